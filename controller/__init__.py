@@ -0,0 +1,22 @@
+# 3 humidifier controller
+#
+#   config   configuration constants
+#   clock    the clock all timekeeping goes through - real on the Pico, virtual for host simulation
+#   logger   console and rotating logfile messages
+#   stats    main loop allocation and GC pause statistics
+#   policy   controller state, capacity model, RH history and humidifier decisions
+#   render   display, LED and the humidifier bars screen
+#   sensor   reading (or faking) the RH on core 1
+#   rh_sensor RH sensor driver interface - dht20, sht3x and bme280 implement it
+#   moisture dew point and absolute humidity from the RH and temperature, in fixed point
+#   snapshot saving and restoring state across a restart
+#   history  the hourly and daily min, mean and max, kept for weeks and drawn by the bars screen
+#   trace    recording the decision inputs for replay on a host
+#   telemetry binary frames of the live state on USB serial, for a host to record
+#   commands settings, refills and the RH history over USB serial, for a host
+#   wifi     joining WiFi for the network features, on a Pico W
+#   mqtt     publishing the readings to an MQTT broker over WiFi, on a Pico W
+#   http_server the state and RH history as JSON over HTTP, on a Pico W
+#   watchdog resetting the Pico if the controller hangs
+#   menu     buttons and menu screens
+#   main     hardware setup and the main loop
@@ -0,0 +1,94 @@
+# 3 humidifier controller - BME280 sensor
+#
+# Forced mode measurements of temperature and humidity (pressure is skipped), each oversampled once.  The humidity
+# compensation needs the temperature, so both are read.  The compensation is the datasheet's integer version.
+# See rh_sensor.py for the interface.
+
+import struct
+from controller.rh_sensor import RHSensor
+
+
+BME280_CHIP_ID = 0x60       # a BMP280 (0x58) has no humidity sensor
+
+
+class BME280(RHSensor):
+    NAME = "BME280"
+    ADDRESSES = (0x76, 0x77)
+    POWER_UP_MS = 2         # 2ms at most
+    CONVERSION_MS = 7       # 1.25ms + 2.3ms per temperature sample + 2.3ms + 0.575ms per humidity sample
+
+    def __init__(self, i2c, address=0x76, ready_deadline_ms=200):
+        super().__init__(i2c, address, ready_deadline_ms)
+        self.calibration = None
+
+    def read_registers(self, register, count):
+        self.i2c.writeto(self.address, bytes([register]))
+        return self.i2c.readfrom(self.address, count)
+
+    def write_register(self, register, value):
+        self.i2c.writeto(self.address, bytes([register, value]))
+
+    def identify(self):
+        return self.read_registers(0xd0, 1)[0] == BME280_CHIP_ID
+
+    # the calibration is fixed in the sensor's NVM, so it is only read once
+    def power_on(self):
+        if self.calibration is None:
+            t1, t2, t3 = struct.unpack("<Hhh", self.read_registers(0x88, 6))
+            h1 = self.read_registers(0xa1, 1)[0]
+            h2, h3, e4, e5, e6, h6 = struct.unpack("<hBBBBb", self.read_registers(0xe1, 7))
+            h4 = (e4 << 4) | (e5 & 0x0f)
+            h5 = (e6 << 4) | (e5 >> 4)
+            # 12 bit signed
+            if h4 & 0x800:
+                h4 = h4 - 0x1000
+            if h5 & 0x800:
+                h5 = h5 - 0x1000
+            self.calibration = (t1, t2, t3, h1, h2, h3, h4, h5, h6)
+
+    def start_measurement(self):
+        self.write_register(0xf2, 0x01)         # ctrl_hum - humidity oversampled x1.  Takes effect on ctrl_meas
+        self.write_register(0xf4, 0x21)         # ctrl_meas - temperature x1, no pressure, forced mode
+        self.measurement_started()
+
+    def is_ready(self):
+        return (self.read_registers(0xf3, 1)[0] & 0x08) == 0
+
+    def read(self):
+        data = self.read_registers(0xfa, 5)
+        adc_t = (data[0] << 12) | (data[1] << 4) | (data[2] >> 4)
+        adc_h = (data[3] << 8) | data[4]
+        self.temperature = compensate_temperature(self.calibration, adc_t) / 100.0
+        return compensate_humidity(self.calibration, adc_t, adc_h)
+
+
+#
+# The datasheet's t_fine - the temperature as the humidity compensation needs it
+#
+def temperature_fine(calibration, adc_t):
+    t1, t2, t3 = calibration[:3]
+    var1 = (((adc_t >> 3) - (t1 << 1)) * t2) >> 11
+    var2 = (((((adc_t >> 4) - t1) * ((adc_t >> 4) - t1)) >> 12) * t3) >> 14
+    return var1 + var2
+
+
+#
+# The temperature in hundredths of a degree C from the raw reading, as the datasheet's bme280_compensate_T_int32()
+#
+def compensate_temperature(calibration, adc_t):
+    return (temperature_fine(calibration, adc_t) * 5 + 128) >> 8
+
+
+#
+# The humidity in % from the raw readings, as the datasheet's bme280_compensate_H_int32()
+#
+def compensate_humidity(calibration, adc_t, adc_h):
+    t1, t2, t3, h1, h2, h3, h4, h5, h6 = calibration
+    t_fine = temperature_fine(calibration, adc_t)
+
+    v = t_fine - 76800
+    v = ((((adc_h << 14) - (h4 << 20) - (h5 * v)) + 16384) >> 15) * \
+        (((((((v * h6) >> 10) * (((v * h3) >> 11) + 32768)) >> 10) + 2097152) * h2 + 8192) >> 14)
+    v = v - (((((v >> 15) * (v >> 15)) >> 7) * h1) >> 4)
+    v = min(max(v, 0), 419430400)
+    return (v >> 12) / 1024.0
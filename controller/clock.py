@@ -0,0 +1,161 @@
+# 3 humidifier controller - clock
+#
+# All of the controller's timekeeping goes through this module rather than the time module, so a host can run
+# it on a virtual clock.  Use it like the time module - clock.time(), clock.ticks_ms(), clock.sleep_ms() and so on.
+# Only the profiling measurements (boot time, GC pauses) use the time module directly, as they measure the real cost.
+#
+#   RealClock       the Pico's clock.  The module functions are the time module's own, so there is no overhead.
+#   VirtualClock    a discrete-event clock for hosts.  Sleeping advances virtual time instantly, running any events
+#                   that come due on the way, so days of controller operation run in seconds - and the same way
+#                   every time.
+#
+# start_task() starts a task that runs every period ms until it returns False: on core 1 with the real clock,
+# and as an event with the virtual clock.
+#
+# lightsleep() sleeps in the low power mode, until the time is up or an interrupt (a button press) wakes it.
+
+import _thread
+import machine
+import time as real_time
+
+
+#
+# The Pico's clock
+#
+class RealClock:
+    def __init__(self):
+        self.time = real_time.time
+        self.ticks_ms = real_time.ticks_ms
+        self.ticks_diff = real_time.ticks_diff
+        self.sleep = real_time.sleep
+        self.sleep_ms = real_time.sleep_ms
+        self.lightsleep = machine.lightsleep
+        self.localtime = real_time.localtime
+
+    def start_task(self, task, period_ms):
+        _thread.start_new_thread(self.run_task, (task, period_ms))
+
+    def run_task(self, task, period_ms):
+        while task():
+            real_time.sleep_ms(period_ms)
+
+
+#
+# A discrete-event virtual clock.  Time only moves when something sleeps (or advance() is called).
+#   start_secs      what time() returns at virtual time 0
+#
+class VirtualClock:
+    def __init__(self, start_secs=0):
+        self.start_secs = start_secs
+        self.now_ms = 0
+        self.events = []            # (due ms, sequence, callback), kept sorted
+        self.event_sequence = 0     # orders events that are due at the same ms
+        self.in_event = False
+        self.lightsleep_ms = 0      # virtual ms spent in lightsleep(), for estimating the power used
+        self.sleeping = False       # set during lightsleep()
+        self.woken = False          # set by wake() to end a lightsleep() early
+
+    def time(self):
+        return self.start_secs + self.now_ms // 1000
+
+    def ticks_ms(self):
+        return self.now_ms
+
+    def ticks_diff(self, end, start):
+        return end - start
+
+    def sleep(self, secs):
+        self.advance(int(secs * 1000))
+
+    def sleep_ms(self, ms):
+        self.advance(ms)
+
+    def lightsleep(self, ms):
+        start_ms = self.now_ms
+        self.sleeping = True
+        self.woken = False
+        try:
+            self.advance(ms)
+        finally:
+            self.sleeping = False
+            self.lightsleep_ms = self.lightsleep_ms + self.now_ms - start_ms
+
+    #
+    # An interrupt - a lightsleep() in progress ends at the current virtual time
+    #
+    def wake(self):
+        if self.sleeping:
+            self.woken = True
+
+    def localtime(self, secs=None):
+        return real_time.localtime(self.time() if secs is None else secs)
+
+    #
+    # Run callback at virtual ms (ticks_ms() time)
+    #
+    def call_at(self, ms, callback):
+        self.event_sequence = self.event_sequence + 1
+        self.events.append((ms, self.event_sequence, callback))
+        self.events.sort()
+
+    def call_after(self, ms, callback):
+        self.call_at(self.now_ms + ms, callback)
+
+    #
+    # Move virtual time forward by ms, running the events that come due in order.  An event that sleeps just moves
+    # time on - events do not interrupt each other, as if the event took no time from the rest of the controller.
+    # An event that wake()s a lightsleep() ends the advance there.
+    #
+    def advance(self, ms):
+        target_ms = self.now_ms + ms
+        if self.in_event:
+            self.now_ms = target_ms
+            return
+        while self.events and self.events[0][0] <= target_ms:
+            due_ms, sequence, callback = self.events.pop(0)
+            if due_ms > self.now_ms:
+                self.now_ms = due_ms
+            self.in_event = True
+            try:
+                callback()
+            finally:
+                self.in_event = False
+            if self.woken:
+                self.woken = False
+                return
+        if target_ms > self.now_ms:
+            self.now_ms = target_ms
+
+    def start_task(self, task, period_ms):
+        def run():
+            if task():
+                self.call_after(period_ms, run)
+        self.call_after(0, run)
+
+
+#
+# Switch the controller to a clock.  Call before starting the controller.
+#
+def use_clock(new_clock):
+    global current
+    global time
+    global ticks_ms
+    global ticks_diff
+    global sleep
+    global sleep_ms
+    global lightsleep
+    global localtime
+    global start_task
+
+    current = new_clock
+    time = new_clock.time
+    ticks_ms = new_clock.ticks_ms
+    ticks_diff = new_clock.ticks_diff
+    sleep = new_clock.sleep
+    sleep_ms = new_clock.sleep_ms
+    lightsleep = new_clock.lightsleep
+    localtime = new_clock.localtime
+    start_task = new_clock.start_task
+
+
+use_clock(RealClock())
@@ -0,0 +1,231 @@
+# 3 humidifier controller - serial commands
+#
+# With COMMANDS_ENABLED, a host can send commands on USB serial, one a line, instead of walking the menu.  The main
+# loop polls for them without waiting, and they change things through the same functions the menu uses.  Each reply
+# is one line starting "ok" or "error", amongst the log messages and any telemetry frames:
+#   get                         ok on_rh=<n> low_rh=<n> rh=<n> trend=<n> humidifying=<activity>
+#                               outlet<i>=<setting>,<energized 0 or 1>,<pct used> ...
+#   set on_rh <n>               set the ON RH, as the menu does - a whole percent from MIN_SETTABLE_RH to
+#   set low_rh <n>              MAX_SETTABLE_RH, with the LOW RH no higher than the ON RH
+#   outlet <i> off|lo|hi        set a humidifier's setting
+#   refill [<i>]                mark one humidifier refilled, or all of them as the menu does
+#   history                     ok history <readings>, then the whole RH history as one binary frame:
+#                                 sync      COMMAND_HISTORY_SYNC
+#                                 length    COMMAND_HISTORY_LENGTH - the payload's length
+#                                 payload   COMMAND_HISTORY_HEADER, then the history as the snapshot holds it -
+#                                           the readings, a humidifying code byte per reading, the dew points and the
+#                                           absolute humidities (see snapshot.py)
+#                                 crc       CRC-8 of the payload
+#
+# The bytes are read one at a time into a line buffer made at setup, so the loop passes with nothing to read do not
+# allocate.  Changes are recorded to the trace (see trace.py) so a replay makes them too.
+
+import select
+import struct
+import sys
+from controller.config import *
+from controller.logger import log_message, log_lock
+from controller import policy
+from controller.rh_sensor import crc8
+from controller import snapshot
+from controller import trace
+
+
+COMMAND_ON_RH   = 0             # apply_command() actions
+COMMAND_LOW_RH  = 1
+COMMAND_SETTING = 2             # value is the index in snapshot.SETTING_CODES
+COMMAND_REFILL  = 3
+REFILL_ALL      = 0xff          # outlet of a refill of every humidifier
+
+COMMAND_HISTORY_SYNC = b"\xa5\x48"
+COMMAND_HISTORY_LENGTH = "<H"
+COMMAND_HISTORY_HEADER = "<HIH"     # readings, clock.time() of the newest, secs between readings
+
+in_stream = None            # USB serial in - None when commands are off or the input has ended
+out_stream = None           # USB serial out
+poll_in = None              # polls in_stream - ipoll, which does not allocate, where there is one
+line = None                 # the command line read so far
+line_length = 0             # bytes in line
+line_too_long = False       # set when the line has gone past COMMAND_LINE_MAX - the rest of it is ignored
+
+
+##############################################################################################################
+################ BEGIN COMMANDS ##############################################################################
+##############################################################################################################
+#
+# Start taking commands, if enabled
+#
+def setup_commands():
+    global in_stream
+    global out_stream
+    global poll_in
+    global line
+
+    if not COMMANDS_ENABLED:
+        return
+    # the host stand-ins run on CPython, whose buffered stdin would keep bytes the poll cannot see
+    in_stream = getattr(sys.stdin.buffer, "raw", sys.stdin.buffer)
+    out_stream = sys.stdout.buffer
+    poller = select.poll()
+    poller.register(in_stream, select.POLLIN)
+    poll_in = getattr(poller, "ipoll", poller.poll)
+    line = bytearray(COMMAND_LINE_MAX)
+
+#
+# Whether there is a byte to read now, without waiting
+#
+def stream_readable():
+    for entry in poll_in(0):
+        return entry[1] & select.POLLIN
+    return False
+
+#
+# Read what the host has sent, up to a line's worth, and carry out any whole commands.  Call from the main loop.
+# Returns True if a command changed a setting.
+#
+def poll_commands():
+    global in_stream
+    global line_length
+    global line_too_long
+
+    changed = False
+    for i in range(COMMAND_LINE_MAX):
+        if in_stream is None or not stream_readable():
+            break
+        byte = in_stream.read(1)
+        if not byte:
+            # the input has ended - only on a host, when stdin is not a port
+            in_stream = None
+            break
+        if byte[0] == 0x0a or byte[0] == 0x0d:
+            if line_too_long:
+                reply("error line longer than %d" % COMMAND_LINE_MAX)
+            elif line_length > 0:
+                words = bytes(line[0:line_length]).decode().split()
+                if words and run_command(words):
+                    changed = True
+            line_length = 0
+            line_too_long = False
+        elif byte[0] < 0x20 or byte[0] > 0x7e:
+            # not a character of a command
+            pass
+        elif line_length < COMMAND_LINE_MAX:
+            line[line_length] = byte[0]
+            line_length = line_length + 1
+        else:
+            line_too_long = True
+    return changed
+
+#
+# Write a reply line
+#
+def reply(text):
+    with log_lock:
+        out_stream.write((text + "\n").encode())
+
+#
+# The humidifier an outlet argument names, or None with an error replied
+#
+def outlet_argument(text):
+    if text.isdigit() and int(text) < len(policy.humidifiers):
+        return int(text)
+    reply("error no outlet %s" % text)
+    return None
+
+#
+# Carry out one command line, split into words.  Returns True if it changed a setting.
+#
+def run_command(words):
+    log_message("command: %s" % " ".join(words))
+    command = words[0]
+    if command == "get" and len(words) == 1:
+        outlets = ""
+        for i in range(len(policy.humidifiers)):
+            humidifier = policy.humidifiers[i]
+            outlets = outlets + " outlet%d=%s,%d,%d" % (i, humidifier.setting, humidifier.energized,
+                                                         min(max(round(policy.units_to_pct(policy.calculate_units_used(humidifier))), 0), 100))
+        reply("ok on_rh=%d low_rh=%d rh=%.2f trend=%d humidifying=%s%s"
+              % (policy.on_rh, policy.low_rh, policy.current_rh, policy.rh_trend, policy.humidifying, outlets))
+        return False
+
+    if command == "set" and len(words) == 3 and words[1] in ("on_rh", "low_rh"):
+        if not words[2].isdigit() or not MIN_SETTABLE_RH <= int(words[2]) <= MAX_SETTABLE_RH:
+            reply("error %s must be a whole %% from %d to %d" % (words[1], MIN_SETTABLE_RH, MAX_SETTABLE_RH))
+            return False
+        rh_value = int(words[2])
+        if words[1] == "on_rh" and rh_value < policy.low_rh or words[1] == "low_rh" and rh_value > policy.on_rh:
+            reply("error low_rh must be no higher than on_rh")
+            return False
+        apply_command(COMMAND_ON_RH if words[1] == "on_rh" else COMMAND_LOW_RH, 0, rh_value)
+        reply("ok")
+        return True
+
+    if command == "outlet" and len(words) == 3:
+        outlet = outlet_argument(words[1])
+        if outlet is None:
+            return False
+        if words[2] not in snapshot.SETTING_CODES:
+            reply("error setting must be off, lo or hi")
+            return False
+        apply_command(COMMAND_SETTING, outlet, snapshot.SETTING_CODES.index(words[2]))
+        reply("ok")
+        return True
+
+    if command == "refill" and len(words) <= 2:
+        outlet = REFILL_ALL
+        if len(words) == 2:
+            outlet = outlet_argument(words[1])
+            if outlet is None:
+                return False
+        apply_command(COMMAND_REFILL, outlet, 0)
+        reply("ok")
+        return True
+
+    if command == "history" and len(words) == 1:
+        reply("ok history %d" % MAX_PREV_RH_READINGS)
+        send_history()
+        return False
+
+    reply("error unknown command - get, set on_rh|low_rh <n>, outlet <i> off|lo|hi, refill [<i>], history")
+    return False
+
+#
+# Make a change a command asked for, through the functions the menu uses
+#   action      COMMAND_ON_RH, COMMAND_LOW_RH, COMMAND_SETTING or COMMAND_REFILL
+#   outlet      the humidifier, for a setting or refill - REFILL_ALL refills them all
+#   value       the RH, or the setting's index in snapshot.SETTING_CODES
+#
+def apply_command(action, outlet, value):
+    trace.record_command(action, outlet, value)
+    if action == COMMAND_ON_RH:
+        policy.set_rh_threshold("on", value)
+    elif action == COMMAND_LOW_RH:
+        policy.set_rh_threshold("low", value)
+    elif action == COMMAND_SETTING:
+        policy.humidifier_setting(policy.humidifiers[outlet], snapshot.SETTING_CODES[value])
+    elif action == COMMAND_REFILL:
+        for i in range(len(policy.humidifiers)):
+            if outlet == REFILL_ALL or outlet == i:
+                policy.humidifier_refilled(policy.humidifiers[i])
+
+#
+# Send the RH history as one binary frame
+#
+def send_history():
+    payload = bytearray(struct.pack(COMMAND_HISTORY_HEADER, MAX_PREV_RH_READINGS, policy.current_rh_time, RH_UPDATE_SECS))
+    payload.extend(policy.prev_rh_readings)
+    codes = bytearray(MAX_PREV_RH_READINGS)
+    for i in range(MAX_PREV_RH_READINGS):
+        codes[i] = snapshot.HUMIDIFYING_CODES.index(policy.prev_rh_humidifying[i])
+    payload.extend(codes)
+    payload.extend(policy.prev_dew_points)
+    payload.extend(policy.prev_absolute_humidities)
+    with log_lock:
+        out_stream.write(COMMAND_HISTORY_SYNC)
+        out_stream.write(struct.pack(COMMAND_HISTORY_LENGTH, len(payload)))
+        out_stream.write(payload)
+        out_stream.write(bytes([ crc8(payload) ]))
+#
+##############################################################################################################
+################# END COMMANDS ###############################################################################
+##############################################################################################################
@@ -0,0 +1,344 @@
+# 3 humidifier controller - configuration constants
+#
+# Everything that can be tuned lives here.  Nothing in this module touches the hardware,
+# so it can be imported on a host as well as on the Pico.
+
+###############################################################################
+# Constants
+#
+VERSION = "1.0.8"
+
+
+# Overall settings
+#
+BAR_DISPLAY_SECS = 5      # How often to refresh the bar display screen
+RH_UPDATE_SECS   = 300    # How often to read the sensor to update relative humidity (RH)
+TICK_INTERVAL    = 36     # How often to draw ticks (longer bars) on RH plot.  Interval of 36 ticks with 300 second updates means a tick every 3 hours of data
+AUTOMATE_SECS    = 5      # How often to check whether the automation settings (relays) need updating
+LOOP_SLEEP_MS    = 100    # How long the main loop pauses between passes
+
+OFF_HB_MS        = 2000   # How often to blink the heartbeat circle in the upper left corner when off
+LIGHT_HB_MS      = 1000   # How often to blink the heartbeat circle in the upper left corner when light humidifying
+HEAVY_HB_MS      =  500   # How often to blink the heartbeat circle in the upper left corner when heavy humidifying
+
+DEFAULT_ON_RH    = 56.0   # Turn on one low humidifier if RH drops below the ON threshold (default setting)
+DEFAULT_LOW_RH   = 50.0   # Turn on all humidifiers if RH drops below the LOW threshold (default setting)
+SWITCH_PCT       = 10.0   # When running a single lo humidifier, swtich if another is available with at least this pct more capacity left
+
+WARN_PCT         = 30.0   # When a humidifier is this % or less full, show its bar yellow.  If on low and one is available, switch to another lo humidifier
+ERROR_PCT        = 10.0   # When a humidifier is this % or less full, show its bar red.
+
+LOGFILE_BASENAME      = "humidifier.log"
+MAX_LOGFILE_LINES     = 2000
+LOGFILE_GENERATIONS   = 3
+LOG_TO_CONSOLE        = True   # Also print log messages - turn off to keep a long host simulation quiet
+
+TRACE_ENABLED         = False  # Record the RH readings, button presses and decisions to a trace file per logfile, for host/replay.py
+TRACE_BASENAME        = "trace.bin"
+TRACE_BUFFER_RECORDS  = 32     # How many trace records to hold in RAM before writing them to the trace file
+
+TELEMETRY_ENABLED     = False  # Send binary frames of the live state on USB serial, for host/telemetry_collector.py - keeps the Pico out of lightsleep
+TELEMETRY_SECS        = 5      # How often to send a telemetry frame
+
+COMMANDS_ENABLED      = False  # Take commands from a host on USB serial, for host/serial_command.py - see controller/commands.py - keeps the Pico out of lightsleep
+COMMAND_LINE_MAX      = 64     # Longest command line - longer ones are ignored
+
+# Display framebuffer pen type.  The UI only uses the handful of pens created in DISPLAY SETUP, so a palette mode
+# holds every colour it draws while using far less RAM than RGB565:
+#   "RGB565" - 16 bits per pixel, 64800 bytes for the 240x135 display
+#   "P8"     -  8 bits per pixel, 32400 bytes, palette of up to 256 pens
+#   "P4"     -  4 bits per pixel, 16200 bytes, palette of up to 16 pens
+DISPLAY_PEN_TYPE = "P4"
+PALETTE_SIZES = { "P4" : 16, "P8" : 256 }
+
+# RAM freed by a palette pen type goes to a longer RH history and a buffered logfile
+RH_HISTORY_SCREENS   = 1 if DISPLAY_PEN_TYPE == "RGB565" else 3   # How many display widths of RH readings to keep (graph shows the newest width)
+LOG_BUFFER_LINES     = 1 if DISPLAY_PEN_TYPE == "RGB565" else 20  # How many log lines to hold in RAM before writing them to the logfile
+# A reset that skips the crash handler's flush - the watchdog, or a power cut - loses the lines still held, so they are
+# also written once the oldest has waited this long
+LOG_FLUSH_SECS       = 30
+
+# Older readings are kept downsampled, as the min, mean and max of each hour and each day - X and Y on the bars screen
+# zoom the graph out to them and back (see controller/history.py)
+HOURLY_HISTORY_HOURS = 7 * 24   # How many hours of hourly aggregates to keep - the 7 day graph
+DAILY_HISTORY_DAYS   = 30       # How many days of daily aggregates to keep - the 30 day graph
+
+RH_TREND_READINGS     = 12    # The RH rate is the slope of a least squares line through this many of the newest readings
+RH_TREND_MIN_READINGS = 3     # Readings needed before there is a rate - until then the trend is even
+RH_TREND_EVEN_RATE    = 0.35  # The trend arrow shows rising or falling once the rate is more than this, in %RH an hour
+
+LED_TRACK_SENSOR = False  # When true, light leds to track sensor interactions
+
+# Set to fake RH.  To see humidifier use run faster than reality, run the controller on a host - see host/simulate.py
+FAKE_RH = False
+if FAKE_RH:
+    RH_UPDATE_SECS = 2
+
+
+# Main bar screen settings
+#
+HI_X_MIN = [   7,  84, 161 ]                     # coordinates of the humidifier bars
+HI_X_MAX = [  79, 156, 233 ]                     # coordinates of the humidifier bars
+LO_X_MIN = [  31, 108, 185 ]                     # coordinates of the humidifier bars
+LO_X_MAX = [  55, 132, 209 ]                     # coordinates of the humidifier bars
+
+LIGHTNING_POLYGON = [ [  4,  0 ],                # polygon making lightning bolt
+                      [ 10,  0 ],                # ... continued ...
+                      [  6,  6 ],                # ... continued ...
+                      [  9,  6 ],                # ... continued ...
+                      [  0, 20 ],                # ... continued ...
+                      [  4, 10 ],                # ... continued ...
+                      [  1, 10 ] ]               # ... end of polygon
+LIGHTNING_POLYGON_HEIGHT = 20                    # lightning bolt height in pixels
+
+HEARTBEAT_CIRCLE_SIZE = 5                        # diameter for heartbeat circle
+HEARTBEAT_X = int(HEARTBEAT_CIRCLE_SIZE / 2) + 1 # X coordinate of center of heartbeat circle
+HEARTBEAT_Y = int(HEARTBEAT_CIRCLE_SIZE / 2) + 1 # Y coordinate of center of heartbeat circle
+
+MIN_RH_PLOT_PCT = 45                             # Min RH of background line graph behind displayed RH value
+MAX_RH_PLOT_PCT = 75                             # Max RH of background line graph behind displayed RH value
+MIN_DEW_POINT_PLOT_C = 0                         # Min dew point of the line graph when it shows the dew point
+MAX_DEW_POINT_PLOT_C = 20                        # Max dew point of the line graph when it shows the dew point
+MIN_ABSOLUTE_PLOT_G  = 4                         # Min absolute humidity (g/m3) of the line graph when it shows it
+MAX_ABSOLUTE_PLOT_G  = 16                        # Max absolute humidity (g/m3) of the line graph when it shows it
+RH_SCALE        = 1.5                            # Scaling factor for text displaying RH value
+REMAIN_SCALE    = 0.75                           # Scaling factor for pct remaining for each humidifier
+
+MAX_SECONDS_AT_HI      = 11 * 60 * 60 + 45 * 60  # 11h 45m
+MAX_SECONDS_AT_LO      = 23 * 60 * 60 + 45 * 60  # 23h 45m
+
+# Tank capacity is tracked in integer units so the steady state loop never does float math (floats allocate on the heap).
+# A full tank is TANK_UNITS, chosen so that a second at HI and a second at LO are each a whole number of units.
+def gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return a
+TANK_UNITS             = MAX_SECONDS_AT_HI * MAX_SECONDS_AT_LO // gcd(MAX_SECONDS_AT_HI, MAX_SECONDS_AT_LO)
+HI_UNITS_PER_SECOND    = TANK_UNITS // MAX_SECONDS_AT_HI    # Units of tank used per second at HI
+LO_UNITS_PER_SECOND    = TANK_UNITS // MAX_SECONDS_AT_LO    # Units of tank used per second at LO
+WARN_UNITS_AVAILABLE   = int(TANK_UNITS * WARN_PCT / 100.0)              # WARN_PCT of the tank in units
+ERROR_UNITS_AVAILABLE  = int(TANK_UNITS * ERROR_PCT / 100.0)             # ERROR_PCT of the tank in units
+ERROR_UNITS_USED       = TANK_UNITS - ERROR_UNITS_AVAILABLE              # Units used at which a humidifier is at ERROR_PCT
+SWITCH_UNITS           = int(TANK_UNITS * SWITCH_PCT / 100.0)            # SWITCH_PCT of the tank in units
+CAPACITY_THRESHOLDS    = ( TANK_UNITS - WARN_UNITS_AVAILABLE,            # Units used at which bar colour or switching decisions change,
+                           ERROR_UNITS_USED,                             #   in increasing order
+                           TANK_UNITS )
+NO_THRESHOLD_TIME      = -1                                              # next_threshold_time when no threshold will be crossed
+
+UP_ARROW_LINES =   [ [ 5,  0,  8,  0 ],          # Line description for RH trending UP line
+                     [ 8,  0,  9,  3 ],          # Line description for RH trending UP line
+                     [ 8,  0,  0, 20 ] ]         # Line description for RH trending UP line
+DOWN_ARROW_LINES = [ [ 5, 20,  8, 20 ],          # Line description for RH trending DOWN line
+                     [ 8, 20,  9, 17 ],          # Line description for RH trending DOWN line
+                     [ 8, 20,  0,  0 ] ]         # Line description for RH trending DOWN line
+EVEN_ARROW_LINES = [ [ 5,  7,  8, 10 ],          # Line description for RH trending EVEN line
+                     [ 5, 13,  8, 10 ],          # Line description for RH trending EVEN line
+                     [ 0, 10,  8, 10 ] ]         # Line description for RH trending EVEN line
+ARROW_HEIGHT = 20                                # Height of RH trend arrow
+
+
+
+# For Menu screens settings
+#
+MENU_ENTRY_RECTS = [ { "x_min" : 30, "x_max" : 210, "y_min" :  4, "y_max":  44 },  # Coordinates of the menu entry text fields
+                     { "x_min" : 30, "x_max" : 210, "y_min" : 48, "y_max":  88 },  # Coordinates of the menu entry text fields
+                     { "x_min" : 30, "x_max" : 210, "y_min" : 92, "y_max": 132 } ] # Coordinates of the menu entry text fields
+
+MENU_TEXT_SCALE = 0.75                     # Scale factor for menu text
+NUMBER_SCALE    = 2.0                      # Scale factor for showing number in menu (when setting RH thresholds)
+VERSION_SCALE   = 1.5                      # Scale factor for showing version in menu
+
+HUMIDIFIER_MENU = [ { "text" : "OFF",  "action" : "humidifier_off" },           # Humidifier setting sub-menu entries
+                    { "text" : "LO",   "action" : "humidifier_lo" },            #   ...
+                    { "text" : "HI",   "action" : "humidifier_hi" } ]           #   ...
+
+SETTINGS_MENU = [ { "text": "ON RH%",  "action" : "show_settings_menu_on" },    # Humidifier settings sub-menu entries
+                  { "text": "LOW RH%", "action" : "show_settings_menu_low" } ]  #   ...
+
+TOP_MENU = [ { "text" : "Refill",       "action" : "humidifiers_refilled" },    # Top level menu entries
+             { "text" : "Humidifier 1", "action" : "show_humidifier_menu_1" },  #   ...
+             { "text" : "Humidifier 2", "action" : "show_humidifier_menu_2" },  #   ...
+             { "text" : "Humidifier 3", "action" : "show_humidifier_menu_3" },  #   ...
+             { "text" : "RH Settings",  "action" : "show_settings_menu" },      #   ...
+             { "text" : "Version",      "action" : "show_version" } ]           #   ...
+
+MENU_IDLE_SECS_EXIT = 5          # Seconds of no button press at which to automatically exit menu screens
+MIN_SETTABLE_RH     = 10         # Lowest the ON and LOW RH can be set to, from the menu or a serial command
+MAX_SETTABLE_RH     = 95         # Highest the ON and LOW RH can be set to, from the menu or a serial command
+DEBOUNCE_MS         = 150        # min ms between button presses to debounce switch noise
+
+
+DEBOUNCE_RH_AMOUNT = 0.5         # Debounce RH settings.  When crossing a RH threshold, must pass it by this much before considered crossing
+RH_SAMPLES_PER_READ = 5          # Read the sensor this many times and average for each RH reading
+ACQUISITION_PERIOD_MS = 1000     # How often the sensor acquisition task on core 1 checks whether a reading is due
+ACQUISITION_STALL_MS = 10000     # Restart if the sensor acquisition task on core 1 shows no progress for this long
+
+
+# Sensor fault settings
+#   A failed sample is retried SENSOR_READ_RETRIES times, recovering the I2C bus and backing off between attempts.
+#   If they all fail the reading fails, and the acquisition task tries again after SENSOR_FAILED_RETRY_SECS.
+#   The last good RH is used until it is RH_STALE_SECS old - then FAILSAFE_HUMIDIFYING applies until a reading succeeds.
+#
+I2C_TIMEOUT_US              = 50000   # Timeout of each I2C transaction - a stuck bus fails the transaction rather than hanging
+SENSOR_READY_DEADLINE_MS    = 200     # Fail a measurement still not ready this long after it was started (a DHT20 takes 80ms)
+SENSOR_READ_RETRIES         = 4       # Attempts at each sample before the reading fails
+SENSOR_RETRY_BACKOFF_MS     = 500     # Wait before the first retry, doubling for each retry after that
+SENSOR_RETRY_BACKOFF_MAX_MS = 4000    # Longest wait between retries - keep well below ACQUISITION_STALL_MS
+SENSOR_FAILED_RETRY_SECS    = 30      # After a failed reading, try again this soon rather than after RH_UPDATE_SECS
+RH_STALE_SECS               = 3 * RH_UPDATE_SECS  # The last good RH is stale once it is this old
+FAILSAFE_HUMIDIFYING        = "off"   # Humidifying while the RH is stale - "off" risks too dry, "light" risks too damp
+
+
+# Multiple sensor settings
+#   Several sensors of one kind can share the bus behind a TCA9548A I2C multiplexer, one per mux channel.  Each
+#   sample triggers every sensor back to back, waits one conversion, then collects them all, and combines the RHs of
+#   the sensors that answered with SENSOR_FUSION:
+#     "mean"      the average
+#     "min"       the lowest - humidify until the driest spot is in range
+#     "weighted"  the average weighted by SENSOR_WEIGHTS, e.g. to favour a sensor away from the humidifiers
+#   SENSOR_WEIGHTS needs one weight of 0 or more for each sensor, at least one above 0.  An unknown SENSOR_FUSION, or
+#   SENSOR_WEIGHTS that do not fit, are logged at boot and "mean" is used instead.
+#   A sample fails only if every sensor fails.  With SENSOR_MUX_CHANNELS empty there is one sensor straight on the bus.
+#
+SENSOR_MUX_ADDRESS         = 0x70     # I2C address of the multiplexer
+SENSOR_MUX_CHANNELS        = []       # Mux channel of each sensor, e.g. [ 0, 1, 2 ] - empty for a single sensor without a mux
+SENSOR_FUSION              = "mean"   # How to combine the sensors' RHs - "mean", "min" or "weighted"
+SENSOR_WEIGHTS             = []       # Weight of each sensor for "weighted", in SENSOR_MUX_CHANNELS order
+SENSOR_UNHEALTHY_FAILURES  = 3        # A sensor that fails this many samples in a row is reported as unhealthy
+
+
+# Relay scheduler settings
+#   Limit how often each outlet's relay switches, sparing the warm-mist humidifiers' heaters from short cycles.
+#   A switch the limits do not allow yet is deferred until they do, and dropped if it is no longer wanted by then.
+#   A humidifier set to OFF in the menu always goes off straight away.
+#
+MIN_ON_SECS               = 300     # Once energized, an outlet stays energized at least this long
+MIN_OFF_SECS              = 300     # Once de-energized, an outlet stays de-energized at least this long
+MAX_RELAY_STARTS_PER_HOUR = 3       # Most times one outlet is energized in any hour - at least 1.  Never delays de-energizing
+NO_SWITCH_TIME            = -1      # Switch time of a relay that has not switched
+
+
+# Duty cycle settings
+#   CONTROL_MODE "bang" runs the light humidifier all the time while light humidifying, until the RH rises past the
+#   ON threshold.  "duty" runs it for part of each DUTY_WINDOW_SECS instead, the part set by a PI controller on how far
+#   the RH is below a target inside the band, so the RH settles at the target rather than swinging up past ON RH.
+#   The on and off parts keep to MIN_ON_SECS and MIN_OFF_SECS.  Heavy humidifying is the same in either mode.
+#
+CONTROL_MODE          = "bang"    # "bang" or "duty"
+DUTY_WINDOW_SECS      = 1800      # Length of each duty cycle window - at least MIN_ON_SECS + MIN_OFF_SECS
+DUTY_TARGET_FRACTION  = 0.75      # Target RH, as the fraction of the way from the LOW threshold up to the ON threshold
+DUTY_KP               = 0.15      # Duty cycle per %RH below the target
+DUTY_KI               = 0.00003   # Duty cycle per %RH below the target, per second it has been below
+
+
+# Predictive settings
+#   The controller learns how fast the RH moves with each humidifying activity - falling with everything off, rising
+#   with light or heavy humidifying - from its own readings, each new rate weighted by RH_SLOPE_FORGETTING so the old
+#   ones fade as the season changes.  From the current activity's rate it projects when the RH will cross the next
+#   threshold and switches up to PREDICT_ENERGIZE_SECS early when the RH is falling (set it to about how long the
+#   humidifiers take to start steaming) or PREDICT_RELEASE_SECS early when it is rising (the RH keeps climbing a while
+#   once they are off).  Releasing early narrows the RH's swing at the cost of more relay switches.
+#   An early switch is never more than PREDICT_MAX_RH short of the threshold, so some of the debounce is always kept.
+#   The projection is drawn, dotted, to the right of the RH history.
+#
+PREDICTIVE_ENABLED      = True
+RH_SLOPE_FORGETTING     = 0.1                     # Weight of each new rate - older ones fade by 1 minus this a reading
+RH_SLOPE_MIN_SAMPLES    = 5                       # Rates measured before an activity's rate is used
+PREDICT_ENERGIZE_SECS   = 0                       # Most an energizing switch (off to light, light to heavy) is brought forward - 0 for humidifiers that steam at once
+PREDICT_RELEASE_SECS    = 300                     # Most a releasing switch (light to off, heavy to light) is brought forward
+PREDICT_MAX_RH          = DEBOUNCE_RH_AMOUNT / 2  # Most an early switch is short of the threshold, in %RH
+RH_PROJECTION_PIXELS    = 24                      # Pixels of the RH history graph given to the projection, one per reading
+
+
+# Low power settings
+#   With nothing due for a while, the main loop lightsleeps (machine.lightsleep) until it is, rather than waking every
+#   LOOP_SLEEP_MS - a button press wakes it.  Lightsleep stops USB, so set LOW_POWER_ENABLED to False to use the REPL.
+#   It is not used while TELEMETRY_ENABLED or COMMANDS_ENABLED want USB serial, or MQTT_ENABLED or HTTP_ENABLED the
+#   network.
+#   The backlight dims after BACKLIGHT_DIM_SECS without a button press, and the heartbeat stops until a press brings
+#   it back, saving the screen updates.
+#
+LOW_POWER_ENABLED        = True
+IDLE_SLEEP_MAX_MS        = 4000    # Longest lightsleep - the watchdog is fed before it, so keep below WDT_TIMEOUT_MS
+BACKLIGHT_BRIGHTNESS     = 1.0     # Backlight brightness while in use, 0.0 to 1.0
+BACKLIGHT_DIM_BRIGHTNESS = 0.1     # Backlight brightness once dimmed - 0.0 turns it off
+BACKLIGHT_DIM_SECS       = 300     # Dim the backlight after this long without a button press
+
+
+# WiFi settings (Pico W)
+#   Joined for MQTT and the HTTP status server, if either is enabled - see controller/wifi.py
+#
+WIFI_SSID             = ""
+WIFI_PASSWORD         = ""
+WIFI_RETRY_SECS       = 30         # Ask a WLAN that has dropped or given up to join again this often
+
+
+# MQTT settings (Pico W)
+#   Publishes the readings to an MQTT broker over WiFi - see controller/mqtt.py.  Give the broker as an IP address:
+#   looking up a name waits on DNS at each connection attempt.  Like telemetry, MQTT keeps the Pico out of lightsleep.
+#
+MQTT_ENABLED          = False
+MQTT_BROKER           = "192.168.1.2"
+MQTT_PORT             = 1883
+MQTT_USER             = ""         # "" to connect without a user name and password
+MQTT_PASSWORD         = ""
+MQTT_CLIENT_ID        = "humidifier"
+MQTT_TOPIC            = "humidifier/readings"
+MQTT_BATCH_READINGS   = 4          # Readings in each publish
+MQTT_QUEUE_READINGS   = 288        # Readings held while the broker cannot be reached (a day) - the oldest are dropped beyond this
+MQTT_KEEPALIVE_SECS   = 60         # Ping the broker this often - one that does not answer in half as long again is taken to be gone
+MQTT_RETRY_SECS       = 30         # After losing WiFi or the broker, try again this often
+MQTT_CONNECT_SECS     = 10         # Give up on a connection the broker has not accepted in this long
+
+
+# HTTP settings (Pico W)
+#   Serves /status and /history as JSON on the local network - see controller/http_server.py.  Like MQTT, the server
+#   keeps the Pico out of lightsleep.
+#
+HTTP_ENABLED          = False
+HTTP_PORT             = 80
+HTTP_REQUEST_MAX      = 512        # Longest request taken, headers and all - a longer one is answered 400
+HTTP_CLIENT_SECS      = 5          # Drop a client that has not sent its request and taken the reply in this long
+
+
+# Boot settings
+#
+SNAPSHOT_FILENAME = "snapshot.bin"  # Last known RH, history and humidifier state, restored at boot
+HISTORY_FILENAME  = "history.bin"   # The hourly and daily history, saved each time an hour is up and restored at boot
+BOOT_RH_SAMPLES   = 1               # Samples in the quick RH reading taken at boot, before the first relay decision
+BOOT_RH_RETRIES   = 1               # Attempts at the quick reading - no retries, so a missing sensor does not hold up the boot
+
+# Watchdog settings
+#   The watchdog resets the Pico if the main loop stops making progress.  Once started it cannot be stopped,
+#   so a Ctrl-C at the REPL is followed by a reset - set WATCHDOG_ENABLED to False while developing.
+#
+WATCHDOG_ENABLED    = True
+WDT_TIMEOUT_MS      = 8000           # Reset if not fed for this long (the RP2040 maximum is 8388)
+CRASH_LOG_FILENAME  = "crash.log"    # Tracebacks of crashes, appended to before the crash reset (the logfile is rewritten at boot)
+CRASH_LOG_MAX_BYTES = 8192          # Start the crash log again once it is this big, so a crash loop cannot fill the flash
+
+
+# Display settings
+#
+DISPLAY_WIDTH  = 240             # Pico Display Pack width in pixels
+DISPLAY_HEIGHT = 135             # Pico Display Pack height in pixels
+
+# Keep one historical RH reading for each pixel of display width, times the number of screens of history
+MAX_PREV_RH_READINGS = DISPLAY_WIDTH * RH_HISTORY_SCREENS
+
+
+# Memory settings
+#
+LOOP_STATS_SECS = 3600           # How often to log main loop allocation and GC pause statistics
+
+
+# Pico settings
+#
+OUTLET_PIN_NUMBERS = [ 3, 4, 5 ]     # GPIO pins of the outlet (relay) controls
+SDA_PIN_NUMBER = 0                   # GPIO pin for sensor SDA (data)
+SCL_PIN_NUMBER = 1                   # GPIO pin for sensor SCL (clock)
+HMIDITY_SENSOR_POWER_PIN_NUMBER = 2  # GPIO pin for sensor power
+SENSOR_TYPE = "auto"                 # RH sensor - "auto" to find it with an I2C scan at the first reading, or "DHT20", "SHT3x" or "BME280"
+
+#
+###############################################################################
@@ -0,0 +1,65 @@
+# 3 humidifier controller - DHT20 sensor
+#
+# Triggered measurements, polling the status byte's busy bit until the result is ready.  See rh_sensor.py for the
+# interface.
+
+import errno
+from controller import clock
+from controller.rh_sensor import RHSensor, crc8
+
+
+class DHT20(RHSensor):
+    NAME = "DHT20"
+    ADDRESSES = (0x38,)
+    POWER_UP_MS = 500       # the datasheet asks for 100ms
+    CONVERSION_MS = 80
+
+    def __init__(self, i2c, address=0x38, ready_deadline_ms=200):
+        super().__init__(i2c, address, ready_deadline_ms)
+
+    def power_on(self):
+        if (self.dht20_read_status() & 0x80) == 0x80:
+            self.dht20_init()
+
+    def start_measurement(self):
+        self.i2c.writeto(self.address, bytes([0xac,0x33,0x00]))
+        self.measurement_started()
+
+    def is_ready(self):
+        return (self.dht20_read_status() & 0x80) == 0
+
+    def read(self):
+        data = self.read_data()
+        self.temperature = self.temperature_from(data)
+        return self.humidity_from(data)
+
+    def read_data(self):
+        data = self.i2c.readfrom(self.address, 7, True)
+        n = []
+        for i in data[:]:
+            n.append(i)
+        if self.calc_crc8(n) & 0xff != n[6]:
+            raise OSError(errno.EIO)
+        return n
+
+    def dht20_read_status(self):
+        data = self.i2c.readfrom(self.address, 1, True)
+        return data[0]
+
+    def dht20_init(self):
+        self.i2c.writeto(self.address, bytes([0xa8,0x00,0x00]))
+        clock.sleep_ms(10)
+        self.i2c.writeto(self.address, bytes([0xbe,0x08,0x00]))
+
+    def calc_crc8(self,data):
+        return crc8(data[:-1])
+
+    # 20 bits of temperature, in the low nibble of byte 3 and bytes 4 and 5
+    def temperature_from(self, data):
+        temperature = ((data[3] << 16) | (data[4] << 8) | data[5]) & 0xfffff
+        return temperature * 200 / 1024 / 1024 - 50
+
+    # 20 bits of humidity, in bytes 1 and 2 and the high nibble of byte 3
+    def humidity_from(self, data):
+        humidity = ((data[1] << 16) | (data[2] << 8) | data[3]) >> 4
+        return humidity * 100 / 1024 / 1024
@@ -0,0 +1,199 @@
+# 3 humidifier controller - long history
+#
+# policy.prev_rh_readings holds every reading, but only the newest MAX_PREV_RH_READINGS of them.  Here the readings
+# are also kept downsampled, for longer, in two tiers: hourly for HOURLY_HISTORY_HOURS and daily for
+# DAILY_HISTORY_DAYS.  Each entry of a tier is the min, mean and max of the RH, dew point and absolute humidity over
+# its period.  A reading goes straight into the newest entry of both tiers - a running min and max, and a sum and
+# count for the mean - so nothing ever goes back over the readings, and once its period is up a tier moves along by
+# one.  The bars screen's 7 day and 30 day graphs are drawn straight from the tiers (see render.py).
+#
+# The tiers are saved to HISTORY_FILENAME each time an hour is up, and by the crash handler, and restored at boot.
+# As in the snapshot, the newest period's start is kept as an age, so the history carries on across a restart as
+# though the Pico had not been off.
+#
+# Layout (little endian):
+#   header      HISTORY_HEADER - magic, number of tiers
+#   per tier    HISTORY_TIER - entries, period secs, secs since the newest period started (NO_PERIOD_AGE before the
+#               first reading), readings in the newest period
+#               HISTORY_SUMS - the newest period's sums, one per quantity
+#               then for each quantity, in HISTORY_QUANTITIES order, the mins, means and maxes arrays, oldest first
+
+import os
+import struct
+from array import array
+from controller.config import *
+from controller import clock
+from controller.logger import log_message
+from controller import policy
+from controller import snapshot
+
+
+HISTORY_MAGIC = b"HIS1"
+HISTORY_HEADER = "<4sB"
+HISTORY_TIER = "<HIIH"
+HISTORY_SUMS = "<iii"
+NO_PERIOD_AGE = 0xffffffff                                   # newest period age of a tier with no readings yet
+HISTORY_QUANTITIES = ( "rh", "dew_point", "absolute_humidity" )   # in hundredths, as policy has them
+
+NO_PERIOD_TIME = -1         # start_time of a tier with no readings yet
+
+
+#
+# One tier of the history - entries periods of period_secs, oldest first.  A period with no readings (the sensor was
+# out) has a mean RH of 0.
+#   entries     How many periods are kept
+#   period_secs How long each period is
+#   start_time  Time the newest period started, or NO_PERIOD_TIME before the first reading
+#   count       Readings in the newest period so far
+#   sums        The newest period's sum of each quantity, for its mean
+#   mins        The min of each quantity over each period - an array per quantity, in HISTORY_QUANTITIES order
+#   means       The mean of each quantity over each period
+#   maxes       The max of each quantity over each period
+class Tier:
+    __slots__ = ("entries", "period_secs", "start_time", "count", "sums", "mins", "means", "maxes")
+
+    def __init__(self, entries, period_secs):
+        self.entries = entries
+        self.period_secs = period_secs
+        self.start_time = NO_PERIOD_TIME
+        self.count = 0
+        self.sums = [ 0 ] * len(HISTORY_QUANTITIES)
+        self.mins = [ array("h", [ 0 ] * entries) for quantity in HISTORY_QUANTITIES ]
+        self.means = [ array("h", [ 0 ] * entries) for quantity in HISTORY_QUANTITIES ]
+        self.maxes = [ array("h", [ 0 ] * entries) for quantity in HISTORY_QUANTITIES ]
+
+hourly = Tier(HOURLY_HISTORY_HOURS, 3600)
+daily = Tier(DAILY_HISTORY_DAYS, 24 * 3600)
+tiers = [ hourly, daily ]
+
+
+##############################################################################################################
+################# BEGIN HISTORY ##############################################################################
+##############################################################################################################
+#
+# Add the current reading to the newest period of each tier, moving a tier along first if its period is up.  Saves
+# the history each time an hour is up.  Call after each reading has been recorded in policy.prev_rh_readings.
+#
+def record_reading():
+    now = policy.current_rh_time
+    hour_up = False
+    for tier in tiers:
+        if tier.start_time == NO_PERIOD_TIME:
+            tier.start_time = now
+        elif now - tier.start_time >= tier.period_secs:
+            periods = (now - tier.start_time) // tier.period_secs
+            move_along(tier, periods)
+            tier.start_time = tier.start_time + periods * tier.period_secs
+            if tier is hourly:
+                hour_up = True
+        tier.count = tier.count + 1
+        add_value(tier, 0, policy.prev_rh_readings[MAX_PREV_RH_READINGS - 1])
+        add_value(tier, 1, policy.current_dew_point)
+        add_value(tier, 2, policy.current_absolute_humidity)
+    if hour_up:
+        save_history()
+
+#
+# Fold a value into the newest period's min, mean and max of a quantity - tier.count already counts it
+#
+def add_value(tier, quantity, value):
+    newest = tier.entries - 1
+    if tier.count == 1 or value < tier.mins[quantity][newest]:
+        tier.mins[quantity][newest] = value
+    if tier.count == 1 or value > tier.maxes[quantity][newest]:
+        tier.maxes[quantity][newest] = value
+    tier.sums[quantity] = tier.sums[quantity] + value
+    tier.means[quantity][newest] = (tier.sums[quantity] + tier.count // 2) // tier.count
+
+#
+# Move a tier's entries along by periods, dropping the oldest, and start an empty newest period.  The periods
+# between, with no readings, are left empty.
+#
+def move_along(tier, periods):
+    periods = min(periods, tier.entries)
+    for quantity in range(len(HISTORY_QUANTITIES)):
+        for series in (tier.mins[quantity], tier.means[quantity], tier.maxes[quantity]):
+            for i in range(tier.entries - periods):
+                series[i] = series[i + periods]
+            for i in range(tier.entries - periods, tier.entries):
+                series[i] = 0
+        tier.sums[quantity] = 0
+    tier.count = 0
+
+#
+# The history, as bytes
+#
+def history_data():
+    now = clock.time()
+    data = bytearray(struct.pack(HISTORY_HEADER, HISTORY_MAGIC, len(tiers)))
+    for tier in tiers:
+        data.extend(struct.pack(HISTORY_TIER, tier.entries, tier.period_secs,
+                                now - tier.start_time if tier.start_time != NO_PERIOD_TIME else NO_PERIOD_AGE, tier.count))
+        data.extend(struct.pack(HISTORY_SUMS, *tier.sums))
+        for quantity in range(len(HISTORY_QUANTITIES)):
+            data.extend(tier.mins[quantity])
+            data.extend(tier.means[quantity])
+            data.extend(tier.maxes[quantity])
+    return data
+
+#
+# Write the history - to a temporary file renamed over the old one, like the snapshot
+#
+def save_history():
+    tmp_filename = HISTORY_FILENAME + ".tmp"
+    with open(tmp_filename, "wb") as f:
+        f.write(history_data())
+    os.rename(tmp_filename, HISTORY_FILENAME)
+
+#
+# Restore the history, if there is one.  A tier whose period has changed is left empty; one with fewer or more
+# entries than before keeps the newest that fit.
+#
+def restore_history():
+    try:
+        with open(HISTORY_FILENAME, "rb") as f:
+            data = f.read()
+    except OSError:
+        log_message("No history to restore")
+        return
+
+    try:
+        magic, tier_count = struct.unpack_from(HISTORY_HEADER, data, 0)
+        if magic != HISTORY_MAGIC or tier_count != len(tiers):
+            log_message("History does not match this controller, ignoring it")
+            return
+        offset = struct.calcsize(HISTORY_HEADER)
+        for tier in tiers:
+            entries, period_secs, age, count = struct.unpack_from(HISTORY_TIER, data, offset)
+            offset = offset + struct.calcsize(HISTORY_TIER)
+            sums = struct.unpack_from(HISTORY_SUMS, data, offset)
+            offset = offset + struct.calcsize(HISTORY_SUMS)
+            size = entries * 2
+            if period_secs == tier.period_secs and age != NO_PERIOD_AGE:
+                tier.start_time = clock.time() - age
+                tier.count = count
+                kept = min(entries, tier.entries)
+                for quantity in range(len(HISTORY_QUANTITIES)):
+                    tier.sums[quantity] = sums[quantity]
+                    for series, start in ((tier.mins[quantity], offset), (tier.means[quantity], offset + size),
+                                          (tier.maxes[quantity], offset + size * 2)):
+                        saved = array("h", data[start:start + size])
+                        for i in range(kept):
+                            series[tier.entries - kept + i] = saved[entries - kept + i]
+                    offset = offset + size * 3
+            else:
+                offset = offset + size * 3 * len(HISTORY_QUANTITIES)
+    except snapshot.SNAPSHOT_ERRORS as err:
+        log_message("History is damaged, ignoring it: {0}".format(err))
+        # start again rather than keep what was restored before the damage
+        for tier in tiers:
+            move_along(tier, tier.entries)
+            tier.start_time = NO_PERIOD_TIME
+        return
+
+    log_message("Restored history: %d hours and %d days" % (sum(1 for mean in hourly.means[0] if mean),
+                                                             sum(1 for mean in daily.means[0] if mean)))
+#
+##############################################################################################################
+################## END HISTORY ###############################################################################
+##############################################################################################################
@@ -0,0 +1,295 @@
+# 3 humidifier controller - HTTP status server (Pico W)
+#
+# With HTTP_ENABLED, serves the controller's state as JSON on HTTP_PORT, for a browser or a dashboard on the local
+# network:
+#   /status     {"time":..,"rh":..,"temperature":..,"dew_point":..,"absolute_humidity":..,"trend":..,"rate":..,
+#                "humidifying":"light","failsafe":false,"on_rh":..,"low_rh":..,
+#                "outlets":[{"setting":"lo","energized":true,"used_pct":12},..]}
+#   /history    {"newest_time":..,"secs":..,"rh":[..]} - the RH history, oldest first, null before the first reading
+#
+# Each reply is kept whole - status line, headers and JSON - and only made again once what it shows has changed, so
+# a dashboard polling every few seconds costs a compare and a send rather than a JSON serialisation.  For the status,
+# a request packs the state it shows into a small bytearray made at setup and compares it with the one the kept reply
+# was made from; the history changes only with a new reading.
+#
+# The server is stepped by the main loop once a pass with service_http(), on non-blocking sockets, one client at a
+# time: each step accepts a client, reads what it has sent, or hands the socket as much of the kept reply as it will
+# take in one send - never waiting, so a slow or stalled client cannot hold up the relay decisions.  A client that
+# has not sent its request and taken the reply within HTTP_CLIENT_SECS is dropped.
+
+import errno
+import select
+import struct
+from controller.config import *
+from controller import clock
+from controller.logger import log_message
+from controller import policy
+from controller import snapshot
+from controller import wifi
+
+
+STATUS_STATE  = "<IffbBB"   # what the status shows, to tell when it has changed - clock.time() of the reading, ON and
+                            # LOW RH, trend, index in snapshot.HUMIDIFYING_CODES, failsafe
+STATUS_OUTLET = "<BB"       # index in snapshot.SETTING_CODES plus STATUS_ENERGIZED, pct of the tank used
+STATUS_ENERGIZED = 0x80
+STATUS_STATE_SIZE = struct.calcsize(STATUS_STATE) + struct.calcsize(STATUS_OUTLET) * len(OUTLET_PIN_NUMBERS)
+
+
+#
+# A whole reply - the status line, the headers and the body
+#
+def http_response(status, body):
+    return (("HTTP/1.0 %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: close\r\n\r\n"
+             % (status, len(body))).encode() + body)
+
+BAD_REQUEST = http_response("400 Bad Request", b'{"error":"bad request"}\n')
+NOT_FOUND = http_response("404 Not Found", b'{"error":"not found - try /status or /history"}\n')
+METHOD_NOT_ALLOWED = http_response("405 Method Not Allowed", b'{"error":"only GET"}\n')
+
+server = None               # the listening socket - None when the server is off
+poll_server = None          # polls server - ipoll, which does not allocate, where there is one
+client_poller = None
+poll_client = None          # polls client
+client = None               # the client being served, one at a time
+client_time = 0             # clock.time() the client was accepted
+request = b""               # what the client has sent so far
+reply = None                # the reply being sent - None until the request is all in
+reply_sent = 0              # bytes of reply sent
+
+current_state = None        # STATUS_STATE_SIZE bytes - the state now, packed to compare
+status_state = None         # the state status_reply was made from
+status_reply = None         # the kept /status reply
+history_time = -1           # policy.current_rh_time history_reply was made at
+history_reply = None        # the kept /history reply
+
+requests_served = 0         # replies sent whole since boot
+status_rebuilds = 0         # times the /status reply has been made
+history_rebuilds = 0        # times the /history reply has been made
+
+
+##############################################################################################################
+################### BEGIN HTTP ###############################################################################
+##############################################################################################################
+#
+# Start WiFi and listen, if the server is enabled.  Call once the controller's state is set up.
+#
+def setup_http():
+    global server
+    global poll_server
+    global client_poller
+    global poll_client
+    global current_state
+    global status_state
+
+    if not HTTP_ENABLED:
+        return
+    # only a Pico W has the socket module
+    import socket
+    wifi.setup_wifi()
+    current_state = bytearray(STATUS_STATE_SIZE)
+    status_state = bytearray(STATUS_STATE_SIZE)
+    server = socket.socket()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(socket.getaddrinfo("0.0.0.0", HTTP_PORT)[0][-1])
+    server.listen(2)
+    server.setblocking(False)
+    poller = select.poll()
+    poller.register(server, select.POLLIN)
+    # the host stand-ins run on CPython, which only has poll()
+    poll_server = getattr(poller, "ipoll", poller.poll)
+    client_poller = select.poll()
+    poll_client = getattr(client_poller, "ipoll", client_poller.poll)
+    log_message("HTTP: serving /status and /history on port %d" % HTTP_PORT)
+
+#
+# The poll events on a socket now, without waiting
+#   poll    poll_server or poll_client
+#
+def socket_events(poll):
+    for entry in poll(0):
+        return entry[1]
+    return 0
+
+#
+# Pack the state the status shows into current_state, to compare with status_state
+#
+def pack_status_state():
+    struct.pack_into(STATUS_STATE, current_state, 0, policy.current_rh_time, policy.on_rh, policy.low_rh,
+                     policy.rh_trend, snapshot.HUMIDIFYING_CODES.index(policy.humidifying), policy.failsafe)
+    offset = struct.calcsize(STATUS_STATE)
+    for i in range(len(policy.humidifiers)):
+        humidifier = policy.humidifiers[i]
+        setting = snapshot.SETTING_CODES.index(humidifier.setting)
+        if humidifier.energized:
+            setting |= STATUS_ENERGIZED
+        struct.pack_into(STATUS_OUTLET, current_state, offset + i * struct.calcsize(STATUS_OUTLET), setting,
+                         used_pct(humidifier))
+
+#
+# How much of a humidifier's tank is used, in whole percent
+#
+def used_pct(humidifier):
+    return min(max((policy.calculate_units_used(humidifier) * 100 + TANK_UNITS // 2) // TANK_UNITS, 0), 100)
+
+#
+# The JSON the status shows
+#
+def status_json():
+    outlets = []
+    for humidifier in policy.humidifiers:
+        outlets.append('{"setting":"%s","energized":%s,"used_pct":%d}'
+                       % (humidifier.setting, "true" if humidifier.energized else "false", used_pct(humidifier)))
+    return ('{"time":%d,"rh":%.2f,"temperature":%.2f,"dew_point":%.2f,"absolute_humidity":%.2f,"trend":%d,"rate":%.2f,'
+            '"humidifying":"%s","failsafe":%s,"on_rh":%d,"low_rh":%d,"outlets":[%s]}\n'
+            % (policy.current_rh_time, policy.current_rh, policy.current_temperature, policy.current_dew_point / 100,
+               policy.current_absolute_humidity / 100, policy.rh_trend, policy.rh_rate, policy.humidifying,
+               "true" if policy.failsafe else "false", policy.on_rh, policy.low_rh, ",".join(outlets)))
+
+#
+# The JSON of the RH history
+#
+def history_json():
+    readings = []
+    for reading in policy.prev_rh_readings:
+        # placeholders before the first reading are 0
+        readings.append("%.2f" % (reading / 100) if reading else "null")
+    return ('{"newest_time":%d,"secs":%d,"rh":[%s]}\n'
+            % (policy.current_rh_time, RH_UPDATE_SECS, ",".join(readings)))
+
+#
+# The /status reply, made again only if the state it shows has changed
+#
+def status():
+    global status_reply
+    global status_rebuilds
+
+    pack_status_state()
+    if status_reply is None or current_state != status_state:
+        status_state[:] = current_state
+        status_reply = http_response("200 OK", status_json().encode())
+        status_rebuilds = status_rebuilds + 1
+    return status_reply
+
+#
+# The /history reply, made again only after a new reading
+#
+def history():
+    global history_time
+    global history_reply
+    global history_rebuilds
+
+    if history_reply is None or history_time != policy.current_rh_time:
+        history_time = policy.current_rh_time
+        history_reply = http_response("200 OK", history_json().encode())
+        history_rebuilds = history_rebuilds + 1
+    return history_reply
+
+#
+# The reply to a request line's words
+#
+def route(words):
+    if len(words) != 3:
+        return BAD_REQUEST
+    if words[0] != b"GET":
+        return METHOD_NOT_ALLOWED
+    path = words[1].split(b"?")[0]
+    if path == b"/status":
+        return status()
+    if path == b"/history":
+        return history()
+    return NOT_FOUND
+
+#
+# Take the next client waiting to connect
+#
+def accept_client():
+    global client
+    global client_time
+    global request
+    global reply
+    global reply_sent
+
+    client, address = server.accept()
+    client.setblocking(False)
+    client_poller.register(client, select.POLLIN | select.POLLOUT)
+    client_time = clock.time()
+    request = b""
+    reply = None
+    reply_sent = 0
+
+#
+# Close the client's connection - done with it or given up on it
+#
+def close_client():
+    global client
+    global reply
+
+    client_poller.unregister(client)
+    client.close()
+    client = None
+    reply = None
+
+#
+# Read what the client has sent, and once the request is all in choose the reply.  Only the request line counts -
+# the headers are read and ignored.
+#
+def read_request():
+    global request
+    global reply
+
+    data = client.recv(HTTP_REQUEST_MAX - len(request))
+    if not data:
+        # gone before asking for anything
+        close_client()
+        return
+    request = request + data
+    if request.find(b"\r\n\r\n") < 0 and request.find(b"\n\n") < 0:
+        if len(request) >= HTTP_REQUEST_MAX:
+            reply = BAD_REQUEST
+        return
+    reply = route(request[:request.find(b"\n")].split())
+
+#
+# Take one step: accept a client, read its request or send some of the reply, as far as it can go without waiting.
+# Call from the main loop.
+#
+def service_http():
+    global reply_sent
+    global requests_served
+
+    if server is None:
+        return
+    # nothing can reach the server without WiFi - and asking keeps it joined
+    if not wifi.wifi_connected():
+        if client:
+            close_client()
+        return
+    try:
+        if client is None:
+            if socket_events(poll_server) & select.POLLIN:
+                accept_client()
+            return
+        if clock.time() - client_time > HTTP_CLIENT_SECS:
+            log_message("HTTP: dropped a client that took more than %d s" % HTTP_CLIENT_SECS)
+            close_client()
+            return
+        events = socket_events(poll_client)
+        if events & (select.POLLERR | select.POLLHUP):
+            close_client()
+        elif reply is None:
+            if events & select.POLLIN:
+                read_request()
+        elif events & select.POLLOUT:
+            sent = client.send(memoryview(reply)[reply_sent:])
+            reply_sent = reply_sent + (sent or 0)
+            if reply_sent == len(reply):
+                requests_served = requests_served + 1
+                close_client()
+    except OSError as err:
+        if err.errno != errno.EAGAIN and client:
+            log_message("HTTP: dropped a client - %s" % err)
+            close_client()
+#
+##############################################################################################################
+#################### END HTTP ################################################################################
+##############################################################################################################
@@ -0,0 +1,134 @@
+# 3 humidifier controller - logger
+#
+# Log messages go to the console and to a rotating set of logfiles.
+#
+# The sensor acquisition task on core 1 logs with queue_log_message(), which only buffers the line - the logfile
+# is only written from core 0.  log_lock protects the buffer and keeps console lines from interleaving.
+
+import _thread
+import os
+from controller.config import *
+from controller import clock
+
+
+logfile = None
+logfile_lines_written = 0
+logfile_generation = 0
+log_buffer = []                     # log lines not yet written to the logfile - written when LOG_BUFFER_LINES are held
+log_buffer_time = 0                 # clock.time() the oldest line in log_buffer was logged
+log_lock = _thread.allocate_lock()  # held while using log_buffer or printing
+
+
+##############################################################################################################
+################# BEGIN LOGGER ###############################################################################
+##############################################################################################################
+#
+# rotate from the current logfile to LOGFILE_BASENAME.<generation+1> and increment the generation.
+# If there are enough generations, delete the logfile that just became too many generations old.
+#
+def rotate_logfile():
+    global logfile
+    global logfile_generation
+
+    # close existing logfile
+    flush_log()
+    logfile.close()
+    logfile = None
+
+    # advance the generation
+    logfile_generation = logfile_generation + 1
+
+    # if too many generations, delete oldest logfile
+    if logfile_generation >= LOGFILE_GENERATIONS:
+        try:
+            os.remove("%s.%d" % (LOGFILE_BASENAME, logfile_generation - LOGFILE_GENERATIONS))
+        except OSError:
+            print("Unable to remove old logfile.  Continuing...")
+
+#
+# Ensure that the logfile is open.
+# If it needs to be rotated, rotate it.
+#
+def ensure_logfile_open():
+    global logfile
+    global logfile_lines_written
+    global logfile_generation
+
+    # if at max lines per logfile, rotate logfile
+    if logfile and logfile_lines_written >= MAX_LOGFILE_LINES:
+        rotate_logfile()
+
+    # if logfile is not open, open it
+    if not logfile:
+        logfile = open("%s.%d" % (LOGFILE_BASENAME, logfile_generation), "w")
+        if logfile_generation == 0:
+            # have first file only take 100 lines since it is likely to get overwritten when plugging in pico
+            logfile_lines_written = MAX_LOGFILE_LINES - 100
+        else:
+            logfile_lines_written = 0
+
+#
+# Write a message to the log file.
+# Also write it to the console in case it is being viewed.
+# Only call from core 0 - see queue_log_message().
+#
+def log_message(message):
+    # open logfile if not already open
+    ensure_logfile_open()
+
+    # to logfile, buffering lines in RAM to save flash writes
+    queue_log_message(message)
+    if len(log_buffer) >= LOG_BUFFER_LINES:
+        flush_log()
+
+#
+# Write a message to the console and buffer it for the logfile, without touching the logfile.
+# Safe to call from either core - core 0 writes the buffered lines with its next flush.
+#
+def queue_log_message(message):
+    global log_buffer_time
+
+    # get for timestamping log messages
+    now = clock.localtime()
+    hour = now[3]
+    minute = now[4]
+    second = now[5]
+
+    full_message = "%02d:%02d:%02d %s" % (hour, minute, second, message)
+    with log_lock:
+        # to console
+        if LOG_TO_CONSOLE:
+            print(full_message)
+        if not log_buffer:
+            log_buffer_time = clock.time()
+        log_buffer.append(full_message)
+
+#
+# Write any buffered log lines to the logfile
+#
+def flush_log():
+    global log_buffer
+    global logfile_lines_written
+
+    if not logfile:
+        return
+    # take the buffered lines so the flash write happens without holding the lock
+    with log_lock:
+        lines = log_buffer
+        log_buffer = []
+    if len(lines) > 0:
+        for line in lines:
+            logfile.write(line + "\n")
+        logfile.flush()
+        logfile_lines_written = logfile_lines_written + len(lines)
+
+#
+# Write the buffered log lines once the oldest has waited LOG_FLUSH_SECS, so a reset that skips crash_restart()'s
+# flush - the watchdog firing, or a power cut - loses only the last few.  Call from core 0 once a main loop pass.
+#
+def flush_old_log():
+    if log_buffer and clock.time() - log_buffer_time >= LOG_FLUSH_SECS:
+        flush_log()
+##############################################################################################################
+################## END LOGGER ################################################################################
+##############################################################################################################
@@ -0,0 +1,293 @@
+# 3 humidifier controller - main
+#
+# Sets up the hardware and runs the main loop.  Nothing is set up until run() is called.
+
+import gc
+import machine
+import os
+import sys
+import time
+from controller.config import *
+from controller import clock
+from controller import commands
+from controller import history
+from controller import http_server
+from controller.logger import log_message, flush_log, flush_old_log
+from controller.stats import timed_gc_collect, update_loop_stats
+from controller import menu
+from controller import mqtt
+from controller import policy
+from controller import render
+from controller import sensor
+from controller import snapshot
+from controller import telemetry
+from controller import trace
+from controller.watchdog import start_watchdog, feed_watchdog
+
+
+booted = False              # set once run() has finished booting - see crash_restart()
+
+
+#
+# setup outlet control pins
+#
+def setup_outlets():
+    for i in range(len(OUTLET_PIN_NUMBERS)):
+        policy.outlet_pins.append(machine.Pin(OUTLET_PIN_NUMBERS[i], machine.Pin.OUT))
+        policy.outlet_pins[i].value(0)
+
+
+#
+# The state a trace file starts from - the exact RH and when it was read, and a warm snapshot, so the replay starts
+# with the relays as they are
+#
+def trace_state():
+    return policy.current_rh, policy.current_rh_time, snapshot.snapshot_data(warm=True)
+
+
+#
+# Handle a crash: record it, save a warm snapshot and reset, so the next boot carries on where this one stopped.
+# A crash while booting saves no snapshot - the one on flash has the relays off, so a boot step that fails every time
+# cannot hold them on through a reset loop.
+# Each step is protected - the reset must happen whatever else fails.
+#
+def crash_restart(err):
+    try:
+        render.display_error_text(f"Unexpected {err=}, {type(err)=}")
+        sys.print_exception(err)
+        mode = "a"
+        try:
+            if os.stat(CRASH_LOG_FILENAME)[6] >= CRASH_LOG_MAX_BYTES:
+                mode = "w"
+        except OSError:
+            pass
+        with open(CRASH_LOG_FILENAME, mode) as f:
+            now = clock.localtime()
+            f.write("----- crash at %02d:%02d:%02d\n" % (now[3], now[4], now[5]))
+            sys.print_exception(err, f)
+    except Exception as log_err:
+        print("Unable to record crash: {0}".format(log_err))
+
+    try:
+        if booted:
+            snapshot.save_snapshot(warm=True)
+            history.save_history()
+            log_message("Saved warm snapshot, resetting")
+        else:
+            log_message("Crashed while booting, resetting")
+        flush_log()
+        trace.flush_trace(force=True)
+    except Exception as save_err:
+        print("Unable to save warm snapshot: {0}".format(save_err))
+
+    machine.reset()
+
+
+#
+# How often the heartbeat blinks for the current humidifying
+#
+def heartbeat_ms():
+    if policy.humidifying == "heavy":
+        return HEAVY_HB_MS
+    if policy.humidifying == "light":
+        return LIGHT_HB_MS
+    return OFF_HB_MS
+
+
+#
+# How many ms until the main loop next has something to do: automate, refresh the bars, toggle the heartbeat or dim
+# the backlight (unless it is dimmed), handle a capacity event, or take the next sensor reading.  The capacity event
+# and the sensor reading are due at a clock.time() second - it is counted from the start of the current second, so
+# the loop wakes early rather than late.
+#
+def ms_until_due(last_automate_ms, last_display_ms, last_heartbeat_ms):
+    now_ms = clock.ticks_ms()
+    due_ms = min(AUTOMATE_SECS * 1000 - clock.ticks_diff(now_ms, last_automate_ms),
+                 BAR_DISPLAY_SECS * 1000 - clock.ticks_diff(now_ms, last_display_ms),
+                 (sensor.next_reading_time - clock.time() - 1) * 1000)
+    if not render.backlight_dimmed:
+        due_ms = min(due_ms, heartbeat_ms() - clock.ticks_diff(now_ms, last_heartbeat_ms),
+                     BACKLIGHT_DIM_SECS * 1000 - clock.ticks_diff(now_ms, menu.last_button_ms))
+    if policy.next_capacity_event_time != NO_THRESHOLD_TIME:
+        due_ms = min(due_ms, (policy.next_capacity_event_time - clock.time() - 1) * 1000)
+    return due_ms
+
+
+#
+# Sleep until something is due, due_ms from now.  With LOW_POWER_ENABLED and nothing due for more than a loop pass,
+# lightsleep - the buttons' interrupts wake it early.  Not while core 1 is reading the sensor, as lightsleep stops it,
+# nor with TELEMETRY_ENABLED, COMMANDS_ENABLED, MQTT_ENABLED or HTTP_ENABLED, as it stops USB and the network would
+# not be served.
+# The watchdog is fed first, and the lightsleep is kept to IDLE_SLEEP_MAX_MS.
+#
+def idle_sleep(due_ms):
+    if (not LOW_POWER_ENABLED or TELEMETRY_ENABLED or COMMANDS_ENABLED or MQTT_ENABLED or HTTP_ENABLED
+            or sensor.acquisition_busy or due_ms <= LOOP_SLEEP_MS):
+        clock.sleep_ms(LOOP_SLEEP_MS)
+        return
+    feed_watchdog()
+    clock.lightsleep(min(due_ms, IDLE_SLEEP_MAX_MS))
+
+
+#
+# main
+#   boot_start_ms       time.ticks_ms() when the entry point started, before importing the controller
+#   boot_start_alloc    gc.mem_alloc() when the entry point started
+#
+def run(boot_start_ms, boot_start_alloc):
+    global booted
+
+    # heap allocated by importing (and compiling, if not precompiled) the controller, before anything collects it
+    import_alloc = gc.mem_alloc() - boot_start_alloc
+    import_ms = time.ticks_diff(time.ticks_ms(), boot_start_ms)
+
+    log_message("boot: reset cause %d" % machine.reset_cause())
+
+    # The boot is inside the crash handler's try, and the watchdog is running, so a boot step that fails or hangs
+    # resets the Pico too rather than leaving it stopped.
+    try:
+        start_watchdog()
+
+        # Get something on the screen first.  A restored snapshot gives the last known state, otherwise say we are
+        # starting.  After a crash the warm snapshot also says which relays were on - put them straight back, once it
+        # has been saved again cold, so that if this boot fails too the next one starts with them off.
+        render.setup_display()
+        setup_outlets()
+        if snapshot.restore_snapshot():
+            if snapshot.warm_restart:
+                snapshot.save_snapshot()
+            policy.update_relays()
+            render.display_humidifier_bars()
+        else:
+            render.display_error_text("Initializing...")
+        history.restore_history()
+        log_message("boot: imports took %d ms and %d bytes of heap, first frame %d ms after start"
+                    % (import_ms, import_alloc, time.ticks_diff(time.ticks_ms(), boot_start_ms)))
+
+        # Then a quick RH reading is enough to make the first relay decision - a warm restart already has a fresh one.
+        # The acquisition task on core 1 takes the full (averaged) reading that refines it straight away.
+        sensor.setup_sensor()
+        menu.setup_buttons()
+        if not snapshot.warm_restart:
+            sensor.update_rh_quick()
+        trace.start_trace(trace_state)
+        trace.record_automate()
+        policy.automate_energizing()
+        log_message("boot: first relay decision %d ms after start" % time.ticks_diff(time.ticks_ms(), boot_start_ms))
+        sensor.start_acquisition()
+        telemetry.setup_telemetry()
+        commands.setup_commands()
+        mqtt.setup_mqtt()
+        http_server.setup_http()
+
+        last_display_ms = clock.ticks_ms()
+        last_heartbeat_ms = clock.ticks_ms()
+        last_automate_ms = clock.ticks_ms()
+        automate_now = False
+        policy.should_refresh_display = True
+        booted = True
+
+        while True:
+            loop_alloc_start = gc.mem_alloc()
+            loop_start_us = time.ticks_us()
+
+            # reaching here again shows the last iteration completed
+            feed_watchdog()
+
+            # If a is pressed, enter the menu
+            if menu.a_pressed:
+                render.led_red()
+                trace.record_menu()
+                menu.enter_menu(TOP_MENU, None)
+                policy.should_refresh_display = True
+                render.clear_led()
+                snapshot.save_snapshot()
+
+            # carry out any commands a host has sent on USB serial
+            if commands.poll_commands():
+                policy.should_refresh_display = True
+                snapshot.save_snapshot()
+
+            # B on the bars screen shows the next of RH, dew point and absolute humidity
+            if menu.b_pressed:
+                menu.b_pressed = False
+                render.next_graph_view()
+                policy.should_refresh_display = True
+
+            # X zooms the graph out to the hourly and daily history, Y back in
+            if menu.x_pressed or menu.y_pressed:
+                render.next_graph_span(1 if menu.x_pressed else -1)
+                menu.x_pressed = False
+                menu.y_pressed = False
+                policy.should_refresh_display = True
+
+            # take a new RH reading if core 1 has published one
+            if sensor.update_rh():
+                snapshot.save_snapshot()
+
+            # a capacity threshold crossing or light switch has come due - refresh the bars and automate now
+            if policy.next_capacity_event_time != NO_THRESHOLD_TIME and clock.time() >= policy.next_capacity_event_time:
+                trace.record_capacity()
+                policy.handle_capacity_event()
+                policy.should_refresh_display = True
+                automate_now = True
+
+            # automate
+            if automate_now or clock.ticks_diff(clock.ticks_ms(), last_automate_ms) >= AUTOMATE_SECS * 1000:
+                trace.record_automate()
+                policy.automate_energizing()
+                last_automate_ms = clock.ticks_ms()
+                automate_now = False
+
+            # NO humidifier available - but need one!  Set the led
+            if policy.no_humidifier_available:
+                render.led_red(bright=True)
+                policy.no_humidifier_available = False
+
+            # update humidifier bars at the appropriate interval
+            refreshed_display = False
+            if clock.ticks_diff(clock.ticks_ms(), last_display_ms) >= BAR_DISPLAY_SECS * 1000 or policy.should_refresh_display:
+                render.display_humidifier_bars()
+                policy.should_refresh_display = False
+                last_display_ms = clock.ticks_ms()
+                refreshed_display = True
+
+            # dim the backlight once nobody has pressed a button for a while, and bring it back on a press
+            render.update_backlight(clock.ticks_diff(clock.ticks_ms(), menu.last_button_ms) < BACKLIGHT_DIM_SECS * 1000)
+
+            # toggle the heartbeat as needed - not while the backlight is dimmed, when nobody is watching
+            if not render.backlight_dimmed and clock.ticks_diff(clock.ticks_ms(), last_heartbeat_ms) >= heartbeat_ms():
+                render.toggle_heartbeat()
+                last_heartbeat_ms = clock.ticks_ms()
+
+            # A loop that did not allocate leaves mem_alloc unchanged.  If an automatic collection ran the difference is negative - ignore it.
+            # The heap is shared with core 1, so a loop during a sensor reading also counts the acquisition task's allocations.
+            update_loop_stats(gc.mem_alloc() - loop_alloc_start, time.ticks_diff(time.ticks_us(), loop_start_us))
+
+            # send the live state to a host, if one is listening
+            telemetry.send_telemetry()
+
+            # publish the readings - a step at a time, never waiting on the network
+            mqtt.service_mqtt()
+
+            # answer a status request - a step at a time too
+            http_server.service_http()
+
+            # write the trace when enough has built up, and the log when its oldest line has waited long enough
+            trace.flush_trace()
+            flush_old_log()
+
+            # the display was just refreshed so this is an idle point - collect now rather than when the heap runs out
+            if refreshed_display:
+                timed_gc_collect()
+
+            # don't spin too fast - and with nothing due for a while, sleep until it is
+            idle_sleep(ms_until_due(last_automate_ms, last_display_ms, last_heartbeat_ms))
+
+    except KeyboardInterrupt as err:
+        # stopped at the REPL - leave everything as it is
+        render.display_error_text(f"Unexpected {err=}, {type(err)=}")
+        sys.print_exception(err)
+
+    except Exception as err:
+        crash_restart(err)
@@ -0,0 +1,418 @@
+# 3 humidifier controller - menu
+#
+# Button handling and the menu screens used to change settings.
+
+import machine
+from controller.config import *
+from controller import clock
+from controller.logger import log_message
+from controller import policy
+from controller import render
+from controller import trace
+from controller.watchdog import feed_watchdog
+
+
+last_button_press_secs = 0          # time of the last button press - used for menu idle timeout
+last_button_ms = clock.ticks_ms()    # ms resolution time of last button press - used for de-bouncing buttons
+
+
+##############################################################################################################
+############### BEGIN MENU ###################################################################################
+##############################################################################################################
+#
+# Setup button handling
+#
+a_pressed = False
+b_pressed = False
+x_pressed = False
+y_pressed = False
+
+def button_a_handler(pin):
+    global a_pressed
+    global last_button_ms
+    global DEBOUNCE_MS
+    if clock.ticks_diff(clock.ticks_ms(), last_button_ms) < DEBOUNCE_MS:
+        return
+    last_button_ms = clock.ticks_ms()
+    a_pressed = True
+    trace.record_button("a")
+
+def button_b_handler(pin):
+    global b_pressed
+    global last_button_ms
+    global DEBOUNCE_MS
+    if clock.ticks_diff(clock.ticks_ms(), last_button_ms) < DEBOUNCE_MS:
+        return
+    last_button_ms = clock.ticks_ms()
+    b_pressed = True
+    trace.record_button("b")
+
+def button_x_handler(pin):
+    global x_pressed
+    global last_button_ms
+    global DEBOUNCE_MS
+    if clock.ticks_diff(clock.ticks_ms(), last_button_ms) < DEBOUNCE_MS:
+        return
+    last_button_ms = clock.ticks_ms()
+    x_pressed = True
+    trace.record_button("x")
+
+def button_y_handler(pin):
+    global y_pressed
+    global last_button_ms
+    global DEBOUNCE_MS
+    if clock.ticks_diff(clock.ticks_ms(), last_button_ms) < DEBOUNCE_MS:
+        return
+    last_button_ms = clock.ticks_ms()
+    y_pressed = True
+    trace.record_button("y")
+
+# ORIGINAL
+#def button_y_handler(pin):
+#    global y_pressed
+#    if pin.value() == 0:
+#        y_pressed = True
+
+#
+# defining buttons and their irq handlers
+#
+button_a = None
+button_b = None
+button_x = None
+button_y = None
+
+def setup_buttons():
+    global button_a
+    global button_b
+    global button_x
+    global button_y
+    button_a = machine.Pin(12, machine.Pin.IN, machine.Pin.PULL_UP)
+    button_b = machine.Pin(13, machine.Pin.IN, machine.Pin.PULL_UP)
+    button_x = machine.Pin(14, machine.Pin.IN, machine.Pin.PULL_UP)
+    button_y = machine.Pin(15, machine.Pin.IN, machine.Pin.PULL_UP)
+    button_a.irq(trigger = machine.Pin.IRQ_FALLING, handler=button_a_handler)
+    button_b.irq(trigger = machine.Pin.IRQ_FALLING, handler=button_b_handler)
+    button_x.irq(trigger = machine.Pin.IRQ_FALLING, handler=button_x_handler)
+    button_y.irq(trigger = machine.Pin.IRQ_FALLING, handler=button_y_handler)
+
+
+#
+# Display a menu entry and the rectangle provide
+#
+def draw_menu_entry(entry, menu_entry_rect, is_selected):
+    display = render.display
+    # set pen based on whether selected or not
+    # { "x_min" : 30, "x_max" : 210, "y_min" :  4, "y_max":  44 }
+    entry_width = menu_entry_rect["x_max"] - menu_entry_rect["x_min"]
+    entry_height = menu_entry_rect["y_max"] - menu_entry_rect["y_min"]
+    y_midline = round(menu_entry_rect["y_min"] + (entry_height / 2))
+    display.set_clip(menu_entry_rect["x_min"],
+                     menu_entry_rect["y_min"],
+                     entry_width,
+                     entry_height)
+    #log_message("y_midline=%d, clip rect=%d, %d, %d, %d" % (y_midline, menu_entry_rect["x_min"], menu_entry_rect["y_min"], entry_width, entry_height))
+
+    # if selected entry, set the background to green
+    if is_selected:
+        display.set_pen(render.GREEN)
+        disp_w, disp_h = display.get_bounds()
+        display.rectangle(0, 0, disp_w, disp_h)
+
+    display.set_pen(render.RED)
+    display.set_font("sans")
+    text_width = display.measure_text(entry["text"], MENU_TEXT_SCALE)
+    x_start = menu_entry_rect["x_max"] - text_width - 1
+    display.text(entry["text"], x_start, y_midline, scale = MENU_TEXT_SCALE)
+    display.remove_clip()
+
+
+#
+# Display a list of menu entries
+#
+def show_menu_entries(entries, menu_selection):
+    display = render.display
+    # clear display
+    display.set_pen(render.BLACK)
+    display.clear()
+    # wrap selection
+    if menu_selection < 0:
+        menu_selection = len(entries) - 1
+    elif menu_selection >= len(entries):
+        menu_selection = 0
+    # do we need to start below the top?
+    if menu_selection >= len(MENU_ENTRY_RECTS):
+        top_entry = menu_selection - len(MENU_ENTRY_RECTS) + 1
+    else:
+        top_entry = 0
+
+    # display each entry
+    for i in range(len(MENU_ENTRY_RECTS)):
+        if top_entry + i < len(entries):
+            draw_menu_entry(entries[top_entry + i], MENU_ENTRY_RECTS[i], menu_selection == top_entry + i)
+    # update the display
+    display.update()
+    return menu_selection
+
+
+#
+# Display a menu entry and the rectangle provide
+#
+def show_setting(value):
+    display = render.display
+    display.set_pen(render.BLACK)
+    display.clear()
+
+    display.set_pen(render.RED)
+    display.set_font("sans")
+    text_width = display.measure_text(str(value), NUMBER_SCALE)
+    x_start = int( render.HALF_WIDTH - (text_width/2))
+    display.text(str(value), x_start, render.HALF_HEIGHT, scale = NUMBER_SCALE)
+    display.update()
+
+
+def can_adjust(which_one, rh_value, min_value, max_value, direction):
+    if direction == "up":
+        if rh_value >= max_value:
+            return False
+        if which_one == "low" and rh_value >= policy.on_rh:
+            return False
+    else:
+        if rh_value <= min_value:
+            return False
+        if which_one == "on" and rh_value <= policy.low_rh:
+            return False
+    return True
+
+
+def choose_RH(which_one, min_value, max_value):
+    global a_pressed
+    global b_pressed
+    global x_pressed
+    global y_pressed
+    global last_button_press_secs
+
+    keep_processing = True
+    rh_value = 0
+    if which_one == "on":
+        rh_value = policy.on_rh
+    else:
+        rh_value = policy.low_rh
+
+    # clear a button press
+    clock.sleep(0.1)
+    a_pressed = False
+
+    while keep_processing:
+        show_setting(rh_value)
+
+        if a_pressed:
+            policy.set_rh_threshold(which_one, rh_value)
+            # update last button press time
+            clock.sleep(0.1)
+            last_button_press_secs = clock.time()
+            a_pressed = False
+            return True
+
+        if b_pressed:
+            # update last button press time
+            clock.sleep(0.1)
+            last_button_press_secs = clock.time()
+            b_pressed = False
+            return True
+
+        if x_pressed:
+            if can_adjust(which_one, rh_value, min_value, max_value, "up"):
+                rh_value = rh_value + 1
+            # update last button press time
+            clock.sleep(0.1)
+            last_button_press_secs = clock.time()
+            x_pressed = False
+
+        if y_pressed:
+            if can_adjust(which_one, rh_value, min_value, max_value, "down"):
+                rh_value = rh_value - 1
+            # update last button press time
+            clock.sleep(0.1)
+            last_button_press_secs = clock.time()
+            y_pressed = False
+
+        clock.sleep(0.1)
+        feed_watchdog()
+        if clock.time() - last_button_press_secs > MENU_IDLE_SECS_EXIT:
+            return False
+
+
+#
+# Display the code version
+#
+def show_version():
+    global a_pressed
+    global b_pressed
+    global x_pressed
+    global y_pressed
+    global last_button_press_secs
+
+    keep_processing = True
+    display = render.display
+
+    # Show the version string
+    display.set_pen(render.BLACK)
+    display.clear()
+
+    display.set_pen(render.RED)
+    display.set_font("sans")
+    text_width = display.measure_text(VERSION, VERSION_SCALE)
+    x_start = int( render.HALF_WIDTH - (text_width/2))
+    display.text(VERSION, x_start, render.HALF_HEIGHT, scale = VERSION_SCALE)
+    display.update()
+
+    # clear a button press
+    clock.sleep(0.1)
+    a_pressed = False
+
+    while keep_processing:
+
+        if a_pressed:
+            # update last button press time
+            clock.sleep(0.1)
+            last_button_press_secs = clock.time()
+            a_pressed = False
+            return True
+
+        if b_pressed:
+            # update last button press time
+            clock.sleep(0.1)
+            last_button_press_secs = clock.time()
+            b_pressed = False
+            return True
+
+        if x_pressed:
+            # update last button press time
+            clock.sleep(0.1)
+            last_button_press_secs = clock.time()
+            x_pressed = False
+
+        if y_pressed:
+            # update last button press time
+            clock.sleep(0.1)
+            last_button_press_secs = clock.time()
+            y_pressed = False
+
+        clock.sleep(0.1)
+        feed_watchdog()
+        if clock.time() - last_button_press_secs > MENU_IDLE_SECS_EXIT:
+            return False
+
+
+def enter_menu(current_menu, menu_context):
+    global a_pressed
+    global b_pressed
+    global x_pressed
+    global y_pressed
+    global last_button_press_secs
+    stay_in_menu = True
+
+    # clear a button press
+    clock.sleep(0.1)
+    a_pressed = False
+    b_pressed = False
+    x_pressed = False
+    y_pressed = False
+
+    menu_selection = 0
+
+    last_button_press_secs = clock.time()
+
+    while stay_in_menu:
+        menu_selection = show_menu_entries(current_menu, menu_selection)
+
+        if a_pressed:
+            action = current_menu[menu_selection]["action"]
+            if action == "humidifier_off":
+                log_message("action %s for humidifier %d" % (action, menu_context))
+                policy.humidifier_setting(policy.humidifiers[menu_context], "off")
+                # update last button press time
+                clock.sleep(0.1)
+                last_button_press_secs = clock.time()
+                a_pressed = False
+                return False
+            elif action == "humidifier_lo":
+                log_message("action %s for humidifier %d" % (action, menu_context))
+                policy.humidifier_setting(policy.humidifiers[menu_context], "lo")
+                # update last button press time
+                clock.sleep(0.1)
+                last_button_press_secs = clock.time()
+                a_pressed = False
+                return False
+            elif action == "humidifier_hi":
+                log_message("action %s for humidifier %d" % (action, menu_context))
+                policy.humidifier_setting(policy.humidifiers[menu_context], "hi")
+                # update last button press time
+                clock.sleep(0.1)
+                last_button_press_secs = clock.time()
+                a_pressed = False
+                return False
+            elif action == "show_humidifier_menu_1":
+                stay_in_menu = enter_menu(HUMIDIFIER_MENU, 0)
+            elif action == "show_humidifier_menu_2":
+                stay_in_menu = enter_menu(HUMIDIFIER_MENU, 1)
+            elif action == "show_humidifier_menu_3":
+                stay_in_menu = enter_menu(HUMIDIFIER_MENU, 2)
+            elif action == "humidifiers_refilled":
+                for i in range(len(policy.humidifiers)):
+                    policy.humidifier_refilled(policy.humidifiers[i])
+                stay_in_menu = False
+            elif action == "show_settings_menu":
+                stay_in_menu = enter_menu(SETTINGS_MENU, None)
+            elif action == "show_version":
+                stay_in_menu = show_version()
+            elif action == "show_settings_menu_on":
+                stay_in_menu = choose_RH("on", MIN_SETTABLE_RH, MAX_SETTABLE_RH)
+            elif action == "show_settings_menu_low":
+                stay_in_menu = choose_RH("low", MIN_SETTABLE_RH, MAX_SETTABLE_RH)
+            # update last button press time
+            clock.sleep(0.1)
+            last_button_press_secs = clock.time()
+            a_pressed = False
+
+        elif b_pressed:
+            # update last button press time
+            clock.sleep(0.1)
+            last_button_press_secs = clock.time()
+            b_pressed = False
+            return True
+
+        elif x_pressed:
+            menu_selection = menu_selection - 1
+            menu_selection = show_menu_entries(current_menu, menu_selection)
+            # update last button press time
+            clock.sleep(0.1)
+            last_button_press_secs = clock.time()
+            x_pressed = False
+
+        elif y_pressed:
+            menu_selection = menu_selection + 1
+            menu_selection = show_menu_entries(current_menu, menu_selection)
+            # update last button press time
+            clock.sleep(0.1)
+            last_button_press_secs = clock.time()
+            y_pressed = False
+
+        else:
+            a_pressed = False
+            b_pressed = False
+            x_pressed = False
+            y_pressed = False
+
+        clock.sleep(0.1)
+        feed_watchdog()
+        if clock.time() - last_button_press_secs > MENU_IDLE_SECS_EXIT:
+            break
+
+    return
+#
+##############################################################################################################
+################ END MENU ####################################################################################
+##############################################################################################################
+
+
@@ -0,0 +1,67 @@
+# 3 humidifier controller - moisture
+#
+# Dew point and absolute humidity from the RH and the temperature the sensor measured with it.  Cheap fixed point:
+# the saturation vapour pressure of each whole degree from MOISTURE_MIN_C to MOISTURE_MAX_C is worked out once at
+# import (Magnus formula over water) and interpolated linearly between them, so after the import it is all integer
+# math.  RH is in hundredths of a percent, temperatures in hundredths of a degree C, absolute humidity in hundredths
+# of a g/m3, as the RH history keeps them.
+
+import math
+from array import array
+
+
+MOISTURE_MIN_C = -20        # coldest temperature in the table - colder is taken as this
+MOISTURE_MAX_C = 50         # warmest temperature in the table - warmer is taken as this
+
+# saturation vapour pressure in Pa at each whole degree from MOISTURE_MIN_C to MOISTURE_MAX_C
+SATURATION_PA = array("H", [ int(611.2 * math.exp(17.62 * t / (243.12 + t)) + 0.5)
+                             for t in range(MOISTURE_MIN_C, MOISTURE_MAX_C + 1) ])
+
+
+##############################################################################################################
+################ BEGIN MOISTURE ##############################################################################
+##############################################################################################################
+#
+# Saturation vapour pressure in Pa at a temperature in hundredths of a degree
+#
+def saturation_vapour_pressure(temperature):
+    t = temperature - MOISTURE_MIN_C * 100
+    if t < 0:
+        t = 0
+    if t > (len(SATURATION_PA) - 1) * 100 - 1:
+        t = (len(SATURATION_PA) - 1) * 100 - 1
+    i = t // 100
+    return SATURATION_PA[i] + (SATURATION_PA[i + 1] - SATURATION_PA[i]) * (t % 100) // 100
+
+
+#
+# Vapour pressure in Pa of the air at an RH and temperature
+#
+def vapour_pressure(rh, temperature):
+    return saturation_vapour_pressure(temperature) * rh // 10000
+
+
+#
+# Dew point in hundredths of a degree - the temperature whose saturation vapour pressure is the air's vapour pressure,
+# found in the table
+#
+def dew_point(rh, temperature):
+    pa = vapour_pressure(rh, temperature)
+    if pa <= SATURATION_PA[0]:
+        return MOISTURE_MIN_C * 100
+    i = 0
+    while i < len(SATURATION_PA) - 2 and SATURATION_PA[i + 1] <= pa:
+        i = i + 1
+    return (MOISTURE_MIN_C + i) * 100 + (pa - SATURATION_PA[i]) * 100 // (SATURATION_PA[i + 1] - SATURATION_PA[i])
+
+
+#
+# Absolute humidity in hundredths of a g/m3 - the ideal gas law for water vapour, 2.1674 g K / (m3 Pa) over the
+# temperature in kelvin
+#
+def absolute_humidity(rh, temperature):
+    return vapour_pressure(rh, temperature) * 21674 // (27315 + temperature)
+#
+##############################################################################################################
+################# END MOISTURE ###############################################################################
+##############################################################################################################
@@ -0,0 +1,377 @@
+# 3 humidifier controller - MQTT publisher (Pico W)
+#
+# With MQTT_ENABLED, each RH reading is queued with the trend, the humidifying and each outlet's setting, relay and
+# tank use, and published to MQTT_TOPIC on an MQTT 3.1.1 broker, MQTT_BATCH_READINGS readings to a publish, as JSON:
+#   {"readings":[{"time":..,"rh":..,"temperature":..,"trend":..,"humidifying":"light",
+#                 "outlets":[{"setting":"lo","energized":true,"used_pct":12},..]},..],"dropped":..}
+# "dropped" counts the readings the queue has had to drop since boot.
+#
+# The client is a small state machine the main loop steps once a pass with service_mqtt(), on a non-blocking socket:
+# each step polls, then sends what the socket will take of the packet being sent or reads what the broker has sent,
+# and returns - so neither a slow network nor a stalled broker ever holds up the relay decisions.  Until the broker
+# has taken a whole publish the next is not made, and meanwhile the readings wait in a bounded queue, packed
+# MQTT_RECORD by MQTT_RECORD into a bytearray made at setup.  Losing WiFi or the broker just leaves them queued: the
+# client tries again every MQTT_RETRY_SECS and drains the queue once it is back, oldest first.  The publish being sent
+# when a connection drops is sent again on the next one, so a broker may see it twice.
+
+import errno
+import select
+import struct
+from controller.config import *
+from controller import clock
+from controller.logger import log_message
+from controller import policy
+from controller import snapshot
+from controller import wifi
+
+
+MQTT_RECORD = "<IHhbB"      # clock.time(), RH and temperature in hundredths, trend, index in snapshot.HUMIDIFYING_CODES
+MQTT_OUTLET = "<BB"         # index in snapshot.SETTING_CODES plus MQTT_ENERGIZED, pct of the tank used
+MQTT_ENERGIZED = 0x80
+OUTLET_SIZE = struct.calcsize(MQTT_OUTLET)
+RECORD_SIZE = struct.calcsize(MQTT_RECORD) + OUTLET_SIZE * len(OUTLET_PIN_NUMBERS)
+
+MQTT_CONNECT    = 0x10      # MQTT packet types
+MQTT_CONNACK    = 0x20
+MQTT_PUBLISH    = 0x30
+MQTT_PINGREQ    = 0xc0
+
+STATE_OFFLINE    = 0        # no connection - waiting for WiFi or the next retry
+STATE_CONNECTING = 1        # the socket is connecting
+STATE_CONNACK    = 2        # CONNECT sent or being sent, waiting for the broker to accept it
+STATE_CONNECTED  = 3        # publishing
+
+state = STATE_OFFLINE
+sock = None
+poll_sock = None            # polls sock - ipoll, which does not allocate, where there is one
+poller = None
+state_time = 0              # clock.time() state last changed
+retry_time = 0              # clock.time() to next try connecting
+last_ping_time = 0          # clock.time() the last PINGREQ was started
+last_received_time = 0      # clock.time() the broker last sent anything
+out_packet = None           # the packet being sent
+out_sent = 0                # bytes of out_packet sent
+publish_packet = None       # the publish being sent - kept until the broker has it all, to send again on a new connection
+publish_readings = 0        # queued readings in publish_packet
+connack = bytearray(4)      # the CONNACK as it arrives
+connack_length = 0
+
+queue = None                # the readings queue - MQTT_QUEUE_READINGS records
+queue_start = 0             # record index of the oldest reading
+queue_count = 0             # readings queued, including those in publish_packet
+readings_dropped = 0        # readings dropped from a full queue since boot
+publishes = 0               # publishes the broker has had whole since boot
+send_waits = 0              # times the socket could not take all of a packet - the network pushing back
+
+
+##############################################################################################################
+################### BEGIN MQTT ###############################################################################
+##############################################################################################################
+#
+# Start WiFi and the queue, if MQTT is enabled.  Call once the controller's state is set up.
+#
+def setup_mqtt():
+    global queue
+
+    if not MQTT_ENABLED:
+        return
+    queue = bytearray(MQTT_QUEUE_READINGS * RECORD_SIZE)
+    wifi.setup_wifi()
+    log_message("MQTT: publishing to %s:%d" % (MQTT_BROKER, MQTT_PORT))
+
+#
+# Queue the current reading.  Call after each reading has updated the trend.
+#
+def record_reading():
+    global queue_start
+    global queue_count
+    global readings_dropped
+
+    if queue is None:
+        return
+    if queue_count == MQTT_QUEUE_READINGS:
+        # drop the oldest reading not already in the publish being sent
+        if publish_readings == queue_count:
+            readings_dropped = readings_dropped + 1
+            return
+        drop = (queue_start + publish_readings) % MQTT_QUEUE_READINGS
+        for i in range(publish_readings):
+            j = (queue_start + publish_readings - 1 - i) % MQTT_QUEUE_READINGS
+            queue[drop * RECORD_SIZE:(drop + 1) * RECORD_SIZE] = queue[j * RECORD_SIZE:(j + 1) * RECORD_SIZE]
+            drop = j
+        queue_start = (queue_start + 1) % MQTT_QUEUE_READINGS
+        queue_count = queue_count - 1
+        readings_dropped = readings_dropped + 1
+
+    offset = (queue_start + queue_count) % MQTT_QUEUE_READINGS * RECORD_SIZE
+    struct.pack_into(MQTT_RECORD, queue, offset, policy.current_rh_time, min(max(round(policy.current_rh * 100), 0), 10000),
+                     round(policy.current_temperature * 100), policy.rh_trend,
+                     snapshot.HUMIDIFYING_CODES.index(policy.humidifying))
+    offset = offset + struct.calcsize(MQTT_RECORD)
+    for i in range(len(policy.humidifiers)):
+        humidifier = policy.humidifiers[i]
+        setting = snapshot.SETTING_CODES.index(humidifier.setting)
+        if humidifier.energized:
+            setting |= MQTT_ENERGIZED
+        used_pct = (policy.calculate_units_used(humidifier) * 100 + TANK_UNITS // 2) // TANK_UNITS
+        struct.pack_into(MQTT_OUTLET, queue, offset + i * OUTLET_SIZE, setting, min(max(used_pct, 0), 100))
+    queue_count = queue_count + 1
+
+#
+# An MQTT packet - the fixed header, with the remaining length, then the body
+#
+def mqtt_packet(kind, body):
+    packet = bytearray([ kind ])
+    length = len(body)
+    while True:
+        byte = length & 0x7f
+        length = length >> 7
+        packet.append(byte | 0x80 if length else byte)
+        if not length:
+            break
+    packet.extend(body)
+    return packet
+
+#
+# An MQTT string - its length then its bytes
+#
+def mqtt_string(text):
+    data = text.encode()
+    return struct.pack(">H", len(data)) + data
+
+#
+# The CONNECT packet - a clean session, with the user name and password if there are any
+#
+def connect_packet():
+    flags = 0x02
+    body = mqtt_string("MQTT") + bytes([ 4 ])
+    credentials = b""
+    if MQTT_USER:
+        flags |= 0xc0
+        credentials = mqtt_string(MQTT_USER) + mqtt_string(MQTT_PASSWORD)
+    body = body + bytes([ flags ]) + struct.pack(">H", MQTT_KEEPALIVE_SECS) + mqtt_string(MQTT_CLIENT_ID) + credentials
+    return mqtt_packet(MQTT_CONNECT, body)
+
+#
+# The JSON of count queued readings, oldest first
+#
+def readings_json(count):
+    readings = []
+    for i in range(count):
+        offset = (queue_start + i) % MQTT_QUEUE_READINGS * RECORD_SIZE
+        secs, rh, temperature, trend, humidifying = struct.unpack_from(MQTT_RECORD, queue, offset)
+        offset = offset + struct.calcsize(MQTT_RECORD)
+        outlets = []
+        for j in range(len(policy.humidifiers)):
+            setting, used_pct = struct.unpack_from(MQTT_OUTLET, queue, offset + j * OUTLET_SIZE)
+            outlets.append('{"setting":"%s","energized":%s,"used_pct":%d}'
+                           % (snapshot.SETTING_CODES[setting & ~MQTT_ENERGIZED],
+                              "true" if setting & MQTT_ENERGIZED else "false", used_pct))
+        readings.append('{"time":%d,"rh":%.2f,"temperature":%.2f,"trend":%d,"humidifying":"%s","outlets":[%s]}'
+                        % (secs, rh / 100, temperature / 100, trend, snapshot.HUMIDIFYING_CODES[humidifying],
+                           ",".join(outlets)))
+    return '{"readings":[%s],"dropped":%d}' % (",".join(readings), readings_dropped)
+
+#
+# Make the next publish from the oldest queued readings, if a batch is waiting
+#
+def make_publish():
+    global publish_packet
+    global publish_readings
+
+    if queue_count < MQTT_BATCH_READINGS:
+        return
+    publish_readings = MQTT_BATCH_READINGS
+    publish_packet = mqtt_packet(MQTT_PUBLISH, mqtt_string(MQTT_TOPIC) + readings_json(publish_readings).encode())
+
+#
+# The broker has the whole publish - take its readings off the queue
+#
+def publish_sent():
+    global publish_packet
+    global publish_readings
+    global queue_start
+    global queue_count
+    global publishes
+
+    queue_start = (queue_start + publish_readings) % MQTT_QUEUE_READINGS
+    queue_count = queue_count - publish_readings
+    publish_packet = None
+    publish_readings = 0
+    publishes = publishes + 1
+
+def set_state(new_state):
+    global state
+    global state_time
+    state = new_state
+    state_time = clock.time()
+
+#
+# Close the connection, if there is one, and try again after MQTT_RETRY_SECS
+#   reason  why, for the log - None for no message
+#
+def disconnect(reason):
+    global sock
+    global out_packet
+    global retry_time
+
+    if sock:
+        sock.close()
+        sock = None
+        if reason:
+            log_message("MQTT: disconnected - %s" % reason)
+    out_packet = None
+    retry_time = clock.time() + MQTT_RETRY_SECS
+    set_state(STATE_OFFLINE)
+
+#
+# Start connecting to the broker.  A non-blocking connect returns straight away - the poll shows when it has finished.
+#
+def start_connection():
+    global sock
+    global poller
+    global poll_sock
+    # only a Pico W has the socket module
+    import socket
+
+    address = socket.getaddrinfo(MQTT_BROKER, MQTT_PORT)[0][-1]
+    sock = socket.socket()
+    sock.setblocking(False)
+    # a ping straight after a publish would otherwise wait for the publish's delayed ACK - where there is the option
+    if hasattr(socket, "TCP_NODELAY"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    try:
+        sock.connect(address)
+    except OSError as err:
+        if err.errno != errno.EINPROGRESS:
+            raise
+    poller = select.poll()
+    poller.register(sock, select.POLLIN | select.POLLOUT)
+    # the host stand-ins run on CPython, which only has poll()
+    poll_sock = getattr(poller, "ipoll", poller.poll)
+    set_state(STATE_CONNECTING)
+
+#
+# The poll events on the socket now, without waiting
+#
+def socket_events():
+    for entry in poll_sock(0):
+        return entry[1]
+    return 0
+
+#
+# Send what the socket will take of out_packet.  Returns True once it is all sent.
+#
+def send_some():
+    global out_sent
+    global send_waits
+
+    sent = sock.send(memoryview(out_packet)[out_sent:])
+    out_sent = out_sent + (sent or 0)
+    if out_sent < len(out_packet):
+        send_waits = send_waits + 1
+        return False
+    return True
+
+def start_sending(packet):
+    global out_packet
+    global out_sent
+    out_packet = packet
+    out_sent = 0
+
+#
+# Take one step: connect, send or receive as far as it can go without waiting.  Call from the main loop.
+#
+def service_mqtt():
+    global retry_time
+    global last_received_time
+    global last_ping_time
+    global connack_length
+
+    if queue is None:
+        return
+    if state == STATE_OFFLINE:
+        if clock.time() < retry_time:
+            return
+        if not wifi.wifi_connected():
+            retry_time = clock.time() + MQTT_RETRY_SECS
+            return
+        try:
+            start_connection()
+        except OSError as err:
+            disconnect(None)
+            log_message("MQTT: cannot connect to %s:%d - %s" % (MQTT_BROKER, MQTT_PORT, err))
+        return
+
+    try:
+        events = socket_events()
+        if events & (select.POLLERR | select.POLLHUP):
+            disconnect("connection failed" if state == STATE_CONNECTING else "connection closed")
+            return
+        if not wifi.wifi_connected():
+            disconnect("WiFi lost")
+            return
+
+        if state == STATE_CONNECTING:
+            if events & select.POLLOUT:
+                connack_length = 0
+                start_sending(connect_packet())
+                set_state(STATE_CONNACK)
+            elif clock.time() - state_time > MQTT_CONNECT_SECS:
+                disconnect("no connection in %d s" % MQTT_CONNECT_SECS)
+            return
+
+        if events & select.POLLIN:
+            data = sock.recv(len(connack) if state == STATE_CONNACK else 64)
+            if not data:
+                disconnect("the broker closed the connection")
+                return
+            last_received_time = clock.time()
+            if state == STATE_CONNACK:
+                for byte in data:
+                    if connack_length < len(connack):
+                        connack[connack_length] = byte
+                        connack_length = connack_length + 1
+                if connack_length == len(connack):
+                    if connack[0] != MQTT_CONNACK or connack[3] != 0:
+                        disconnect("the broker refused the connection, code %d" % connack[3])
+                        return
+                    log_message("MQTT: connected to %s:%d, %d readings queued" % (MQTT_BROKER, MQTT_PORT, queue_count))
+                    set_state(STATE_CONNECTED)
+                    last_ping_time = clock.time()
+                    # the publish a dropped connection interrupted goes again
+                    if publish_packet:
+                        start_sending(publish_packet)
+            # anything else from the broker is a PINGRESP
+
+        if state == STATE_CONNACK:
+            if out_packet and events & select.POLLOUT and send_some():
+                start_sending(None)
+            if clock.time() - state_time > MQTT_CONNECT_SECS:
+                disconnect("the broker did not accept the connection in %d s" % MQTT_CONNECT_SECS)
+            return
+
+        # connected - a broker that has not answered a ping in half a keepalive is gone
+        if clock.time() - last_received_time > MQTT_KEEPALIVE_SECS * 3 // 2:
+            disconnect("no word from the broker in %d s" % (MQTT_KEEPALIVE_SECS * 3 // 2))
+            return
+        if out_packet is None:
+            if clock.time() - last_ping_time >= MQTT_KEEPALIVE_SECS:
+                start_sending(mqtt_packet(MQTT_PINGREQ, b""))
+                last_ping_time = clock.time()
+            else:
+                if publish_packet is None:
+                    make_publish()
+                if publish_packet:
+                    start_sending(publish_packet)
+        if out_packet and events & select.POLLOUT and send_some():
+            if out_packet is publish_packet:
+                publish_sent()
+            start_sending(None)
+    except OSError as err:
+        if err.errno != errno.EAGAIN:
+            disconnect(str(err))
+#
+##############################################################################################################
+#################### END MQTT ################################################################################
+##############################################################################################################
@@ -0,0 +1,1032 @@
+# 3 humidifier controller - policy
+#
+# The controller state (RH thresholds, current RH, humidifying activity and the humidifiers themselves),
+# the capacity model, and the decisions about which humidifiers to energize.
+# Nothing in this module touches the hardware directly - the outlet pins are handed in by main, so the
+# decision functions can also be run on a host.
+
+from array import array
+from controller.config import *
+from controller import clock
+from controller.logger import log_message
+from controller import trace
+from controller import moisture
+
+
+on_rh  = DEFAULT_ON_RH     # on_rh holds the currently set "ON" RH threshold where light humidifying happens
+low_rh = DEFAULT_LOW_RH    # low_rh holds the currently set "LOW" RH threshold where heavy humidifying happens
+current_rh = 0.0           # The current RH returned from the sensor
+current_rh_time = 0        # clock.time() when current_rh was read - 0 if it never has been
+current_temperature = 0.0  # The temperature the sensor measured with current_rh, in degrees C
+current_dew_point = 0      # The dew point of current_rh at current_temperature, in hundredths of a degree C
+current_absolute_humidity = 0  # The absolute humidity of current_rh at current_temperature, in hundredths of a g/m3
+failed_readings = 0        # Sensor readings failed in a row - written by the acquisition task on core 1
+failsafe = False           # Set while current_rh is stale and FAILSAFE_HUMIDIFYING is used instead
+rh_trend = 0               # The RH trend.  Either -1 (falling), 0 (even) or 1 (rising) - see update_rh_trend()
+rh_rate = 0.0              # How fast the RH is changing, in %RH an hour - see update_rh_trend()
+humidifying = "off"        # current humidifying activity - "off" or "light" or "heavy"
+
+# on_rh and low_rh with DEBOUNCE_RH_AMOUNT added or subtracted - see update_debounced_thresholds()
+on_rh_on_debounced   = DEFAULT_ON_RH + DEBOUNCE_RH_AMOUNT
+on_rh_off_debounced  = DEFAULT_ON_RH - DEBOUNCE_RH_AMOUNT
+low_rh_on_debounced  = DEFAULT_LOW_RH + DEBOUNCE_RH_AMOUNT
+low_rh_off_debounced = DEFAULT_LOW_RH - DEBOUNCE_RH_AMOUNT
+
+should_refresh_display = False   # When set, causes the display to be refreshed immediately instead of at next update interval
+
+next_capacity_event_time = NO_THRESHOLD_TIME   # Earliest time a capacity threshold crossing or light switch could change the bars or automation
+light_switch_time = NO_THRESHOLD_TIME          # Time the energized light humidifier will be SWITCH_PCT more used than the least used one
+no_humidifier_available = False # Set when humidifying is needed but no humidifier can be energized
+relay_switches_deferred = 0      # Relay switches the relay scheduler held back until the outlet's limits allowed them
+relay_switches_suppressed = 0    # Held back relay switches that were no longer wanted by the time they were allowed
+
+# Duty cycle control of light humidifying (CONTROL_MODE "duty") - see DUTY CYCLE
+duty_integral = 0.0                      # The PI controller's integral of the RH below the target, in %RH seconds
+duty_window_time = NO_THRESHOLD_TIME     # Time the current window started, or NO_THRESHOLD_TIME when not light humidifying
+duty_on_secs = 0                         # How long the light humidifier runs at the start of the current window
+duty_switch_time = NO_THRESHOLD_TIME     # Time the light humidifier next goes off or the next window starts
+
+# Predictive switching (PREDICTIVE_ENABLED) - see RH PREDICTION
+humidifying_time = 0                     # Time humidifying last changed
+rh_slopes = { "off" : 0.0, "light" : 0.0, "heavy" : 0.0 }    # Learned RH rate with each humidifying activity, in %RH an hour
+rh_slope_samples = { "off" : 0, "light" : 0, "heavy" : 0 }   # Rates measured for each activity, up to RH_SLOPE_MIN_SAMPLES
+predicted_switch_time = NO_THRESHOLD_TIME  # Time to switch to predicted_humidifying early, or NO_THRESHOLD_TIME
+predicted_humidifying = "off"            # What humidifying switches to at predicted_switch_time
+projection_known = False                 # Set when the current activity's rate has been learned
+projected_rh_step = 0                    # The projected RH change per reading, in hundredths of a percent
+predicted_switch_readings = 0            # Readings after the newest until predicted_switch_time, for the graph
+
+outlet_pins = []                 # The outlet (relay) control pins, one per humidifier - set up by main
+
+# RH history, one reading per pixel of display width times RH_HISTORY_SCREENS.
+# Readings are held in hundredths of a percent (0 means no reading yet), with the humidifying activity at each reading
+# and the dew point (hundredths of a degree C) and absolute humidity (hundredths of a g/m3) at each reading.
+prev_rh_readings = array("H", [0] * MAX_PREV_RH_READINGS)
+prev_rh_humidifying = [ "off" ] * MAX_PREV_RH_READINGS
+prev_dew_points = array("h", [0] * MAX_PREV_RH_READINGS)
+prev_absolute_humidities = array("H", [0] * MAX_PREV_RH_READINGS)
+
+# RH trend window - the newest RH_TREND_READINGS readings (hundredths of a percent) and when they were read, in a ring
+# with the oldest at trend_index once it is full, and the least squares sums over them - see update_rh_trend().
+# The sums are integers with the times as secs after trend_base_time, so readings leave them exactly as they came in.
+trend_readings = array("H", [0] * RH_TREND_READINGS)
+trend_times = array("i", [0] * RH_TREND_READINGS)
+trend_index = 0            # Where the next reading goes
+trend_count = 0            # Readings in the window
+trend_base_time = 0        # The time the sums' times are measured from - the newest reading's
+trend_sum_t = 0            # Sum of the times
+trend_sum_tt = 0           # Sum of the times squared
+trend_sum_y = 0            # Sum of the readings
+trend_sum_ty = 0           # Sum of the times by the readings
+
+
+# Represents each of the 3 humidifiers (outlets).  Fixed slots and integer seconds keep the records compact.
+# The source of truth for usage is lo_secs, hi_secs and last_setting_time.  The units_* and next_threshold_time fields are
+# the capacity model derived from them - see update_capacity_model().
+#   setting             The setting of the humidifier plugged into this outlet - "hi", "lo" or "off" (off means off or not one plugged in)
+#   energized           Whether this humidifier's outlet is currently energized
+#   filled_time         Time when this humidifier was last filled
+#   last_setting_time   Time when this humidifier's setting was last changed (e.g. between "off" "lo" and "hi")
+#   lo_secs             Number of seconds this humidifier has been run on "lo" since being filled - does not count run time from last_setting_time
+#   hi_secs             Number of seconds this humidifier has been run on "hi" since being filled - does not count run time from last_setting_time
+#   outlet              The outlet number for this humidifier (also its index in this array)
+#   units_used          Tank units used as of units_time
+#   units_time          Time of the last energize/de-energize/setting/refill event
+#   units_rate          Tank units used per second since units_time - 0 unless energized and set to "lo" or "hi"
+#   next_threshold_time Time the humidifier will next cross WARN_PCT, ERROR_PCT or empty, or NO_THRESHOLD_TIME if it never will
+#   switch_time         Time the outlet's relay last switched, or NO_SWITCH_TIME - see RELAY SCHEDULER
+#   start_times         Times the outlet was last energized, the last MAX_RELAY_STARTS_PER_HOUR of them, oldest at start_index
+#   start_index         Where the next start time goes in start_times
+#   switch_pending      Set while a relay switch (to not energized) is deferred
+#   switch_pending_time Time the deferred relay switch will be allowed
+class Humidifier:
+    __slots__ = ("setting", "energized", "filled_time", "last_setting_time", "lo_secs", "hi_secs", "outlet",
+                 "units_used", "units_time", "units_rate", "next_threshold_time",
+                 "switch_time", "start_times", "start_index", "switch_pending", "switch_pending_time")
+
+    def __init__(self, outlet, setting):
+        self.setting = setting
+        self.energized = False
+        self.filled_time = 0
+        self.last_setting_time = clock.time()
+        self.lo_secs = 0
+        self.hi_secs = 0
+        self.outlet = outlet
+        self.units_used = 0
+        self.units_time = self.last_setting_time
+        self.units_rate = 0
+        self.next_threshold_time = NO_THRESHOLD_TIME
+        self.switch_time = NO_SWITCH_TIME
+        self.start_times = array("i", [ NO_SWITCH_TIME ] * MAX_RELAY_STARTS_PER_HOUR)
+        self.start_index = 0
+        self.switch_pending = False
+        self.switch_pending_time = NO_THRESHOLD_TIME
+
+humidifiers = [ Humidifier(0, "lo"),
+                Humidifier(1, "lo"),
+                Humidifier(2, "off") ]
+
+
+##############################################################################################################
+############## BEGIN CAPACITY MODEL ##########################################################################
+##############################################################################################################
+#
+# Remaining capacity is only recalculated on energize/de-energize/setting/refill events.  Between events a humidifier uses
+# its tank at a constant rate, so the units used at any time and the time of the next threshold crossing follow directly.
+#
+
+#
+# Calculate the tank units used for humidifier, from the capacity model
+#
+def calculate_units_used(humidifier):
+    return humidifier.units_used + humidifier.units_rate * (clock.time() - humidifier.units_time)
+
+
+#
+# Recalculate the capacity model for a humidifier from its lo_secs, hi_secs and the time
+# at "lo" or "hi" since the last_setting_time.
+# Call after every change to energized, setting, lo_secs or hi_secs.
+#
+def update_capacity_model(humidifier):
+    now = clock.time()
+    secs_since_setting = now - humidifier.last_setting_time
+    units_used = humidifier.lo_secs * LO_UNITS_PER_SECOND + humidifier.hi_secs * HI_UNITS_PER_SECOND
+    units_rate = 0
+    if humidifier.energized and humidifier.setting == "lo":
+        units_rate = LO_UNITS_PER_SECOND
+    elif humidifier.energized and humidifier.setting == "hi":
+        units_rate = HI_UNITS_PER_SECOND
+    units_used = units_used + units_rate * secs_since_setting
+
+    humidifier.units_used = units_used
+    humidifier.units_time = now
+    humidifier.units_rate = units_rate
+
+    # find the next threshold this humidifier will cross
+    humidifier.next_threshold_time = NO_THRESHOLD_TIME
+    if units_rate > 0:
+        for threshold in CAPACITY_THRESHOLDS:
+            if units_used < threshold:
+                # first second at which units used reaches the threshold
+                humidifier.next_threshold_time = now + (threshold - units_used + units_rate - 1) // units_rate
+                break
+
+    update_next_capacity_event()
+
+
+#
+# Recalculate next_capacity_event_time as the earliest threshold crossing, light switch, deferred relay switch or
+# duty cycle switch
+#
+def update_next_capacity_event():
+    global next_capacity_event_time
+
+    next_time = light_switch_time
+    if duty_switch_time != NO_THRESHOLD_TIME and (next_time == NO_THRESHOLD_TIME or duty_switch_time < next_time):
+        next_time = duty_switch_time
+    for i in range(len(humidifiers)):
+        threshold_time = humidifiers[i].next_threshold_time
+        if threshold_time != NO_THRESHOLD_TIME and (next_time == NO_THRESHOLD_TIME or threshold_time < next_time):
+            next_time = threshold_time
+        if humidifiers[i].switch_pending and (next_time == NO_THRESHOLD_TIME or humidifiers[i].switch_pending_time < next_time):
+            next_time = humidifiers[i].switch_pending_time
+    next_capacity_event_time = next_time
+
+
+#
+# Handle a capacity event that has come due - move each humidifier that crossed a threshold on to its next threshold,
+# and make the deferred relay switches that are now allowed.
+#
+def handle_capacity_event():
+    global light_switch_time
+    global duty_switch_time
+
+    now = clock.time()
+    if light_switch_time != NO_THRESHOLD_TIME and light_switch_time <= now:
+        light_switch_time = NO_THRESHOLD_TIME
+    if duty_switch_time != NO_THRESHOLD_TIME and duty_switch_time <= now:
+        duty_switch_time = NO_THRESHOLD_TIME
+    for i in range(len(humidifiers)):
+        if humidifiers[i].next_threshold_time != NO_THRESHOLD_TIME and humidifiers[i].next_threshold_time <= now:
+            log_message("humidifier %d crossed a capacity threshold at %.1f%% used" % (i, units_to_pct(calculate_units_used(humidifiers[i]))))
+            update_capacity_model(humidifiers[i])
+        if humidifiers[i].switch_pending and humidifiers[i].switch_pending_time <= now:
+            log_message("Making deferred relay switch of humidifier %d" % i)
+            if humidifiers[i].energized:
+                deenergize_humidifier(humidifiers[i])
+            else:
+                energize_humidifier(humidifiers[i])
+    update_next_capacity_event()
+
+
+#
+# Convert tank units to a pct of the tank.  Only used for log messages since it returns a float.
+#
+def units_to_pct(units):
+    return units * 100.0 / TANK_UNITS
+#
+##############################################################################################################
+############### END CAPACITY MODEL ###########################################################################
+##############################################################################################################
+
+
+##############################################################################################################
+############## BEGIN RELAY SCHEDULER #########################################################################
+##############################################################################################################
+#
+# Every change to whether a humidifier is energized passes through here, between the decisions and the relays.  An
+# outlet stays energized for at least MIN_ON_SECS and de-energized for at least MIN_OFF_SECS, and is energized at most
+# MAX_RELAY_STARTS_PER_HOUR times in any hour.  A switch those limits do not allow yet is deferred - held as the
+# humidifier's pending switch, which handle_capacity_event() makes once it is allowed.  If the decisions want the
+# humidifier left as it is before then, the pending switch is suppressed.
+#
+# humidifier.energized stays the relay's actual state, so the capacity model only counts time a humidifier really ran.
+#
+
+#
+# The earliest time a humidifier's relay may next switch, or NO_SWITCH_TIME if it may switch at any time
+#
+def switch_allowed_time(humidifier):
+    if humidifier.switch_time == NO_SWITCH_TIME:
+        return NO_SWITCH_TIME
+    if humidifier.energized:
+        return humidifier.switch_time + MIN_ON_SECS
+    allowed_time = humidifier.switch_time + MIN_OFF_SECS
+    oldest_start_time = humidifier.start_times[humidifier.start_index]
+    if oldest_start_time != NO_SWITCH_TIME and oldest_start_time + 3600 > allowed_time:
+        allowed_time = oldest_start_time + 3600
+    return allowed_time
+
+
+#
+# Whether a humidifier's relay may switch now.  If not, the switch is deferred until it may.
+# A humidifier set to "off" may always be de-energized - it was switched off in the menu.
+#
+def switch_allowed(humidifier):
+    global relay_switches_deferred
+
+    allowed_time = switch_allowed_time(humidifier)
+    if allowed_time <= clock.time() or (humidifier.energized and humidifier.setting == "off"):
+        humidifier.switch_pending = False
+        return True
+    if not humidifier.switch_pending:
+        log_message("Deferring %s humidifier %d for %d secs" % ("de-energizing" if humidifier.energized else "energizing",
+                                                                humidifier.outlet, allowed_time - clock.time()))
+        relay_switches_deferred = relay_switches_deferred + 1
+    elif humidifier.switch_pending_time == allowed_time:
+        return False
+    humidifier.switch_pending = True
+    humidifier.switch_pending_time = allowed_time
+    update_next_capacity_event()
+    return False
+
+
+#
+# The decisions want a humidifier left as it is - suppress its pending switch, if it has one
+#
+def suppress_pending_switch(humidifier):
+    global relay_switches_suppressed
+
+    if not humidifier.switch_pending:
+        return
+    log_message("Suppressing deferred %s of humidifier %d" % ("de-energizing" if humidifier.energized else "energizing", humidifier.outlet))
+    relay_switches_suppressed = relay_switches_suppressed + 1
+    humidifier.switch_pending = False
+    update_next_capacity_event()
+
+
+#
+# Whether the decisions want a humidifier energized - its relay's state, or the state it is waiting to switch to.
+# The decisions count humidifiers by this, so they carry on from what they decided rather than from a deferred relay.
+#
+def wanted_energized(humidifier):
+    return humidifier.energized != humidifier.switch_pending
+
+
+#
+# Note a humidifier's relay switching now, for its limits - call once energized is changed
+#
+def record_switch(humidifier):
+    humidifier.switch_time = clock.time()
+    if humidifier.energized:
+        humidifier.start_times[humidifier.start_index] = humidifier.switch_time
+        humidifier.start_index = (humidifier.start_index + 1) % MAX_RELAY_STARTS_PER_HOUR
+#
+##############################################################################################################
+############### END RELAY SCHEDULER ##########################################################################
+##############################################################################################################
+
+
+##############################################################################################################
+############## BEGIN DUTY CYCLE ##############################################################################
+##############################################################################################################
+#
+# With CONTROL_MODE "duty", light humidifying runs the light humidifier for the first duty_on_secs of each
+# DUTY_WINDOW_SECS window and leaves it off for the rest.  Each window's duty cycle comes from a PI controller on the
+# error - how far current_rh is below duty_target_rh().  The window's start and its switch off are capacity events,
+# so they happen on time rather than at the next automate pass.
+#
+
+#
+# The RH the duty cycle aims for, DUTY_TARGET_FRACTION of the way from low_rh up to on_rh
+#
+def duty_target_rh():
+    return low_rh + (on_rh - low_rh) * DUTY_TARGET_FRACTION
+
+
+#
+# Start a duty cycle window: update the PI controller and work out how long the light humidifier runs in the window.
+# The integral takes in the error over the window just ended, unless that would push a duty cycle already held at
+# 0 or 1 further past it (anti-windup) - so it does not build up while the RH is out of reach.
+# The on and off parts are rounded to none or at least MIN_ON_SECS and MIN_OFF_SECS, as the relay scheduler needs.
+#
+def start_duty_window():
+    global duty_integral
+    global duty_window_time
+    global duty_on_secs
+
+    now = clock.time()
+    error = duty_target_rh() - current_rh
+    integral = duty_integral
+    if duty_window_time != NO_THRESHOLD_TIME:
+        integral = integral + error * (now - duty_window_time)
+    duty = DUTY_KP * error + DUTY_KI * integral
+    if (duty > 1.0 and error > 0) or (duty < 0.0 and error < 0):
+        integral = duty_integral
+        duty = DUTY_KP * error + DUTY_KI * integral
+    duty_integral = integral
+    duty = min(1.0, max(0.0, duty))
+
+    on_secs = int(duty * DUTY_WINDOW_SECS + 0.5)
+    if on_secs < MIN_ON_SECS:
+        on_secs = 0 if on_secs < MIN_ON_SECS // 2 else MIN_ON_SECS
+    if DUTY_WINDOW_SECS - on_secs < MIN_OFF_SECS:
+        on_secs = DUTY_WINDOW_SECS if DUTY_WINDOW_SECS - on_secs < MIN_OFF_SECS // 2 else DUTY_WINDOW_SECS - MIN_OFF_SECS
+    duty_window_time = now
+    duty_on_secs = on_secs
+    log_message("duty cycle %.0f%% for RH %.1f%%, target %.1f%%: on for %d of %d secs"
+                % (duty * 100, current_rh, duty_target_rh(), on_secs, DUTY_WINDOW_SECS))
+
+
+#
+# Whether the light humidifier should be running now, starting a new window when one is due.
+# Schedules the next switch off or window start as a capacity event.
+#
+def duty_cycle_on():
+    global duty_switch_time
+
+    now = clock.time()
+    if duty_window_time == NO_THRESHOLD_TIME or now >= duty_window_time + DUTY_WINDOW_SECS:
+        start_duty_window()
+    on = now < duty_window_time + duty_on_secs
+    if on:
+        switch_time = duty_window_time + duty_on_secs
+    else:
+        switch_time = duty_window_time + DUTY_WINDOW_SECS
+    if switch_time != duty_switch_time:
+        duty_switch_time = switch_time
+        update_next_capacity_event()
+    return on
+
+
+#
+# Light humidifying has ended - the next one starts a fresh window.  The integral is kept, as what the room needs.
+#
+def end_duty_window():
+    global duty_window_time
+    global duty_switch_time
+
+    if duty_window_time == NO_THRESHOLD_TIME:
+        return
+    duty_window_time = NO_THRESHOLD_TIME
+    duty_switch_time = NO_THRESHOLD_TIME
+    update_next_capacity_event()
+#
+##############################################################################################################
+############### END DUTY CYCLE ###############################################################################
+##############################################################################################################
+
+
+##############################################################################################################
+############## BEGIN ACTIONS #################################################################################
+##############################################################################################################
+#
+# Update relay settings for each humidifier based on whether its outlet is energized
+# Turn on or off the outlet's GPIO pin to control the outlet's relay
+#
+def update_relays():
+    global should_refresh_display
+    for i in range(len(outlet_pins)):
+        if humidifiers[i].energized:
+            if outlet_pins[i].value() == 0:
+                log_message("Energizing relay %d" % i)
+                outlet_pins[i].value(1)
+                trace.record_relay(i, 1)
+                should_refresh_display = True
+        else:
+            if outlet_pins[i].value() == 1:
+                log_message("De-energizing relay %d" % i)
+                outlet_pins[i].value(0)
+                trace.record_relay(i, 0)
+                should_refresh_display = True
+
+
+#
+# update humidifier usage - if switching setting from "lo" or "hi", update lo_secs or hi_secs to include the number of seconds
+# it as run at that setting since the last_setting_time.  Reset the humidifier's last_setting_time.
+# This should be called prior to changing the humidifier setting.
+#
+def update_humidifier_usage(humidifier):
+    log_message("Updating usage for humidifier %d" % humidifier.outlet)
+    now = clock.time()
+    if humidifier.energized and humidifier.setting == "lo":
+        humidifier.lo_secs = humidifier.lo_secs + now - humidifier.last_setting_time
+    elif humidifier.energized and humidifier.setting == "hi":
+        humidifier.hi_secs = humidifier.hi_secs + now - humidifier.last_setting_time
+    humidifier.last_setting_time = now
+
+
+#
+# de-energize the humidifier, once the relay scheduler allows it
+# Update this humidifier's usage and set it as not energized
+#
+def deenergize_humidifier(humidifier):
+    if not humidifier.energized:
+        suppress_pending_switch(humidifier)
+        return
+    if not switch_allowed(humidifier):
+        return
+    log_message("De-energizing humidifier %d" % humidifier.outlet)
+    update_humidifier_usage(humidifier)
+    humidifier.energized = False
+    record_switch(humidifier)
+    update_capacity_model(humidifier)
+    update_relays()
+
+
+#
+# energize the humidifier, once the relay scheduler allows it
+# Update this humidifier's usage and set it as energized
+#
+def energize_humidifier(humidifier):
+    if humidifier.energized:
+        suppress_pending_switch(humidifier)
+        return
+    if not switch_allowed(humidifier):
+        return
+    log_message("Energizing humidifier %d" % humidifier.outlet)
+    update_humidifier_usage(humidifier)
+    humidifier.energized = True
+    record_switch(humidifier)
+    update_capacity_model(humidifier)
+    update_relays()
+
+
+#
+# Calculate needed humidifying setting.  Will return "off", "light" or "heavy" - FAILSAFE_HUMIDIFYING while the RH is stale
+#
+def determine_needed_humidifying():
+    global failsafe
+
+    if rh_is_stale():
+        if not failsafe:
+            log_message("##### RH is %d secs old, fail-safe humidifying %s" % (clock.time() - current_rh_time, FAILSAFE_HUMIDIFYING))
+            failsafe = True
+        return FAILSAFE_HUMIDIFYING
+    if failsafe:
+        log_message("RH is fresh again, leaving fail-safe")
+        failsafe = False
+
+    if humidifying == "off":
+        if current_rh > on_rh_off_debounced:
+            needed_humidifying = "off"
+        elif current_rh > low_rh_off_debounced:
+            needed_humidifying = "light"
+        else:
+            needed_humidifying = "heavy"
+    elif humidifying == "light":
+        if current_rh > on_rh_on_debounced:
+            needed_humidifying = "off"
+        elif current_rh < low_rh_off_debounced:
+            needed_humidifying = "heavy"
+        else:
+            needed_humidifying = "light"
+    else: # heavy
+        if current_rh > on_rh_on_debounced:
+            needed_humidifying = "off"
+        elif current_rh > low_rh_on_debounced:
+            needed_humidifying = "light"
+        else:
+            needed_humidifying = "heavy"
+    if (PREDICTIVE_ENABLED and needed_humidifying == humidifying and predicted_switch_time != NO_THRESHOLD_TIME
+            and clock.time() >= predicted_switch_time):
+        log_message("RH %.2f%% predicted to cross a threshold soon, switching to %s early" % (current_rh, predicted_humidifying))
+        needed_humidifying = predicted_humidifying
+    if needed_humidifying != humidifying:
+        log_message("determine_needed_humidifying determined %s" % needed_humidifying)
+    return needed_humidifying
+
+
+#
+# Whether current_rh is too old to decide from - the sensor has not been read for RH_STALE_SECS
+#
+def rh_is_stale():
+    return clock.time() - current_rh_time > RH_STALE_SECS
+
+
+#
+# Recalculate the debounced RH thresholds used by determine_needed_humidifying.
+# Call whenever on_rh or low_rh change, so the automation does not do float math on every pass.
+#
+def update_debounced_thresholds():
+    global on_rh_on_debounced
+    global on_rh_off_debounced
+    global low_rh_on_debounced
+    global low_rh_off_debounced
+    on_rh_on_debounced   = on_rh + DEBOUNCE_RH_AMOUNT
+    on_rh_off_debounced  = on_rh - DEBOUNCE_RH_AMOUNT
+    low_rh_on_debounced  = low_rh + DEBOUNCE_RH_AMOUNT
+    low_rh_off_debounced = low_rh - DEBOUNCE_RH_AMOUNT
+    update_rh_projection()
+
+
+#
+# Find the least used humidifier with the given setting, optionally only considering (wanted) energized humidifiers.
+# Returns its outlet, or -1 if there is no such humidifier.  Ties go to the lowest outlet.
+#
+def least_used_humidifier(setting, energized_only):
+    least_used = -1
+    least_units = 0
+    for i in range(len(humidifiers)):
+        if humidifiers[i].setting != setting:
+            continue
+        if energized_only and not wanted_energized(humidifiers[i]):
+            continue
+        units = calculate_units_used(humidifiers[i])
+        if least_used < 0 or units < least_units:
+            least_used = i
+            least_units = units
+    return least_used
+
+
+#
+# Count the (wanted) energized humidifiers with the given setting
+#
+def count_energized(setting):
+    count = 0
+    for i in range(len(humidifiers)):
+        if wanted_energized(humidifiers[i]) and humidifiers[i].setting == setting:
+            count = count + 1
+    return count
+
+
+#
+# True if the the pick of humidifier to use is lo, or False for should use hi one
+#
+def potential_use_lo_other_humidifier(least_lo, least_hi):
+    # is there a lo and the least_used lo is not error?  Choose it
+    if least_lo >= 0 and calculate_units_used(humidifiers[least_lo]) < ERROR_UNITS_USED:
+        return True
+    # then is there a hi and the last used hi is not error?  Choose it
+    if least_hi >= 0 and calculate_units_used(humidifiers[least_hi]) < ERROR_UNITS_USED:
+        return False
+    # only humidifiers in ERROR state, pick lo if exists
+    if least_lo >= 0:
+        return True
+    else:
+        return False
+
+
+#
+# Energize the least used lo humidifier, or the least used hi if no lo is available,
+# preferring ones that are not at ERROR_PCT.
+#
+def energize_least_used(least_lo, least_hi):
+    global no_humidifier_available
+
+    # if any lo humidifiers, use the least used one if not error level
+    if least_lo >= 0:
+        if calculate_units_used(humidifiers[least_lo]) < ERROR_UNITS_USED:
+            log_message("light energizing lo humidifier %d" % least_lo)
+            energize_humidifier(humidifiers[least_lo])
+            return
+    # no lo available, least used hi
+    if least_hi >= 0:
+        if calculate_units_used(humidifiers[least_hi]) < ERROR_UNITS_USED:
+            log_message("light energizing hi humidifier %d" % least_hi)
+            energize_humidifier(humidifiers[least_hi])
+            return
+    # no non-error humidifiers.  Energize any humidifiers
+    if least_lo >= 0:
+        log_message("light desparately energizing lo humidifier %d at %.3f%% used" % (least_lo, units_to_pct(calculate_units_used(humidifiers[least_lo]))))
+        energize_humidifier(humidifiers[least_lo])
+        return
+    if least_hi >= 0:
+        log_message("light desparately energizing hi humidifier %d at %.3f%% used" % (least_hi, units_to_pct(calculate_units_used(humidifiers[least_hi]))))
+        energize_humidifier(humidifiers[least_hi])
+        return
+
+    # NO humidifier available - but need one!  Main sets the led
+    no_humidifier_available = True
+    log_message("NO HUMIDIFIER AVAILALBE!!!")
+
+
+#
+# Switch light humidifying from one humidifier to another
+#
+def switch_light_humidifier(from_outlet, to_outlet):
+    log_message("light switching from %s[%d] at %.1f%% used to %s[%d] at %.1f%% used" % (humidifiers[from_outlet].setting, from_outlet, units_to_pct(calculate_units_used(humidifiers[from_outlet])),
+                                                                                         humidifiers[to_outlet].setting, to_outlet, units_to_pct(calculate_units_used(humidifiers[to_outlet]))))
+    deenergize_humidifier(humidifiers[from_outlet])
+    energize_humidifier(humidifiers[to_outlet])
+
+
+#
+# Schedule a capacity event for when the energized light humidifier will have used more than SWITCH_UNITS more than
+# the least used one, which is currently units_ahead.
+#
+def schedule_light_switch(humidifier, units_ahead):
+    global light_switch_time
+
+    switch_time = NO_THRESHOLD_TIME
+    if humidifier.units_rate > 0:
+        switch_time = clock.time() + (SWITCH_UNITS - units_ahead) // humidifier.units_rate + 1
+    if switch_time != light_switch_time:
+        light_switch_time = switch_time
+        update_next_capacity_event()
+
+
+#
+# Choose which humidifier to use for light humidifying.
+# When the current choice stays the same this does not allocate, so it is safe in the steady state loop.
+#
+def choose_humidifiers_light():
+
+    # see what humidifiers are currently energized, and which are least used
+    energized_lo_count = count_energized("lo")
+    energized_hi_count = count_energized("hi")
+    energized_lo = least_used_humidifier("lo", True)
+    energized_hi = least_used_humidifier("hi", True)
+    least_lo = least_used_humidifier("lo", False)
+    least_hi = least_used_humidifier("hi", False)
+
+    # if none are currently energized...
+    if energized_lo_count + energized_hi_count == 0:
+        log_message("choose_humidifiers_light found no energized humidifiers")
+        energize_least_used(least_lo, least_hi)
+        return
+
+    # is one lo and only one lo already on?
+    if energized_lo_count + energized_hi_count == 1:
+
+        # should we try to swtich to the least used lo or hi humidifier
+        try_lo = potential_use_lo_other_humidifier(least_lo, least_hi)
+
+        # if currently using the lo first low and the pick is lo, continue to do so
+        if try_lo and energized_lo >= 0 and energized_lo == least_lo:
+            energize_humidifier(humidifiers[energized_lo])
+            return
+
+        # if currently using the hi first low and the pick is hi, continue to do so
+        if not try_lo and energized_hi >= 0 and energized_hi == least_hi:
+            energize_humidifier(humidifiers[energized_hi])
+            return
+
+        # If currently using hi and should use lo, switch
+        if energized_hi >= 0 and try_lo:
+            # switch to lo humidifiers
+            switch_light_humidifier(energized_hi, least_lo)
+            return
+
+        # If currently using lo and should use hi, switch
+        if energized_lo >= 0 and not try_lo:
+            # switch to hi humidifiers
+            switch_light_humidifier(energized_lo, least_hi)
+            return
+
+        # we're using a lo or hi that is not the one picked, is it worth switching?
+        if try_lo:
+            energized = energized_lo
+            least = least_lo
+        else:
+            energized = energized_hi
+            least = least_hi
+        # if the least used is more than SWITCH_PCT above current one, switch to it
+        # unused at 40% used, energized at 70% used
+        units_ahead = calculate_units_used(humidifiers[energized]) - calculate_units_used(humidifiers[least])
+        if units_ahead > SWITCH_UNITS:
+            switch_light_humidifier(energized, least)
+            return
+        # not worth switching yet, continue with current one.
+        # Only the energized one is using its tank, so schedule the first second at which it will be worth switching.
+        energize_humidifier(humidifiers[energized])
+        schedule_light_switch(humidifiers[energized], units_ahead)
+        return
+
+
+    # choose from scratch!
+    # de-energize all and we'll energize the one we want to use
+    log_message("choose_humidifiers_light found %d lo, %d hi energized, choosing from scratch" % (energized_lo_count, energized_hi_count))
+    for i in range(len(humidifiers)):
+        deenergize_humidifier(humidifiers[i])
+    energize_least_used(least_lo, least_hi)
+
+
+#
+# For heavy, energize all humidifiers - energizing one that already is keeps it energized
+#
+def choose_humidifiers_heavy():
+
+    for i in range(len(humidifiers)):
+        if humidifiers[i].setting != "off":
+            energize_humidifier(humidifiers[i])
+
+
+#
+# Determine what to energize
+#
+def automate_energizing():
+    global humidifying
+    global humidifying_time
+    previous_humidifying = humidifying
+    needed_humidifying = determine_needed_humidifying()
+
+    # ensure any humidifiers set as off are deenergized
+    for i in range(len(humidifiers)):
+        if humidifiers[i].setting == "off":
+            deenergize_humidifier(humidifiers[i])
+
+    if needed_humidifying != "light":
+        end_duty_window()
+
+    if needed_humidifying == "off":
+        if humidifying != "off":
+            log_message("humidifying turning off, current_rh = %.1f%%, above %.1f%% (debounce=%.1f%%), staying off" % (current_rh, on_rh, DEBOUNCE_RH_AMOUNT))
+            humidifying = "off"
+            for i in range(len(humidifiers)):
+                deenergize_humidifier(humidifiers[i])
+
+    elif needed_humidifying == "light":
+        if CONTROL_MODE == "duty" and not duty_cycle_on():
+            # the off part of the duty cycle window
+            for i in range(len(humidifiers)):
+                deenergize_humidifier(humidifiers[i])
+        else:
+            choose_humidifiers_light()
+        humidifying = "light"
+    else:
+        choose_humidifiers_heavy()
+        humidifying = "heavy"
+
+    if humidifying != previous_humidifying:
+        humidifying_time = clock.time()
+        update_rh_projection()
+
+
+#
+# Set a humidifier as refilled
+#
+def humidifier_refilled(humidifier):
+    humidifier.filled_time = clock.time()
+    humidifier.last_setting_time = clock.time()
+    humidifier.lo_secs = 0
+    humidifier.hi_secs = 0
+    update_capacity_model(humidifier)
+
+
+#
+# Set a humidifier setting
+#
+def humidifier_setting(humidifier, new_setting):
+    update_humidifier_usage(humidifier)
+    humidifier.setting = new_setting
+    update_capacity_model(humidifier)
+
+
+#
+# Set the "on" or "low" RH threshold
+#
+def set_rh_threshold(which_one, rh_value):
+    global on_rh
+    global low_rh
+
+    if which_one == "on":
+        on_rh = rh_value
+    else:
+        low_rh = rh_value
+    update_debounced_thresholds()
+#
+##############################################################################################################
+############### END ACTIONS ##################################################################################
+##############################################################################################################
+
+
+
+
+##############################################################################################################
+################ BEGIN RH HISTORY ############################################################################
+##############################################################################################################
+#
+# Work out current_dew_point and current_absolute_humidity from current_rh and current_temperature
+#
+def update_moisture():
+    global current_dew_point
+    global current_absolute_humidity
+
+    rh = int(current_rh * 100 + 0.5)
+    temperature = int(current_temperature * 100 + (0.5 if current_temperature >= 0 else -0.5))
+    current_dew_point = moisture.dew_point(rh, temperature)
+    current_absolute_humidity = moisture.absolute_humidity(rh, temperature)
+
+
+#
+# Keep a rolling buffer of RH readings, with the dew point and absolute humidity from update_moisture(), and add the
+# reading to the trend window.  Call once current_rh_time is set.
+#
+def record_rh(rh):
+    for i in range(0, MAX_PREV_RH_READINGS - 1):
+        prev_rh_readings[i] = prev_rh_readings[i+1]
+        prev_rh_humidifying[i] = prev_rh_humidifying[i+1]
+        prev_dew_points[i] = prev_dew_points[i+1]
+        prev_absolute_humidities[i] = prev_absolute_humidities[i+1]
+    prev_rh_readings[MAX_PREV_RH_READINGS - 1] = int(rh * 100 + 0.5)
+    prev_rh_humidifying[MAX_PREV_RH_READINGS - 1] = humidifying
+    prev_dew_points[MAX_PREV_RH_READINGS - 1] = current_dew_point
+    prev_absolute_humidities[MAX_PREV_RH_READINGS - 1] = current_absolute_humidity
+    add_trend_reading(prev_rh_readings[MAX_PREV_RH_READINGS - 1], current_rh_time)
+
+
+#
+# Add a reading to the trend window, dropping the oldest once it is full.  O(1) - the sums are moved to the new
+# reading's time and the leaving reading is taken out of them, rather than the window being summed again.
+# Placeholder readings (0) are ignored.
+#   reading     the reading in hundredths of a percent
+#   time        clock.time() it was read
+#
+def add_trend_reading(reading, time):
+    global trend_index
+    global trend_count
+    global trend_base_time
+    global trend_sum_t
+    global trend_sum_tt
+    global trend_sum_y
+    global trend_sum_ty
+
+    if reading == 0:
+        return
+    # measure the times from the new reading's time
+    shift = time - trend_base_time
+    trend_sum_ty = trend_sum_ty - shift * trend_sum_y
+    trend_sum_tt = trend_sum_tt - 2 * shift * trend_sum_t + trend_count * shift * shift
+    trend_sum_t = trend_sum_t - trend_count * shift
+    trend_base_time = time
+
+    if trend_count == RH_TREND_READINGS:
+        t = trend_times[trend_index] - time
+        y = trend_readings[trend_index]
+        trend_sum_t = trend_sum_t - t
+        trend_sum_tt = trend_sum_tt - t * t
+        trend_sum_y = trend_sum_y - y
+        trend_sum_ty = trend_sum_ty - t * y
+        trend_count = trend_count - 1
+
+    # the new reading is at time 0, so only adds to the count and the readings' sum
+    trend_sum_y = trend_sum_y + reading
+    trend_count = trend_count + 1
+    trend_readings[trend_index] = reading
+    trend_times[trend_index] = time
+    trend_index = (trend_index + 1) % RH_TREND_READINGS
+
+
+#
+# Empty the trend window
+#
+def clear_trend_window():
+    global trend_index
+    global trend_count
+    global trend_sum_t
+    global trend_sum_tt
+    global trend_sum_y
+    global trend_sum_ty
+
+    trend_index = 0
+    trend_count = 0
+    trend_sum_t = 0
+    trend_sum_tt = 0
+    trend_sum_y = 0
+    trend_sum_ty = 0
+
+
+#
+# Time of the oldest reading in the trend window - only meaningful while there is one
+#
+def trend_oldest_time():
+    return trend_times[(trend_index - trend_count) % RH_TREND_READINGS]
+
+
+#
+# Update rh_rate from the trend window's least squares slope, and the rh_trend arrow from the rate.
+# Call after each new reading has been added.
+#
+def update_rh_trend():
+    global rh_rate
+    global rh_trend
+
+    denominator = trend_count * trend_sum_tt - trend_sum_t * trend_sum_t
+    if trend_count < RH_TREND_MIN_READINGS or denominator == 0:
+        log_message("Too few RH readings to trend.")
+        rh_rate = 0.0
+        rh_trend = 0
+        return
+    # hundredths of a percent a second, to percent an hour
+    rh_rate = (trend_count * trend_sum_ty - trend_sum_t * trend_sum_y) * 36 / denominator
+    if rh_rate < -RH_TREND_EVEN_RATE:
+        rh_trend = -1
+    elif rh_rate > RH_TREND_EVEN_RATE:
+        rh_trend = 1
+    else:
+        rh_trend = 0
+#
+##############################################################################################################
+################# END RH HISTORY #############################################################################
+##############################################################################################################
+
+
+##############################################################################################################
+############## BEGIN RH PREDICTION ###########################################################################
+##############################################################################################################
+#
+# Learn how fast the RH moves with each humidifying activity, and predict when it will cross the threshold that
+# ends the current activity so the switch can be made early - before the humidifiers' lag carries the RH past it.
+# The rates are float math, so it is done once a reading (or when humidifying changes), leaving the automation and
+# the graph integer times and steps.
+#
+
+#
+# Learn the RH rate of the current humidifying activity from a new reading.  Only from readings a reading period
+# apart with the same activity all the way between them - a switch part way through would mix two rates.
+#   previous_rh         the reading before this one
+#   previous_rh_time    when it was read - 0 if there was none
+#
+def learn_rh_slope(previous_rh, previous_rh_time):
+    secs = current_rh_time - previous_rh_time
+    if previous_rh_time == 0 or humidifying_time > previous_rh_time or failsafe or secs <= 0 or secs > 2 * RH_UPDATE_SECS:
+        return
+    slope = (current_rh - previous_rh) * 3600 / secs
+    if rh_slope_samples[humidifying] == 0:
+        rh_slopes[humidifying] = slope
+    else:
+        rh_slopes[humidifying] = rh_slopes[humidifying] + RH_SLOPE_FORGETTING * (slope - rh_slopes[humidifying])
+    if rh_slope_samples[humidifying] < RH_SLOPE_MIN_SAMPLES:
+        rh_slope_samples[humidifying] = rh_slope_samples[humidifying] + 1
+
+
+#
+# Project the RH at the current activity's learned rate and work out predicted_switch_time - when, allowing the
+# lead, it will cross the threshold that ends the activity.  Call after each reading and when humidifying changes.
+#
+def update_rh_projection():
+    global predicted_switch_time
+    global predicted_humidifying
+    global projection_known
+    global projected_rh_step
+    global predicted_switch_readings
+
+    predicted_switch_time = NO_THRESHOLD_TIME
+    if rh_slope_samples[humidifying] >= RH_SLOPE_MIN_SAMPLES:
+        rate = rh_slopes[humidifying]
+    elif trend_count >= RH_TREND_MIN_READINGS and trend_oldest_time() >= humidifying_time:
+        # not learned yet, but every reading in the trend window is with this activity - its slope will do
+        rate = rh_rate
+    else:
+        projection_known = False
+        return
+    projection_known = current_rh_time != 0
+    if not projection_known:
+        return
+    projected_rh_step = int(rate * RH_UPDATE_SECS / 36)
+    if humidifying_time > current_rh_time:
+        # no reading with this activity yet - the rate only applies once it has started, so wait for one
+        return
+    if humidifying == "off" and rate < 0:
+        threshold, next_humidifying, lead_secs = on_rh_off_debounced, "light", PREDICT_ENERGIZE_SECS
+    elif humidifying == "light" and rate > 0:
+        threshold, next_humidifying, lead_secs = on_rh_on_debounced, "off", PREDICT_RELEASE_SECS
+    elif humidifying == "light" and rate < 0:
+        threshold, next_humidifying, lead_secs = low_rh_off_debounced, "heavy", PREDICT_ENERGIZE_SECS
+    elif humidifying == "heavy" and rate > 0:
+        threshold, next_humidifying, lead_secs = low_rh_on_debounced, "light", PREDICT_RELEASE_SECS
+    else:
+        return
+    crossing_secs = (threshold - current_rh) * 3600 / rate
+    if crossing_secs < 0:
+        # already past it - determine_needed_humidifying switches without a prediction
+        return
+    lead_secs = min(lead_secs, PREDICT_MAX_RH * 3600 / abs(rate))
+    predicted_switch_time = current_rh_time + int(crossing_secs - lead_secs)
+    predicted_humidifying = next_humidifying
+    predicted_switch_readings = (predicted_switch_time - current_rh_time) // RH_UPDATE_SECS + 1
+#
+##############################################################################################################
+############### END RH PREDICTION ############################################################################
+##############################################################################################################
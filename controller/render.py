@@ -0,0 +1,477 @@
+# 3 humidifier controller - rendering
+#
+# The display, the LED, and the screens drawn outside of the menus: the humidifier bars screen,
+# the heartbeat circle and error text.
+
+import gc
+from picographics import PicoGraphics, DISPLAY_PICO_DISPLAY, PEN_P4, PEN_P8, PEN_RGB565
+from pimoroni import RGBLED
+from controller.config import *
+from controller import clock
+from controller.logger import log_message, flush_log
+from controller import history
+from controller import policy
+
+
+display = None                      # The PicoGraphics display - see setup_display()
+LED = None                          # The RGB LED on the display pack
+WIDTH = DISPLAY_WIDTH
+HEIGHT = DISPLAY_HEIGHT
+HALF_HEIGHT = int(HEIGHT/2)
+HALF_WIDTH = int(WIDTH/2)
+HISTORY_WIDTH = WIDTH - RH_PROJECTION_PIXELS if PREDICTIVE_ENABLED else WIDTH   # pixels of the graph for the RH history
+
+heartbeat_on = False                # indicator of whether the heartbeat circle is currently shown or not - gets toggled at heartbeat interval
+backlight_dimmed = False            # set while the backlight is dimmed - see update_backlight()
+
+GRAPH_VIEWS = ( "rh", "dew_point", "absolute_humidity" )   # what the bars screen's number and graph can show
+GRAPH_VIEW_LABELS = { "dew_point" : "dew point", "absolute_humidity" : "g/m3" }   # shown in place of the RH rate
+graph_view = "rh"                   # what the bars screen's number and graph show - see next_graph_view()
+GRAPH_SPANS = ( None, history.hourly, history.daily )   # what the graph is drawn from - the readings, or a history tier
+GRAPH_SPAN_TICKS = ( TICK_INTERVAL, 24, 7 )             # periods between ticks for each span - every day, every week
+GRAPH_SPAN_LABELS = ( "", "%d days" % (HOURLY_HISTORY_HOURS // 24), "%d days" % DAILY_HISTORY_DAYS )   # shown top right
+graph_span = 0                      # index in GRAPH_SPANS of what the graph spans - see next_graph_span()
+
+# Text shown on the bars screen, formatted ahead of time so refreshing the screen does not allocate
+PCT_TEXTS = [ "%d" % pct for pct in range(101) ]   # text for each whole pct available
+rh_text = ""                                       # text for the current value graph_view shows
+rh_text_value = -1.0                               # value that rh_text was formatted from
+rh_text_view = ""                                  # graph_view that rh_text was formatted for
+rate_text = ""                                     # text for policy.rh_rate
+rate_text_value = -1000.0                          # policy.rh_rate value that rate_text was formatted from
+sensor_text = ""                                   # sensor fault text - see sensor_fault_text()
+sensor_text_failed = -1                            # policy.failed_readings sensor_text was formatted from
+sensor_text_minutes = -1                           # minutes stale sensor_text was formatted from, -1 if not stale
+
+# Lightning bolt polygon for each outlet, at the "hi" and "lo" bar positions
+LIGHTNING_POLYGONS_HI = []
+LIGHTNING_POLYGONS_LO = []
+for i in range(len(HI_X_MIN)):
+    LIGHTNING_POLYGONS_HI.append([ (x + HI_X_MIN[i] + (HI_X_MAX[i] - HI_X_MIN[i]) // 2, y + HALF_HEIGHT) for x, y in LIGHTNING_POLYGON ])
+    LIGHTNING_POLYGONS_LO.append([ (x + LO_X_MIN[i] + (LO_X_MAX[i] - LO_X_MIN[i]) // 2, y + HALF_HEIGHT) for x, y in LIGHTNING_POLYGON ])
+
+
+##############################################################################################################
+############## BEGIN DISPLAY SETUP ###########################################################################
+##############################################################################################################
+#
+# Create the display and its pens, and the LED
+#
+def setup_display():
+    global display, WIDTH, HEIGHT, HALF_HEIGHT, HALF_WIDTH, HISTORY_WIDTH
+    global RED, ORANGE, YELLOW, GREEN, INDIGO, VIOLET, WHITE, PINK, BLUE, BROWN, BLACK, MAGENTA, CYAN, GRAY
+    global PREV_RH_GRAPH_COLORS
+    global LED
+
+    gc.collect()
+    mem_free_before_display = gc.mem_free()
+    if DISPLAY_PEN_TYPE == "P4":
+        display = PicoGraphics(display=DISPLAY_PICO_DISPLAY, rotate=0, pen_type=PEN_P4)
+    elif DISPLAY_PEN_TYPE == "P8":
+        display = PicoGraphics(display=DISPLAY_PICO_DISPLAY, rotate=0, pen_type=PEN_P8)
+    else:
+        display = PicoGraphics(display=DISPLAY_PICO_DISPLAY, rotate=0, pen_type=PEN_RGB565)
+    display.set_backlight(BACKLIGHT_BRIGHTNESS)
+    WIDTH, HEIGHT = display.get_bounds()
+    HALF_HEIGHT = int(HEIGHT/2)
+    HALF_WIDTH = int(WIDTH/2)
+    HISTORY_WIDTH = WIDTH - RH_PROJECTION_PIXELS if PREDICTIVE_ENABLED else WIDTH
+
+    # List of available pen colours, add more if necessary.
+    # In a palette pen type each create_pen() takes the next palette entry, so these build the palette once at startup.
+    RED     = display.create_pen(209,  34,  41)
+    ORANGE  = display.create_pen(246, 138,  30)
+    YELLOW  = display.create_pen(255, 216,   0)
+    GREEN   = display.create_pen(  0, 121,  64)
+    INDIGO  = display.create_pen( 36,  64, 142)
+    VIOLET  = display.create_pen(115,  41, 130)
+    WHITE   = display.create_pen(255, 255, 255)
+    PINK    = display.create_pen(255, 175, 200)
+    BLUE    = display.create_pen(116, 215, 238)
+    BROWN   = display.create_pen( 97,  57,  21)
+    BLACK   = display.create_pen(  0,   0,   0)
+    MAGENTA = display.create_pen(255,  33, 140)
+    CYAN    = display.create_pen( 33, 177, 255)
+    GRAY    = display.create_pen( 24,  24,  24)
+    PEN_COUNT = 14
+
+    if DISPLAY_PEN_TYPE in PALETTE_SIZES and PEN_COUNT > PALETTE_SIZES[DISPLAY_PEN_TYPE]:
+        log_message("%d pens do not fit the %s palette of %d" % (PEN_COUNT, DISPLAY_PEN_TYPE, PALETTE_SIZES[DISPLAY_PEN_TYPE]))
+
+    PREV_RH_GRAPH_COLORS = { "off"  : GREEN, "light" : YELLOW, "heavy" : MAGENTA }
+
+    gc.collect()
+    log_message("Display pen type %s: mem free %d before display setup, %d after" % (DISPLAY_PEN_TYPE, mem_free_before_display, gc.mem_free()))
+
+    LED = RGBLED(6, 7, 8) # pins 6, 7, 8
+    LED.set_rgb(0, 0, 0)
+
+
+#
+# Dim the backlight, or bring it back, as needed
+#   active  whether someone is using the controller - a button was pressed recently
+#
+def update_backlight(active):
+    global backlight_dimmed
+
+    if active and backlight_dimmed:
+        display.set_backlight(BACKLIGHT_BRIGHTNESS)
+        backlight_dimmed = False
+    elif not active and not backlight_dimmed:
+        display.set_backlight(BACKLIGHT_DIM_BRIGHTNESS)
+        backlight_dimmed = True
+##############################################################################################################
+############### END DISPLAY SETUP ############################################################################
+##############################################################################################################
+
+
+
+
+##############################################################################################################
+########### BEGIN ERROR TEXT DISPLAY #########################################################################
+##############################################################################################################
+#
+# Display the error text on the display
+#
+def display_error_text(error_text):
+    if LOG_TO_CONSOLE:
+        print("ERROR TEXT: " + error_text)
+    log_message("ERROR TEXT: " + error_text)
+    display.set_pen(RED)
+    display.set_font("bitmap6")
+    display.text(error_text, 0, 0, wordwrap=HEIGHT)
+    display.update()
+    flush_log()
+##############################################################################################################
+############ END ERROR TEXT DISPLAY ##################$#######################################################
+##############################################################################################################
+
+
+
+##############################################################################################################
+############### BEGIN LED CONTROL ############################################################################
+##############################################################################################################
+#
+def clear_led():
+    LED.set_rgb(0, 0, 0)
+
+def led_red(bright=False):
+    if bright:
+        LED.set_rgb(128, 0, 0)
+    else:
+        LED.set_rgb(8, 0, 0)
+
+def led_green(bright=False):
+    if bright:
+        LED.set_rgb(0, 128, 0)
+    else:
+        LED.set_rgb(0, 8, 0)
+
+def led_rgb(r, g, b):
+    LED.set_rgb(r, g, b)
+#
+##############################################################################################################
+################ END LED CONTROL #############################################################################
+##############################################################################################################
+
+
+
+
+##############################################################################################################
+########## BEGIN HUMIDIFIER BARS SCREEN ######################################################################
+##############################################################################################################
+#
+# Calculate the Y value for a RH value given in hundredths of a percent
+#
+def calculate_RH_y(rh, max_y):
+    if rh == 0:
+        return -1
+    return calculate_value_y(rh, MIN_RH_PLOT_PCT * 100, MAX_RH_PLOT_PCT * 100, max_y)
+
+
+#
+# Calculate the Y value for a value between min_value and max_value (clamped to them), all in hundredths
+#
+def calculate_value_y(value, min_value, max_value, max_y):
+    if value > max_value:
+        value = max_value
+    if value < min_value:
+        value = min_value
+    return max_y - (value - min_value) * max_y // (max_value - min_value)
+
+
+#
+# Show the next of GRAPH_VIEWS on the bars screen
+#
+def next_graph_view():
+    global graph_view
+
+    graph_view = GRAPH_VIEWS[(GRAPH_VIEWS.index(graph_view) + 1) % len(GRAPH_VIEWS)]
+    log_message("Bars screen showing %s" % graph_view)
+
+
+#
+# Zoom the bars screen's graph out (step 1) or in (step -1) through GRAPH_SPANS, round to the other end
+#
+def next_graph_span(step):
+    global graph_span
+
+    graph_span = (graph_span + step) % len(GRAPH_SPANS)
+    if GRAPH_SPANS[graph_span] is None:
+        log_message("Bars screen graph showing the readings")
+    else:
+        log_message("Bars screen graph showing %s" % GRAPH_SPAN_LABELS[graph_span])
+
+
+#
+# Plot a history tier across the graph, one column per period with the newest at the right: the min to max of the
+# quantity as a band and the mean as a line across it, with a tick every ticks periods back.  Periods with no
+# readings are left out.
+#
+def plot_tier(tier, quantity, min_value, max_value, ticks):
+    column_width = max(1, WIDTH // tier.entries)
+    max_y = HALF_HEIGHT - 10
+    for i in range(tier.entries):
+        if tier.means[0][i] == 0:
+            continue
+        x = WIDTH - (tier.entries - i) * column_width
+        top_y = calculate_value_y(tier.maxes[quantity][i], min_value, max_value, max_y)
+        bottom_y = calculate_value_y(tier.mins[quantity][i], min_value, max_value, max_y)
+        display.set_pen(INDIGO)
+        display.rectangle(x, top_y, column_width, bottom_y - top_y + 1)
+        display.set_pen(WHITE)
+        display.rectangle(x, calculate_value_y(tier.means[quantity][i], min_value, max_value, max_y), column_width, 1)
+        if (tier.entries - 1 - i) % ticks == 0 and i < tier.entries - 1:
+            display.set_pen(BLUE)
+            display.pixel(x, 0)
+            display.pixel(x, 1)
+            display.pixel(x, max_y)
+            display.pixel(x, max_y - 1)
+
+
+#
+# The text for a sensor fault - the failed readings so far and, once the RH is stale, how old it is and the fail-safe.
+# Only formatted again when what it shows changes.
+#
+def sensor_fault_text(stale):
+    global sensor_text
+    global sensor_text_failed
+    global sensor_text_minutes
+
+    minutes = (clock.time() - policy.current_rh_time) // 60 if stale else -1
+    if policy.failed_readings != sensor_text_failed or minutes != sensor_text_minutes:
+        if stale:
+            sensor_text = "SENSOR FAILED - RH %dm OLD, %s" % (minutes, FAILSAFE_HUMIDIFYING.upper())
+        else:
+            sensor_text = "SENSOR RETRY %d" % policy.failed_readings
+        sensor_text_failed = policy.failed_readings
+        sensor_text_minutes = minutes
+    return sensor_text
+
+
+#
+# Display the humidifier bars screen.  This includes:
+#   RH history graph in background on top half - the readings, or the hourly or daily history as X and Y zoom it
+#   Current RH % in text format on top half.
+#   RH trend arrow after the current RH on top half.
+#   Capacity bar for each humidifier on bottom half.
+#   Lightning bolt for each energized humidifier on bottom half.
+#
+# Nothing here allocates unless current_rh or a sensor fault has changed since the last refresh, so it is safe in the
+# steady state loop.
+#
+def display_humidifier_bars():
+    global rh_text
+    global rh_text_value
+    global rh_text_view
+    global rate_text
+    global rate_text_value
+
+    # clear the display
+    display.set_pen(BLACK)
+    display.clear()
+
+    # show RH plot in background - or the dew point or absolute humidity, as graph_view says.
+    # Include a "tick" (additional pixels) at every TICK_INTERVAL - which if set correctly should align with each hour back
+    # Only the newest HISTORY_WIDTH readings are plotted, one per pixel - unless X or Y has zoomed out to a history tier
+    if graph_view == "dew_point":
+        values, min_value, max_value = policy.prev_dew_points, MIN_DEW_POINT_PLOT_C * 100, MAX_DEW_POINT_PLOT_C * 100
+    elif graph_view == "absolute_humidity":
+        values, min_value, max_value = policy.prev_absolute_humidities, MIN_ABSOLUTE_PLOT_G * 100, MAX_ABSOLUTE_PLOT_G * 100
+    else:
+        values, min_value, max_value = policy.prev_rh_readings, MIN_RH_PLOT_PCT * 100, MAX_RH_PLOT_PCT * 100
+    if GRAPH_SPANS[graph_span] is not None:
+        plot_tier(GRAPH_SPANS[graph_span], history.HISTORY_QUANTITIES.index(graph_view), min_value, max_value,
+                  GRAPH_SPAN_TICKS[graph_span])
+    else:
+        since_tick = 0
+        draw_tick = False
+        first_plotted = MAX_PREV_RH_READINGS - HISTORY_WIDTH
+        for i in range(HISTORY_WIDTH - 1, 0, -1):
+            if since_tick >= TICK_INTERVAL:
+                draw_tick = True
+                since_tick = 0
+            else:
+                since_tick = since_tick + 1
+            reading = policy.prev_rh_readings[first_plotted + i]
+            if reading > 0:
+                rh_y = calculate_value_y(values[first_plotted + i], min_value, max_value, HALF_HEIGHT - 10)
+                display.set_pen(PREV_RH_GRAPH_COLORS[policy.prev_rh_humidifying[first_plotted + i]])
+                display.pixel(i, rh_y)
+                if draw_tick:
+                    display.set_pen(BLUE)
+                    display.pixel(i, 0)
+                    display.pixel(i, 1)
+                    display.pixel(i, rh_y + 2)
+                    display.pixel(i, rh_y - 2)
+                    display.pixel(i, HALF_HEIGHT - 10)
+                    display.pixel(i, HALF_HEIGHT - 11)
+                    draw_tick = False
+
+    # show the projected RH to the right of the newest reading, dotted, at the current humidifying's learned rate -
+    # with a tick in the predicted humidifying's color where the early switch is due
+    newest = policy.prev_rh_readings[MAX_PREV_RH_READINGS - 1]
+    if PREDICTIVE_ENABLED and graph_view == "rh" and GRAPH_SPANS[graph_span] is None and policy.projection_known and newest > 0:
+        display.set_pen(WHITE)
+        for k in range(2, RH_PROJECTION_PIXELS + 1, 2):
+            display.pixel(HISTORY_WIDTH - 1 + k, calculate_RH_y(max(1, newest + policy.projected_rh_step * k), HALF_HEIGHT - 10))
+        if policy.predicted_switch_time != NO_THRESHOLD_TIME and policy.predicted_switch_readings <= RH_PROJECTION_PIXELS:
+            x = HISTORY_WIDTH - 1 + max(1, policy.predicted_switch_readings)
+            rh_y = calculate_RH_y(max(1, newest + policy.projected_rh_step * policy.predicted_switch_readings), HALF_HEIGHT - 10)
+            display.set_pen(PREV_RH_GRAPH_COLORS[policy.predicted_humidifying])
+            display.line(x, rh_y - 3, x, rh_y + 4)
+
+    # show the current RH as a number and percent sign - or the dew point or absolute humidity
+    if graph_view == "dew_point":
+        value = policy.current_dew_point
+    elif graph_view == "absolute_humidity":
+        value = policy.current_absolute_humidity
+    else:
+        value = policy.current_rh
+    if value != rh_text_value or graph_view != rh_text_view:
+        if graph_view == "dew_point":
+            rh_text = "%.1fC" % (value / 100)
+        elif graph_view == "absolute_humidity":
+            rh_text = "%.1fg" % (value / 100)
+        else:
+            rh_text = "%.1f%%" % value
+        rh_text_value = value
+        rh_text_view = graph_view
+    stale = policy.rh_is_stale()
+    display.set_pen(ORANGE if stale else WHITE)
+    display.set_font("sans")
+    text_width = display.measure_text(rh_text, RH_SCALE)
+    x_start = HALF_WIDTH - text_width // 2
+    y_midline = HALF_HEIGHT // 2
+    display.text(rh_text, x_start, y_midline, scale = RH_SCALE)
+
+    # show the trend - up, even or down arrow - with the rate it comes from, in %RH an hour.  For the dew point or
+    # absolute humidity, what it is instead
+    arrow_x = x_start + text_width + 5
+    arrow_y = y_midline - ARROW_HEIGHT // 2
+    display.set_font("bitmap6")
+    if graph_view == "rh":
+        if policy.rh_trend == 1:
+            arrow_lines = UP_ARROW_LINES
+        elif policy.rh_trend == -1:
+            arrow_lines = DOWN_ARROW_LINES
+        else:
+            arrow_lines = EVEN_ARROW_LINES
+        for line in arrow_lines:
+            display.line(line[0] + arrow_x, line[1] + arrow_y, line[2] + arrow_x, line[3] + arrow_y)
+        if policy.rh_rate != rate_text_value:
+            rate_text = "%+.1f/h" % policy.rh_rate
+            rate_text_value = policy.rh_rate
+        display.text(rate_text, arrow_x + 14, arrow_y + ARROW_HEIGHT // 2 - 3, scale = 1)
+    else:
+        display.text(GRAPH_VIEW_LABELS[graph_view], arrow_x, arrow_y + ARROW_HEIGHT // 2 - 3, scale = 1)
+
+    # name the span when zoomed out to a history tier
+    if GRAPH_SPANS[graph_span] is not None:
+        display.set_pen(BLUE)
+        display.set_font("bitmap6")
+        label = GRAPH_SPAN_LABELS[graph_span]
+        display.text(label, WIDTH - display.measure_text(label, 1) - 2, 2, scale = 1)
+
+    # show a sensor fault over the top of the graph
+    if stale or policy.failed_readings > 0:
+        display.set_pen(ORANGE if stale else YELLOW)
+        display.set_font("bitmap6")
+        display.text(sensor_fault_text(stale), 2, 2, scale = 1)
+
+
+    # Show the bars - wide bar for humidifier set to "hi", thin for "lo" and height based on pct remaining.
+    # If the humidifier is currently energized, also show the lightning bolt
+    for i in range(len(policy.humidifiers)):
+        humidifier = policy.humidifiers[i]
+        units_available = TANK_UNITS - policy.calculate_units_used(humidifier)
+        if units_available < 0:
+            units_available = 0
+
+        # calculate bar height (y_max)
+        height = HALF_HEIGHT * units_available // TANK_UNITS
+
+        # determine x_min, x_max and pen color
+        if humidifier.setting == "lo":
+            x_min = LO_X_MIN[i]
+            x_max = LO_X_MAX[i]
+        else:
+            x_min = HI_X_MIN[i]
+            x_max = HI_X_MAX[i]
+        if humidifier.setting == "off":
+            pen = GRAY
+        elif units_available < ERROR_UNITS_AVAILABLE:
+            pen = RED
+        elif units_available < WARN_UNITS_AVAILABLE:
+            pen = YELLOW
+        else:
+            pen = GREEN
+
+        # draw the outline and the rectangle
+        display.set_pen(pen)
+        display.line(x_min,      HEIGHT, x_min, HALF_HEIGHT)
+        display.line(x_min, HALF_HEIGHT, x_max, HALF_HEIGHT)
+        display.line(x_max, HALF_HEIGHT, x_max,      HEIGHT)
+        display.line(x_max,      HEIGHT, x_min,      HEIGHT)
+
+        display.rectangle(x_min, HEIGHT - height, x_max - x_min, height)
+
+        # show the pct_available on the bar if humidifier not "off"
+        if humidifier.setting != "off":
+            bar_center_x = x_min + (x_max - x_min) // 2
+            avail_text = PCT_TEXTS[(units_available * 100 + TANK_UNITS // 2) // TANK_UNITS]
+            display.set_pen(WHITE)
+            display.set_font("sans")
+            text_width = display.measure_text(avail_text, REMAIN_SCALE)
+            x_start = bar_center_x - text_width // 2
+            y_midline = 100
+            display.text(avail_text, x_start, y_midline, scale = REMAIN_SCALE)
+
+
+        # if energized, draw the blue lightning
+        if humidifier.energized:
+            display.set_pen(BLUE)
+            if humidifier.setting == "lo":
+                display.polygon(LIGHTNING_POLYGONS_LO[i])
+            else:
+                display.polygon(LIGHTNING_POLYGONS_HI[i])
+
+    display.update()
+#
+##############################################################################################################
+########### END HUMIDIFIER BARS SCREEN #######################################################################
+##############################################################################################################
+
+
+
+# Draw the heartbeat circle in either black or blue to blink heartbeat circle
+def toggle_heartbeat():
+    global heartbeat_on
+
+    if heartbeat_on:
+        display.set_pen(BLACK)
+    else:
+        display.set_pen(BLUE)
+    display.circle(HEARTBEAT_X, HEARTBEAT_Y, HEARTBEAT_CIRCLE_SIZE)
+    display.update()
+    heartbeat_on = not heartbeat_on
@@ -0,0 +1,86 @@
+# 3 humidifier controller - RH sensor driver interface
+#
+# Each kind of I2C RH sensor has a driver class derived from RHSensor (dht20.py, sht3x.py, bme280.py), so sensor.py
+# reads them all the same way:
+#   power_on()              get the sensor ready after its power is switched on - called once per sample
+#   start_measurement()     start a single measurement
+#   is_ready()              whether the measurement has finished
+#   read()                  the RH of the finished measurement, in %
+#   temperature             the temperature of the measurement read() last read, in degrees C - every sensor
+#                           measures it along with the RH, so it costs no more I2C
+#
+# measure() does all three with the waits in between.  A driver advertises how long its sensor takes, so nothing
+# sleeps longer than the sensor needs:
+#   POWER_UP_MS             after power is switched on, before power_on()
+#   CONVERSION_MS           after start_measurement(), before the first is_ready()
+#
+# Errors are OSError, as from the I2C bus - a measurement that is not ready within the ready deadline fails with
+# ETIMEDOUT, and a reading that fails its CRC with EIO.
+
+import errno
+from controller import clock
+
+
+class RHSensor(object):
+    NAME = "RH sensor"
+    ADDRESSES = ()          # I2C addresses the sensor can have, in the order to look for it
+    POWER_UP_MS = 0
+    CONVERSION_MS = 0
+
+    # ready_deadline_ms - a measurement still not ready this long after it was started fails with ETIMEDOUT
+    def __init__(self, i2c, address, ready_deadline_ms):
+        self.i2c = i2c
+        self.address = address
+        self.ready_deadline_ms = ready_deadline_ms
+        self.started_ms = 0
+        self.temperature = 0.0
+
+    # whether the device answering at the address is this kind of sensor - the sensor is powered on
+    def identify(self):
+        return True
+
+    def power_on(self):
+        pass
+
+    def start_measurement(self):
+        raise NotImplementedError()
+
+    def is_ready(self):
+        raise NotImplementedError()
+
+    def read(self):
+        raise NotImplementedError()
+
+    # note when a measurement was started, for its ready deadline
+    def measurement_started(self):
+        self.started_ms = clock.ticks_ms()
+
+    # wait for the started measurement to be ready
+    def wait_ready(self):
+        while not self.is_ready():
+            if clock.ticks_diff(clock.ticks_ms(), self.started_ms) >= self.ready_deadline_ms:
+                raise OSError(errno.ETIMEDOUT)
+            clock.sleep_ms(1)
+
+    # the started measurement's RH, once it is ready
+    def finish_measurement(self):
+        self.wait_ready()
+        return self.read()
+
+    def measure(self):
+        self.start_measurement()
+        clock.sleep_ms(self.CONVERSION_MS)
+        return self.finish_measurement()
+
+
+# CRC-8 with polynomial 0x31 and initial value 0xff, as the DHT20 and SHT3x use
+def crc8(data):
+    crc = 0xff
+    for byte in data:
+        crc ^= byte
+        for i in range(8):
+            if crc & 0x80:
+                crc = ((crc << 1) ^ 0x31) & 0xff
+            else:
+                crc = (crc << 1) & 0xff
+    return crc
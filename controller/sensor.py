@@ -0,0 +1,554 @@
+# 3 humidifier controller - sensor
+#
+# Reading the relative humidity (RH) from the sensor, or faking it.  The sensor is a DHT20, SHT3x or BME280 - its
+# driver (see rh_sensor.py) is chosen by an I2C scan at the first reading, unless SENSOR_TYPE names it.
+#
+# After the quick reading at boot, readings are taken by the acquisition task on core 1 (a thread on a host), so the
+# seconds of sensor power sequencing and sampling never hold up the display, menu or automation on core 0.  The task
+# publishes each finished reading to a single slot mailbox, and update_rh() on core 0 takes it without waiting.
+# Core 1 only touches the sensor, the mailbox, policy.failed_readings and the log buffer.
+#
+# Sensor faults are bounded: each I2C transaction has a timeout and each measurement a deadline, and a failed
+# sample is retried SENSOR_READ_RETRIES times with the bus recovered and an exponential backoff in between.  If the
+# sample still fails the reading fails - the last good RH stays in use until it is stale (see policy.rh_is_stale()).
+#
+# With SENSOR_MUX_CHANNELS there are several sensors behind an I2C multiplexer, measured together and combined into
+# each sample (see read_mux_sample()).
+
+import _thread
+import errno
+import machine
+from controller.config import *
+from controller import clock
+from controller.logger import log_message, queue_log_message
+from controller.dht20 import DHT20
+from controller.sht3x import SHT3x
+from controller.bme280 import BME280
+from controller import history
+from controller import policy
+from controller import render
+from controller import mqtt
+from controller import telemetry
+from controller import trace
+if FAKE_RH:
+    import random
+
+
+i2c = None                  # I2C bus of the sensor - see setup_sensor()
+sensor_power_pin = None     # GPIO pin powering the sensor
+
+SENSOR_DRIVERS = ( DHT20, SHT3x, BME280 )   # the sensors detect_sensor() looks for, in order
+DETECT_POWER_UP_MS = max([ driver.POWER_UP_MS for driver in SENSOR_DRIVERS ])
+sensor_driver = None        # the sensor's driver class, once detect_sensor() has found it
+sensors = []                # a driver for the sensor, or for each sensor behind the multiplexer
+
+# mailbox between the acquisition task (core 1) and update_rh() (core 0) - protected by mailbox_lock
+mailbox_lock = _thread.allocate_lock()
+mailbox_rh = 0.0            # the latest reading
+mailbox_temperature = 0.0   # the temperature measured with it, in degrees C
+mailbox_sequence = 0        # incremented for each reading published
+consumed_sequence = 0       # mailbox_sequence of the last reading update_rh() took - only used on core 0
+
+# each sensor behind the multiplexer, in SENSOR_MUX_CHANNELS order - only used on core 1
+sensor_rh = [ 0.0 ] * len(SENSOR_MUX_CHANNELS)          # the sensor's RH in the last sample it answered
+sensor_temperature = [ 0.0 ] * len(SENSOR_MUX_CHANNELS) # the sensor's temperature in the last sample it answered
+sensor_answered = [ False ] * len(SENSOR_MUX_CHANNELS)  # whether the sensor answered in the current sample
+sensor_failures = [ 0 ] * len(SENSOR_MUX_CHANNELS)      # samples the sensor has failed in a row
+sensor_fusion = SENSOR_FUSION                           # SENSOR_FUSION, or "mean" if it is not usable - see check_sensor_fusion()
+
+# the temperature measured along with the RH - only used on core 1, except for the quick reading at boot
+sample_temperature = 0.0        # of the last sample, combined like its RH
+reading_temperature = 0.0       # of the last reading, averaged like its RH
+
+# acquisition task health - written by the task, read by core 0
+# next_reading_time is also read by ms_until_due() on core 0, without mailbox_lock, to choose how long to sleep.  It is
+# a single int, written and read whole.  The task moves it later just as a reading starts - a read of the value before
+# is one already due, which only stops that pass from sleeping - and only brings it forward, after a failed reading,
+# while acquisition_busy is still set, when core 0 does not lightsleep.
+next_reading_time = 0           # clock.time() of the acquisition task's next full reading - written only on core 1
+acquisition_heartbeat_ms = 0    # clock.ticks_ms() when the task last showed progress
+acquisition_error = None        # the exception that ended the task, if one did
+acquisition_busy = False        # set while the task is taking a reading
+
+
+######## FAKE RH ######################################################################################
+fake_rh_ascending = True  # Is fake RH ascending (or descending)
+fake_rh_step = 0.2        # How much to step fake RH at each reading
+fake_rh_hi = 60.0         # When fake RH is above this, start descending fake RH
+fake_rh_low = 45.0        # When fake RH is below this, start ascending fake RH
+fake_temperature = 20.0   # Temperature reported with the fake RH
+######## FAKE RH ######################################################################################
+
+
+##############################################################################################################
+################ BEGIN RH ####################################################################################
+##############################################################################################################
+#
+# setup I2C pins for reading humidity sensor
+#
+def setup_sensor():
+    global sensor_power_pin
+
+    log_message("Setting up I2C...")
+    setup_i2c()
+    sensor_power_pin = machine.Pin(HMIDITY_SENSOR_POWER_PIN_NUMBER, machine.Pin.OUT)
+    check_sensor_fusion()
+
+
+#
+# Check SENSOR_FUSION and SENSOR_WEIGHTS once, before the first reading.  A setting that cannot be used is logged and
+# the sensors are combined with "mean" instead, rather than failing every sample.
+#
+def check_sensor_fusion():
+    global sensor_fusion
+
+    sensor_fusion = SENSOR_FUSION
+    if SENSOR_FUSION not in ("mean", "min", "weighted"):
+        log_message("##### Unknown SENSOR_FUSION %s, using \"mean\"" % repr(SENSOR_FUSION))
+        sensor_fusion = "mean"
+    elif SENSOR_FUSION == "weighted" and SENSOR_MUX_CHANNELS:
+        if (len(SENSOR_WEIGHTS) != len(SENSOR_MUX_CHANNELS)
+                or [ weight for weight in SENSOR_WEIGHTS if not isinstance(weight, (int, float)) or weight < 0 ]
+                or not [ weight for weight in SENSOR_WEIGHTS if weight > 0 ]):
+            log_message("##### SENSOR_WEIGHTS %s needs one weight of 0 or more for each of the %d SENSOR_MUX_CHANNELS, "
+                        "at least one above 0 - using \"mean\"" % (SENSOR_WEIGHTS, len(SENSOR_MUX_CHANNELS)))
+            sensor_fusion = "mean"
+
+
+def setup_i2c():
+    global i2c
+    sda = machine.Pin(SDA_PIN_NUMBER)
+    scl = machine.Pin(SCL_PIN_NUMBER)
+    i2c = machine.I2C(0, sda=sda, scl=scl, freq=400000, timeout=I2C_TIMEOUT_US)
+
+
+#
+# Recover the I2C bus after a failed transaction.  A sensor stopped part way through sending a byte holds SDA low
+# until it is clocked out - clock SCL (up to 9 times) until SDA is released, send a STOP, then set up the I2C
+# peripheral again.  The pin toggles from Python are slower than 100kHz, so they need no delays.
+#
+def recover_i2c():
+    queue_log_message("Recovering I2C bus")
+    scl = machine.Pin(SCL_PIN_NUMBER, machine.Pin.OPEN_DRAIN, value=1)
+    sda = machine.Pin(SDA_PIN_NUMBER, machine.Pin.OPEN_DRAIN, value=1)
+    for i in range(9):
+        if sda.value() == 1:
+            break
+        scl.value(0)
+        scl.value(1)
+    # STOP - SDA rises while SCL is high
+    scl.value(0)
+    sda.value(0)
+    scl.value(1)
+    sda.value(1)
+    setup_i2c()
+
+
+#
+# Take one sample from the sensor.  It does the following:
+#   Powers on the sensor
+#   Waits for it to power up - as long as its driver says, or as long as any sensor needs until it is detected
+#   Reads the humidity - from each sensor behind the multiplexer, if there is one
+#   Powers off the sensor
+#
+# Returns the humidity, leaving the temperature measured with it in sample_temperature.
+# Raises OSError if the sensor does not answer properly, leaving it powered off.
+#
+def read_sample():
+    global sample_temperature
+
+    if sensor_power_pin.value() == 1:
+        queue_log_message("sensor power on.  Turning off and sleeping 500ms")
+        if LED_TRACK_SENSOR:
+            render.led_rgb(255,255,0) # yellow
+        sensor_power_pin.value(0)
+        if LED_TRACK_SENSOR:
+            render.clear_led()
+        clock.sleep_ms(500)
+
+    #log_message("Enabling sensor power")
+    if LED_TRACK_SENSOR:
+        render.led_rgb(255,255,0) # yellow
+    sensor_power_pin.value(1)
+    if LED_TRACK_SENSOR:
+        render.clear_led()
+
+    try:
+        #log_message("Sleeping for sensor to wake up")
+        if sensor_driver is None:
+            clock.sleep_ms(DETECT_POWER_UP_MS)
+            detect_sensor()
+        else:
+            clock.sleep_ms(sensor_driver.POWER_UP_MS)
+
+        if SENSOR_MUX_CHANNELS:
+            humidity = read_mux_sample()
+        else:
+            if LED_TRACK_SENSOR:
+                render.led_rgb(0,0,255) #blue
+            sensors[0].power_on()
+            #log_message("Reading humidity")
+            if LED_TRACK_SENSOR:
+                render.led_rgb(0,255,255) # cyan
+            humidity = sensors[0].measure()
+            sample_temperature = sensors[0].temperature
+            #log_message("read humidity : %.4f" % humidity)
+    finally:
+        #log_message("De-powering sensor")
+        if LED_TRACK_SENSOR:
+            render.led_rgb(255,255,0) #yellow
+        sensor_power_pin.value(0)
+        if LED_TRACK_SENSOR:
+            render.clear_led()
+    return humidity
+
+
+#
+# Take one sample from each sensor behind the multiplexer and combine them with sensor_fusion.  The sensors are
+# triggered one after another and collected after a single conversion wait, so more sensors cost little more time.
+# The sensors are already powered.  Raises OSError if none of them answers.
+#
+def read_mux_sample():
+    started = []
+    for i in range(len(SENSOR_MUX_CHANNELS)):
+        sensor_answered[i] = False
+        try:
+            select_mux_channel(SENSOR_MUX_CHANNELS[i])
+            sensors[i].power_on()
+            sensors[i].start_measurement()
+            started.append(i)
+        except OSError as err:
+            sensor_failed(i, err)
+
+    if started:
+        clock.sleep_ms(sensor_driver.CONVERSION_MS)
+    for i in started:
+        try:
+            select_mux_channel(SENSOR_MUX_CHANNELS[i])
+            sensor_rh[i] = sensors[i].finish_measurement()
+            sensor_temperature[i] = sensors[i].temperature
+            sensor_answered[i] = True
+            if sensor_failures[i] >= SENSOR_UNHEALTHY_FAILURES:
+                queue_log_message("Sensor %d on mux channel %d is healthy again" % (i, SENSOR_MUX_CHANNELS[i]))
+            sensor_failures[i] = 0
+        except OSError as err:
+            sensor_failed(i, err)
+    try:
+        select_mux_channel(None)
+    except OSError:
+        pass
+    return fuse_sensor_rh()
+
+
+#
+# Find the sensor with a scan of the bus, and make its drivers - the sensor is powered on.  Behind a multiplexer the
+# sensors are all taken to be the kind found on the first channel.  With SENSOR_TYPE set, only that kind is looked for.
+# Raises OSError if no sensor is found.
+#
+def detect_sensor():
+    global sensor_driver
+    global sensors
+
+    if SENSOR_MUX_CHANNELS:
+        select_mux_channel(SENSOR_MUX_CHANNELS[0])
+    found = i2c.scan()
+    for driver in SENSOR_DRIVERS:
+        if SENSOR_TYPE != "auto" and SENSOR_TYPE != driver.NAME:
+            continue
+        for address in driver.ADDRESSES:
+            if address not in found:
+                continue
+            try:
+                identified = driver(i2c, address, SENSOR_READY_DEADLINE_MS).identify()
+            except OSError:
+                identified = False
+            if identified:
+                sensors = [ driver(i2c, address, SENSOR_READY_DEADLINE_MS) for i in range(max(1, len(SENSOR_MUX_CHANNELS))) ]
+                sensor_driver = driver
+                queue_log_message("Found %s sensor at I2C address 0x%02x" % (driver.NAME, address))
+                return
+    queue_log_message("##### No %s sensor found, I2C scan found %s" % ("RH" if SENSOR_TYPE == "auto" else SENSOR_TYPE,
+                                                                      [ "0x%02x" % address for address in found ]))
+    raise OSError(errno.ENODEV)
+
+
+#
+# Select a multiplexer channel, or none
+#
+def select_mux_channel(channel):
+    i2c.writeto(SENSOR_MUX_ADDRESS, bytes([ 0 if channel is None else 1 << channel ]))
+
+
+#
+# Note a sensor behind the multiplexer failing a sample, reporting it when it becomes unhealthy
+#
+def sensor_failed(i, err):
+    sensor_failures[i] = sensor_failures[i] + 1
+    if sensor_failures[i] == SENSOR_UNHEALTHY_FAILURES:
+        queue_log_message("##### Sensor %d on mux channel %d is unhealthy, %d samples failed in a row: OS error %s"
+                          % (i, SENSOR_MUX_CHANNELS[i], sensor_failures[i], err))
+
+
+#
+# Combine the RHs of the sensors that answered in this sample, with sensor_fusion.  Raises OSError if none did.
+# Their temperatures are combined the same way into sample_temperature - with "min", the driest sensor's.
+# If only sensors weighted 0 answered, SENSOR_WEIGHTS leaves nothing to go on - that is logged and they are averaged.
+#
+def fuse_sensor_rh():
+    global sample_temperature
+
+    lowest = -1
+    weighted_total = 0.0
+    weighted_temperature_total = 0.0
+    weight_total = 0.0
+    rh_total = 0.0
+    temperature_total = 0.0
+    answered = 0
+    for i in range(len(SENSOR_MUX_CHANNELS)):
+        if sensor_answered[i]:
+            weight = SENSOR_WEIGHTS[i] if sensor_fusion == "weighted" else 1.0
+            weighted_total = weighted_total + weight * sensor_rh[i]
+            weighted_temperature_total = weighted_temperature_total + weight * sensor_temperature[i]
+            weight_total = weight_total + weight
+            rh_total = rh_total + sensor_rh[i]
+            temperature_total = temperature_total + sensor_temperature[i]
+            answered = answered + 1
+            if lowest < 0 or sensor_rh[i] < sensor_rh[lowest]:
+                lowest = i
+    if answered == 0:
+        raise OSError(errno.EIO)
+    if weight_total == 0.0:
+        queue_log_message("##### Only sensors with SENSOR_WEIGHTS of 0 answered, using their mean")
+        sample_temperature = temperature_total / answered
+        return rh_total / answered
+    if sensor_fusion == "min":
+        sample_temperature = sensor_temperature[lowest]
+        return sensor_rh[lowest]
+    sample_temperature = weighted_temperature_total / weight_total
+    return weighted_total / weight_total
+
+
+#
+# Take one sample, making up to retries attempts.  Between attempts the I2C bus is recovered and the wait doubles,
+# from SENSOR_RETRY_BACKOFF_MS up to SENSOR_RETRY_BACKOFF_MAX_MS.  Raises the last OSError if every attempt fails.
+#
+def read_sample_retrying(retries):
+    backoff_ms = SENSOR_RETRY_BACKOFF_MS
+    attempt = 1
+    while True:
+        try:
+            return read_sample()
+        except OSError as err:
+            queue_log_message("Sample attempt %d of %d failed: OS error %s" % (attempt, retries, err))
+            if attempt >= retries:
+                raise
+        recover_i2c()
+        acquisition_heartbeat()
+        clock.sleep_ms(backoff_ms)
+        backoff_ms = min(backoff_ms * 2, SENSOR_RETRY_BACKOFF_MAX_MS)
+        attempt = attempt + 1
+
+
+#
+# Reads the current RH from the sensor: samples samples (RH_SAMPLES_PER_READ by default) 1 second apart, averaged.
+# Each sample gets up to retries attempts - raises OSError if a sample fails them all.
+# The samples' temperatures are averaged into reading_temperature.
+# Runs on core 1, except for the quick reading at boot.
+#
+def read_humidity(samples=RH_SAMPLES_PER_READ, retries=SENSOR_READ_RETRIES):
+    global reading_temperature
+
+    humidity_total = 0.0
+    temperature_total = 0.0
+    humidity_count = 0
+
+    # average 5 readings a second apart
+    for i in range(0, samples):
+        queue_log_message("reading sample %d" % i)
+        acquisition_heartbeat()
+        humidity_total = humidity_total + read_sample_retrying(retries)
+        temperature_total = temperature_total + sample_temperature
+        humidity_count = humidity_count + 1
+        if humidity_count < samples:
+            #log_message("sleeping between RH readings")
+            clock.sleep(1)
+
+    humidity = humidity_total / humidity_count
+    reading_temperature = round(temperature_total / humidity_count, 2)
+    queue_log_message("reporting humidify of %.4f at %.2fC" % (humidity, reading_temperature))
+    if LED_TRACK_SENSOR:
+        render.clear_led()
+    return round(humidity, 2)
+
+
+# Fake the RH instead of reading a sensor
+def fake_rh():
+    global fake_rh_ascending
+    global fake_rh_hi
+    global fake_rh_low
+    global reading_temperature
+
+    current_rh = policy.current_rh
+    if current_rh == 0.0:
+        current_rh = (fake_rh_hi + fake_rh_low) / 2
+
+    if fake_rh_ascending:
+        if current_rh >= fake_rh_hi:
+            fake_rh_ascending = False
+            delta = random.randint(-100,50)
+        else:
+            delta = random.randint(-50,100)
+
+    else: #descending
+        if current_rh <= fake_rh_low:
+            fake_rh_ascending = True
+            delta = random.randint(-50,100)
+        else:
+            delta = random.randint(-100,50)
+
+    return_rh = current_rh + (float(delta) / 100.0)
+    reading_temperature = fake_temperature
+
+    queue_log_message("Faking humidity. RH now %.2f" % return_rh)
+    return return_rh
+
+
+#
+# Take one RH reading.  Returns None if it failed, otherwise the RH with its temperature left in reading_temperature.
+#   samples     how many samples to average
+#   retries     attempts at each sample
+#
+def take_reading(samples, retries=SENSOR_READ_RETRIES):
+    if FAKE_RH:
+        return fake_rh()
+
+    queue_log_message("Reading humidity from sensor")
+    try:
+        rh = read_humidity(samples, retries)
+        queue_log_message("Successful read")
+        return rh
+    except OSError as err:
+        queue_log_message("OS error: {0}".format(err))
+        queue_log_message("##### Exception reading humidity, giving up on this reading.")
+        return None
+
+
+#
+# Note that the acquisition task is making progress
+#
+def acquisition_heartbeat():
+    global acquisition_heartbeat_ms
+    acquisition_heartbeat_ms = clock.ticks_ms()
+
+
+#
+# The acquisition task - runs on core 1, started by clock.start_task() to run every ACQUISITION_PERIOD_MS.
+# Takes a full reading straight away, then every RH_UPDATE_SECS, and publishes each one to the mailbox.
+# After a failed reading it counts the failure and tries again after SENSOR_FAILED_RETRY_SECS.
+# Each run shows the task is alive.  If it fails, it leaves the exception for update_rh() to raise on core 0 and
+# returns False to stop.
+#
+def acquisition_task():
+    global next_reading_time
+    global mailbox_rh
+    global mailbox_temperature
+    global mailbox_sequence
+    global acquisition_error
+    global acquisition_busy
+
+    try:
+        acquisition_heartbeat()
+        if clock.time() >= next_reading_time:
+            next_reading_time = clock.time() + RH_UPDATE_SECS
+            acquisition_busy = True
+            rh = take_reading(RH_SAMPLES_PER_READ)
+            if rh is None:
+                # brought forward while still busy - see next_reading_time
+                next_reading_time = clock.time() + SENSOR_FAILED_RETRY_SECS
+            acquisition_busy = False
+            if rh is None:
+                policy.failed_readings = policy.failed_readings + 1
+                return True
+            policy.failed_readings = 0
+            with mailbox_lock:
+                mailbox_rh = rh
+                mailbox_temperature = reading_temperature
+                mailbox_sequence = mailbox_sequence + 1
+        return True
+    except Exception as err:
+        acquisition_error = err
+        acquisition_busy = False
+        return False
+
+
+#
+# Start the acquisition task on core 1
+#
+def start_acquisition():
+    acquisition_heartbeat()
+    clock.start_task(acquisition_task, ACQUISITION_PERIOD_MS)
+    log_message("Started sensor acquisition on core 1")
+
+
+#
+# Quick RH update at boot, before the acquisition task starts: a single sample read on core 0, setting current_rh
+# without recording it in the history.  It gives the first automation something to work from straight away.
+# It makes BOOT_RH_RETRIES attempts - if they fail, the automation works from whatever RH the snapshot had (if it
+# is stale, the fail-safe) until the acquisition task succeeds.
+#
+def update_rh_quick():
+    rh = take_reading(BOOT_RH_SAMPLES, BOOT_RH_RETRIES)
+    if rh is None:
+        policy.failed_readings = 1
+        log_message("Quick RH read failed")
+        return
+    policy.current_rh = rh
+    policy.current_temperature = reading_temperature
+    policy.current_rh_time = clock.time()
+    policy.update_moisture()
+    log_message("Quick RH now %.2f at %.2fC" % (policy.current_rh, policy.current_temperature))
+    policy.should_refresh_display = True
+
+
+#
+# Update the current RH from the mailbox, if the acquisition task has published a new reading.  Never waits.
+# Returns True if there was a new reading.  Raises if the task has failed or stopped making progress,
+# so the crash handler restarts the controller.
+#
+def update_rh():
+    global consumed_sequence
+
+    if acquisition_error:
+        raise acquisition_error
+    if clock.ticks_diff(clock.ticks_ms(), acquisition_heartbeat_ms) > ACQUISITION_STALL_MS:
+        raise RuntimeError("sensor acquisition stalled")
+
+    previous_rh = policy.current_rh
+    previous_rh_time = policy.current_rh_time
+    with mailbox_lock:
+        if mailbox_sequence == consumed_sequence:
+            return False
+        consumed_sequence = mailbox_sequence
+        policy.current_rh = mailbox_rh
+        policy.current_temperature = mailbox_temperature
+    policy.current_rh_time = clock.time()
+    policy.update_moisture()
+
+    trace.record_reading(policy.current_rh, policy.current_temperature)
+    policy.record_rh(policy.current_rh)
+    policy.learn_rh_slope(previous_rh, previous_rh_time)
+    policy.update_rh_trend()
+    policy.update_rh_projection()
+    telemetry.record_reading()
+    mqtt.record_reading()
+    history.record_reading()
+    log_message("RH now %.2f, trend %d, %+.2f%%/h, %.2fC, dew point %.2fC, %.2fg/m3"
+                % (policy.current_rh, policy.rh_trend, policy.rh_rate, policy.current_temperature,
+                   policy.current_dew_point / 100, policy.current_absolute_humidity / 100))
+
+    policy.should_refresh_display = True
+    return True
+#
+##############################################################################################################
+################# END RH #####################################################################################
+##############################################################################################################
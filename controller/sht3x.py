@@ -0,0 +1,44 @@
+# 3 humidifier controller - SHT3x sensor (SHT30, SHT31, SHT35)
+#
+# Single shot measurements at high repeatability, without clock stretching: while measuring the sensor does not
+# acknowledge a read, so is_ready() tries to read the result.  See rh_sensor.py for the interface.
+
+import errno
+from controller.rh_sensor import RHSensor, crc8
+
+
+class SHT3x(RHSensor):
+    NAME = "SHT3x"
+    ADDRESSES = (0x44, 0x45)
+    POWER_UP_MS = 2         # 1.5ms at most
+    CONVERSION_MS = 16      # 15.5ms at most at high repeatability
+
+    def __init__(self, i2c, address=0x44, ready_deadline_ms=200):
+        super().__init__(i2c, address, ready_deadline_ms)
+        self.data = None
+
+    # the status register, with its CRC, is only there on an SHT3x
+    def identify(self):
+        self.i2c.writeto(self.address, bytes([0xf3, 0x2d]))
+        status = self.i2c.readfrom(self.address, 3)
+        return crc8(status[0:2]) == status[2]
+
+    def start_measurement(self):
+        self.data = None
+        self.i2c.writeto(self.address, bytes([0x24, 0x00]))
+        self.measurement_started()
+
+    def is_ready(self):
+        try:
+            self.data = self.i2c.readfrom(self.address, 6)
+            return True
+        except OSError:
+            return False
+
+    # temperature word and CRC, then humidity word and CRC
+    def read(self):
+        data = self.data
+        if crc8(data[0:2]) != data[2] or crc8(data[3:5]) != data[5]:
+            raise OSError(errno.EIO)
+        self.temperature = -45.0 + 175.0 * ((data[0] << 8) | data[1]) / 65535
+        return 100.0 * ((data[3] << 8) | data[4]) / 65535
@@ -0,0 +1,317 @@
+# 3 humidifier controller - state snapshot
+#
+# A compact binary snapshot of the state worth keeping across a power blip: the RH thresholds, the last RH and trend,
+# each humidifier's setting and usage, and the RH history.  Restoring it at boot lets the controller draw a useful
+# screen and make its first relay decision without waiting for a full sensor reading.
+#
+# The crash handler writes a warm snapshot just before resetting the Pico.  It holds how old its RH is and which
+# humidifiers were energized, so a warm restart puts the relays straight back without reading the sensor, and carries
+# on the relay scheduler's limits where they were.  The RH keeps its age across the reset, so a run of crashes cannot
+# keep a stale RH looking fresh - it goes stale, and to the fail-safe, as it would without them.
+#
+# Layout (little endian):
+#   header          SNAPSHOT_HEADER - magic, flags, on_rh, low_rh, current_rh, rh_trend, humidifying, humidifier count, history length,
+#                   secs since current_rh was read (NO_RH_AGE if it has not been)
+#   per humidifier  SNAPSHOT_HUMIDIFIER - setting, energized, lo_secs, hi_secs (including any run time not yet added to them)
+#                   SNAPSHOT_SWITCHES - whether a relay switch is pending and secs until it is allowed, secs since the
+#                   relay last switched (NO_SWITCH_AGE if it has not), the number of start ages that follow
+#                   then that many secs since each start within the hour, oldest first
+#   duty cycle      SNAPSHOT_DUTY - the duty cycle PI controller's integral, secs since the window started
+#                   (NO_SWITCH_AGE if there is none) and how long the window's on part is
+#   prediction      SNAPSHOT_PREDICTION - the learned RH rate and how many rates were measured for each humidifying
+#                   activity, in HUMIDIFYING_CODES order, and secs since humidifying last changed
+#   trend window    SNAPSHOT_TREND_COUNT - the number of readings in the trend window, then that many
+#                   SNAPSHOT_TREND_READING - secs since the reading and the reading, oldest first
+#   temperature     SNAPSHOT_TEMPERATURE - the temperature measured with current_rh
+#   history         the readings array, then one humidifying code byte per reading, then the dew points array and the
+#                   absolute humidities array
+
+import os
+import struct
+from array import array
+from controller.config import *
+from controller import clock
+from controller.logger import log_message
+from controller import policy
+
+
+SNAPSHOT_MAGIC = b"HUM8"
+SNAPSHOT_HEADER = "<4sBfffbbBHI"
+SNAPSHOT_HUMIDIFIER = "<BBII"
+SNAPSHOT_SWITCHES = "<BIIB"
+SNAPSHOT_START_AGE = "<I"
+SNAPSHOT_DUTY = "<dII"
+SNAPSHOT_PREDICTION = "<dddBBBI"
+SNAPSHOT_TREND_COUNT = "<B"
+SNAPSHOT_TREND_READING = "<IH"
+SNAPSHOT_TEMPERATURE = "<f"
+NO_SWITCH_AGE = 0xffffffff                             # switch age of a relay that has not switched
+NO_RH_AGE = 0xffffffff                                 # RH age before the first reading
+SNAPSHOT_WARM = 0x01                                   # flag - written by the crash handler
+SNAPSHOT_ERRORS = (ValueError, IndexError, getattr(struct, "error", ValueError))   # what damaged data raises - CPython's struct has its own error
+
+SETTING_CODES = ( "off", "lo", "hi" )                  # setting for each code byte
+HUMIDIFYING_CODES = ( "off", "light", "heavy" )        # humidifying activity for each code byte
+
+warm_restart = False        # set by restore_snapshot() when it restored a warm snapshot
+
+
+#
+# The snapshot of the current state, as bytes
+#   warm    True when writing from the crash handler, just before a reset
+#
+def snapshot_data(warm=False):
+    now = clock.time()
+    data = bytearray(struct.pack(SNAPSHOT_HEADER, SNAPSHOT_MAGIC, SNAPSHOT_WARM if warm else 0, policy.on_rh, policy.low_rh, policy.current_rh,
+                                 policy.rh_trend, HUMIDIFYING_CODES.index(policy.humidifying),
+                                 len(policy.humidifiers), MAX_PREV_RH_READINGS,
+                                 rh_age(now)))
+    for humidifier in policy.humidifiers:
+        # fold in the run time since the last setting change without disturbing the humidifier
+        lo_secs = humidifier.lo_secs
+        hi_secs = humidifier.hi_secs
+        if humidifier.energized and humidifier.setting == "lo":
+            lo_secs = lo_secs + now - humidifier.last_setting_time
+        elif humidifier.energized and humidifier.setting == "hi":
+            hi_secs = hi_secs + now - humidifier.last_setting_time
+        data.extend(struct.pack(SNAPSHOT_HUMIDIFIER, SETTING_CODES.index(humidifier.setting), humidifier.energized,
+                                lo_secs, hi_secs))
+        # the relay scheduler's times, as ages so they do not depend on the clock carrying on across the reset
+        start_ages = []
+        for i in range(MAX_RELAY_STARTS_PER_HOUR):
+            start_time = humidifier.start_times[(humidifier.start_index + i) % MAX_RELAY_STARTS_PER_HOUR]
+            if start_time != NO_SWITCH_TIME and now - start_time < 3600:
+                start_ages.append(now - start_time)
+        data.extend(struct.pack(SNAPSHOT_SWITCHES, humidifier.switch_pending,
+                                max(0, humidifier.switch_pending_time - now) if humidifier.switch_pending else 0,
+                                now - humidifier.switch_time if humidifier.switch_time != NO_SWITCH_TIME else NO_SWITCH_AGE,
+                                len(start_ages)))
+        for start_age in start_ages:
+            data.extend(struct.pack(SNAPSHOT_START_AGE, start_age))
+    data.extend(struct.pack(SNAPSHOT_DUTY, policy.duty_integral,
+                            now - policy.duty_window_time if policy.duty_window_time != NO_THRESHOLD_TIME else NO_SWITCH_AGE,
+                            policy.duty_on_secs))
+    data.extend(struct.pack(SNAPSHOT_PREDICTION, policy.rh_slopes["off"], policy.rh_slopes["light"], policy.rh_slopes["heavy"],
+                            policy.rh_slope_samples["off"], policy.rh_slope_samples["light"],
+                            policy.rh_slope_samples["heavy"], now - policy.humidifying_time))
+    data.extend(struct.pack(SNAPSHOT_TREND_COUNT, policy.trend_count))
+    for i in range(policy.trend_count):
+        j = (policy.trend_index - policy.trend_count + i) % RH_TREND_READINGS
+        data.extend(struct.pack(SNAPSHOT_TREND_READING, now - policy.trend_times[j], policy.trend_readings[j]))
+    data.extend(struct.pack(SNAPSHOT_TEMPERATURE, policy.current_temperature))
+    data.extend(policy.prev_rh_readings)
+    codes = bytearray(MAX_PREV_RH_READINGS)
+    for i in range(MAX_PREV_RH_READINGS):
+        codes[i] = HUMIDIFYING_CODES.index(policy.prev_rh_humidifying[i])
+    data.extend(codes)
+    data.extend(policy.prev_dew_points)
+    data.extend(policy.prev_absolute_humidities)
+    return data
+
+
+#
+# How long ago current_rh was read, for the snapshot - rounded up, as clock.time() is whole seconds and the reset
+# takes time the clock does not see, so a restart that crashes within a second still ages it.  NO_RH_AGE before the
+# first reading.
+#   now     clock.time()
+#
+def rh_age(now):
+    if policy.current_rh_time == 0:
+        return NO_RH_AGE
+    return now - policy.current_rh_time + 1
+
+
+#
+# Write the snapshot.  It is written to a temporary file and renamed over the old one,
+# so a power loss part way through leaves the previous snapshot intact.
+#   warm    True when writing from the crash handler, just before a reset
+#
+def save_snapshot(warm=False):
+    tmp_filename = SNAPSHOT_FILENAME + ".tmp"
+    with open(tmp_filename, "wb") as f:
+        f.write(snapshot_data(warm))
+    os.rename(tmp_filename, SNAPSHOT_FILENAME)
+
+
+#
+# Restore the snapshot, if there is one.  Returns True if it was restored.
+# Humidifiers are restored de-energized - the relays are all off at boot until the first automation decides - unless
+# it is a warm snapshot, when they are restored as they were along with the relay scheduler's limits, its RH is taken
+# as read as long ago as it was when saved and warm_restart is set.
+# The caller updates the relays.
+#
+def restore_snapshot():
+    try:
+        with open(SNAPSHOT_FILENAME, "rb") as f:
+            data = f.read()
+    except OSError:
+        log_message("No snapshot to restore")
+        return False
+    return restore_snapshot_data(data)
+
+
+#
+# Restore the state from snapshot data - see restore_snapshot().  Returns True if it was restored.  The whole
+# snapshot is read and checked before any of it is used, so damaged data leaves the state as it was.
+#
+def restore_snapshot_data(data):
+    global warm_restart
+
+    try:
+        parsed = parse_snapshot(data)
+    except SNAPSHOT_ERRORS as err:
+        log_message("Snapshot is damaged, ignoring it: {0}".format(err))
+        return False
+    if parsed is None:
+        log_message("Snapshot does not match this controller, ignoring it")
+        return False
+
+    apply_snapshot(parsed)
+    warm_restart = parsed.warm
+    log_message("Restored %s snapshot: RH %.2f, humidifying %s" % ("warm" if parsed.warm else "cold", policy.current_rh, policy.humidifying))
+    return True
+
+
+#
+# A snapshot read from its data, ready to apply - see parse_snapshot()
+#   humidifiers     per humidifier (setting, energized, lo_secs, hi_secs, switch pending, secs until the switch is
+#                   allowed, switch age, start ages oldest first)
+#   duty            (integral, window age, on secs)
+#   prediction      SNAPSHOT_PREDICTION's values
+#   trend           (age, reading) for each reading in the trend window, oldest first
+#   readings, humidifyings, dew_points, absolute_humidities
+#                   the history, oldest first, as long as it was when saved
+#
+class Snapshot:
+    __slots__ = ("warm", "on_rh", "low_rh", "current_rh", "rh_age", "rh_trend", "humidifying", "humidifiers", "duty",
+                 "prediction", "trend", "temperature", "readings", "humidifyings", "dew_points", "absolute_humidities")
+
+
+#
+# Read snapshot data into a Snapshot without touching the state.  Returns None if it is not for this controller,
+# and raises one of SNAPSHOT_ERRORS if it is damaged.
+#
+def parse_snapshot(data):
+    parsed = Snapshot()
+    magic, flags, parsed.on_rh, parsed.low_rh, parsed.current_rh, parsed.rh_trend, humidifying, humidifier_count, history_length, parsed.rh_age = struct.unpack_from(SNAPSHOT_HEADER, data, 0)
+    if magic != SNAPSHOT_MAGIC or humidifier_count != len(policy.humidifiers):
+        return None
+    offset = struct.calcsize(SNAPSHOT_HEADER)
+    parsed.warm = (flags & SNAPSHOT_WARM) != 0
+    parsed.humidifying = HUMIDIFYING_CODES[humidifying]
+
+    parsed.humidifiers = []
+    for i in range(humidifier_count):
+        setting, energized, lo_secs, hi_secs = struct.unpack_from(SNAPSHOT_HUMIDIFIER, data, offset)
+        offset = offset + struct.calcsize(SNAPSHOT_HUMIDIFIER)
+        pending, pending_secs, switch_age, start_count = struct.unpack_from(SNAPSHOT_SWITCHES, data, offset)
+        offset = offset + struct.calcsize(SNAPSHOT_SWITCHES)
+        start_ages = []
+        for j in range(start_count):
+            start_ages.append(struct.unpack_from(SNAPSHOT_START_AGE, data, offset)[0])
+            offset = offset + struct.calcsize(SNAPSHOT_START_AGE)
+        parsed.humidifiers.append((SETTING_CODES[setting], energized != 0, lo_secs, hi_secs, pending != 0, pending_secs,
+                                   switch_age, start_ages))
+
+    parsed.duty = struct.unpack_from(SNAPSHOT_DUTY, data, offset)
+    offset = offset + struct.calcsize(SNAPSHOT_DUTY)
+    parsed.prediction = struct.unpack_from(SNAPSHOT_PREDICTION, data, offset)
+    offset = offset + struct.calcsize(SNAPSHOT_PREDICTION)
+
+    trend_count = struct.unpack_from(SNAPSHOT_TREND_COUNT, data, offset)[0]
+    offset = offset + struct.calcsize(SNAPSHOT_TREND_COUNT)
+    parsed.trend = []
+    for i in range(trend_count):
+        parsed.trend.append(struct.unpack_from(SNAPSHOT_TREND_READING, data, offset))
+        offset = offset + struct.calcsize(SNAPSHOT_TREND_READING)
+
+    parsed.temperature = struct.unpack_from(SNAPSHOT_TEMPERATURE, data, offset)[0]
+    offset = offset + struct.calcsize(SNAPSHOT_TEMPERATURE)
+
+    # an array() of a short slice is just short, so check the history is all there
+    if len(data) < offset + history_length * 7:
+        raise ValueError("history cut short at %d bytes" % len(data))
+    parsed.readings = array("H", data[offset:offset + history_length * 2])
+    parsed.humidifyings = [ HUMIDIFYING_CODES[code] for code in data[offset + history_length * 2:offset + history_length * 3] ]
+    parsed.dew_points = array("h", data[offset + history_length * 3:offset + history_length * 5])
+    parsed.absolute_humidities = array("H", data[offset + history_length * 5:offset + history_length * 7])
+    return parsed
+
+
+#
+# Put a parsed snapshot into the state - see restore_snapshot()
+#
+def apply_snapshot(parsed):
+    warm = parsed.warm
+    policy.on_rh = parsed.on_rh
+    policy.low_rh = parsed.low_rh
+    policy.update_debounced_thresholds()
+    policy.current_rh = parsed.current_rh
+    if warm and parsed.rh_age != NO_RH_AGE:
+        policy.current_rh_time = clock.time() - parsed.rh_age
+    policy.rh_trend = parsed.rh_trend
+    policy.humidifying = parsed.humidifying
+
+    for i in range(len(policy.humidifiers)):
+        humidifier = policy.humidifiers[i]
+        setting, energized, lo_secs, hi_secs, pending, pending_secs, switch_age, start_ages = parsed.humidifiers[i]
+        humidifier.setting = setting
+        humidifier.energized = warm and energized
+        humidifier.lo_secs = lo_secs
+        humidifier.hi_secs = hi_secs
+        humidifier.last_setting_time = clock.time()
+        restore_switches(humidifier, pending, pending_secs, switch_age, start_ages, warm)
+        policy.update_capacity_model(humidifier)
+
+    # the integral is what the room needs, worth keeping whatever - the window only carries on after a warm reset
+    duty_integral, window_age, duty_on_secs = parsed.duty
+    policy.duty_integral = duty_integral
+    if warm and window_age != NO_SWITCH_AGE:
+        policy.duty_window_time = clock.time() - window_age
+        policy.duty_on_secs = duty_on_secs
+
+    # the rates are the room's, worth keeping whatever - when humidifying changed only means anything after a
+    # warm reset, when the humidifiers carry on as they were
+    prediction = parsed.prediction
+    for i in range(len(HUMIDIFYING_CODES)):
+        policy.rh_slopes[HUMIDIFYING_CODES[i]] = prediction[i]
+        policy.rh_slope_samples[HUMIDIFYING_CODES[i]] = prediction[len(HUMIDIFYING_CODES) + i]
+    policy.humidifying_time = clock.time() - prediction[-1] if warm else clock.time()
+
+    # the trend window's times are kept as ages, like the history carries on across the reset
+    policy.clear_trend_window()
+    for age, reading in parsed.trend:
+        policy.add_trend_reading(reading, clock.time() - age)
+    policy.update_rh_trend()
+    policy.update_rh_projection()
+
+    policy.current_temperature = parsed.temperature
+    policy.update_moisture()
+
+    # the history length may have changed with RH_HISTORY_SCREENS - keep the newest readings that fit
+    history_length = len(parsed.readings)
+    count = min(history_length, MAX_PREV_RH_READINGS)
+    for i in range(count):
+        policy.prev_rh_readings[MAX_PREV_RH_READINGS - count + i] = parsed.readings[history_length - count + i]
+        policy.prev_rh_humidifying[MAX_PREV_RH_READINGS - count + i] = parsed.humidifyings[history_length - count + i]
+        policy.prev_dew_points[MAX_PREV_RH_READINGS - count + i] = parsed.dew_points[history_length - count + i]
+        policy.prev_absolute_humidities[MAX_PREV_RH_READINGS - count + i] = parsed.absolute_humidities[history_length - count + i]
+
+
+#
+# Restore a humidifier's relay scheduler times from its parsed snapshot values.  Only a warm snapshot's - after a
+# power blip the relays have been off for who knows how long, so they start again with no limits.
+#
+def restore_switches(humidifier, pending, pending_secs, switch_age, start_ages, warm):
+    now = clock.time()
+    humidifier.switch_pending = warm and pending
+    humidifier.switch_pending_time = now + pending_secs if humidifier.switch_pending else NO_THRESHOLD_TIME
+    humidifier.switch_time = now - switch_age if warm and switch_age != NO_SWITCH_AGE else NO_SWITCH_TIME
+    for i in range(MAX_RELAY_STARTS_PER_HOUR):
+        humidifier.start_times[i] = NO_SWITCH_TIME
+    humidifier.start_index = 0
+    # the newest starts that fit, oldest first, with start_index after the newest
+    if warm:
+        for start_age in start_ages[max(0, len(start_ages) - MAX_RELAY_STARTS_PER_HOUR):]:
+            humidifier.start_times[humidifier.start_index] = now - start_age
+            humidifier.start_index = (humidifier.start_index + 1) % MAX_RELAY_STARTS_PER_HOUR
@@ -0,0 +1,60 @@
+# 3 humidifier controller - main loop statistics
+#
+# Tracks heap allocation and time per main loop iteration and garbage collection pauses.
+
+import gc
+import time
+from controller.config import *
+from controller import clock
+from controller.logger import log_message
+
+
+# main loop memory statistics, logged every LOOP_STATS_SECS
+loop_count = 0                      # main loop iterations since stats were last logged
+allocating_loop_count = 0           # iterations that allocated heap since stats were last logged
+max_loop_alloc = 0                  # most bytes allocated by one iteration since stats were last logged
+max_loop_us = 0                     # longest iteration, not counting its sleep, since stats were last logged
+max_gc_pause_us = 0                 # longest gc.collect() since stats were last logged
+last_loop_stats_time = 0            # time the stats were last logged
+
+
+#
+# Run a garbage collection and track the longest one
+#
+def timed_gc_collect():
+    global max_gc_pause_us
+    start_us = time.ticks_us()
+    gc.collect()
+    pause_us = time.ticks_diff(time.ticks_us(), start_us)
+    if pause_us > max_gc_pause_us:
+        max_gc_pause_us = pause_us
+
+
+#
+# Track the bytes allocated by one main loop iteration and the us it took, and log the statistics every LOOP_STATS_SECS
+#
+def update_loop_stats(loop_alloc, loop_us):
+    global loop_count
+    global allocating_loop_count
+    global max_loop_alloc
+    global max_loop_us
+    global max_gc_pause_us
+    global last_loop_stats_time
+
+    loop_count = loop_count + 1
+    if loop_alloc > 0:
+        allocating_loop_count = allocating_loop_count + 1
+    if loop_alloc > max_loop_alloc:
+        max_loop_alloc = loop_alloc
+    if loop_us > max_loop_us:
+        max_loop_us = loop_us
+
+    if clock.time() - last_loop_stats_time > LOOP_STATS_SECS:
+        log_message("loop stats: %d loops, %d allocated, max %d bytes allocated in a loop, longest loop %d us, worst gc pause %d us, mem free %d"
+                    % (loop_count, allocating_loop_count, max_loop_alloc, max_loop_us, max_gc_pause_us, gc.mem_free()))
+        loop_count = 0
+        allocating_loop_count = 0
+        max_loop_alloc = 0
+        max_loop_us = 0
+        max_gc_pause_us = 0
+        last_loop_stats_time = clock.time()
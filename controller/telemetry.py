@@ -0,0 +1,169 @@
+# 3 humidifier controller - telemetry
+#
+# With TELEMETRY_ENABLED, a compact binary frame of the live state goes out on USB serial every TELEMETRY_SECS, for
+# host/telemetry_collector.py to record: the RH, temperature, dew point, absolute humidity and trend, the humidifying,
+# each outlet's setting, whether it is energized and how much of its tank is used, and the main loop statistics.
+# Frames share the port with the console (log messages and the REPL) - the sync bytes and CRC let the collector pick
+# them out of the text.
+#
+# A frame is only written when a poll shows the port can take it, so with no host attached, or a host that has
+# stopped reading, frames are dropped (and counted) rather than holding up the main loop.  The frame is one
+# bytearray made at setup: the reading's part is packed once per reading, the rest when the frame is sent, so sending
+# does no float math and allocates nothing.
+#
+# Layout (little endian):
+#   sync        TELEMETRY_SYNC
+#   length      one byte, the payload's length
+#   payload     TELEMETRY_HEADER, TELEMETRY_READING, TELEMETRY_STATE, TELEMETRY_OUTLET for each outlet, TELEMETRY_LOOP
+#   crc         CRC-8 of the payload, as the DHT20 and SHT3x check theirs
+
+import gc
+import select
+import struct
+import sys
+from controller.config import *
+from controller import clock
+from controller import policy
+from controller import stats
+from controller.logger import log_message, log_lock
+
+
+TELEMETRY_SYNC = b"\xa5\x5a"
+TELEMETRY_VERSION = 1
+
+TELEMETRY_HEADER  = "<BHI"      # version, sequence number (counts dropped frames too), clock.time()
+TELEMETRY_READING = "<HhhHhb"   # RH, temperature, dew point and absolute humidity in hundredths, rate in hundredths of
+                                # a %RH an hour, trend
+TELEMETRY_STATE   = "<BBB"      # index in TELEMETRY_HUMIDIFYING, TELEMETRY_FLAG_ bits, outlets
+TELEMETRY_OUTLET  = "<BB"       # index in TELEMETRY_SETTINGS plus TELEMETRY_ENERGIZED, pct of the tank used
+TELEMETRY_LOOP    = "<IIIIII"   # main loop statistics since they were last logged (see stats.py) - loops, allocating
+                                # loops, most bytes allocated by a loop, longest loop us, longest gc pause us, then
+                                # the heap free
+TELEMETRY_HUMIDIFYING = ( "off", "light", "heavy" )
+TELEMETRY_SETTINGS = ( "off", "lo", "hi" )
+TELEMETRY_ENERGIZED = 0x80
+TELEMETRY_FLAG_FAILSAFE = 0x01  # humidifying from FAILSAFE_HUMIDIFYING
+TELEMETRY_FLAG_STALE    = 0x02  # current_rh is too old to decide from
+TELEMETRY_FLAG_FAILING  = 0x04  # the last sensor reading failed
+
+HEADER_OFFSET  = len(TELEMETRY_SYNC) + 1
+READING_OFFSET = HEADER_OFFSET + struct.calcsize(TELEMETRY_HEADER)
+STATE_OFFSET   = READING_OFFSET + struct.calcsize(TELEMETRY_READING)
+OUTLET_OFFSET  = STATE_OFFSET + struct.calcsize(TELEMETRY_STATE)
+OUTLET_SIZE    = struct.calcsize(TELEMETRY_OUTLET)
+LOOP_OFFSET    = OUTLET_OFFSET + OUTLET_SIZE * len(OUTLET_PIN_NUMBERS)
+CRC_OFFSET     = LOOP_OFFSET + struct.calcsize(TELEMETRY_LOOP)
+
+frame = None                # the frame, sent as it is - None when telemetry is off
+stream = None               # USB serial
+poll_stream = None          # polls stream - ipoll, which does not allocate, where there is one
+sequence = 0                # sequence number of the last frame
+last_telemetry_ms = 0       # clock.ticks_ms() when the last frame was due
+frames_dropped = 0          # frames the port could not take
+
+
+##############################################################################################################
+############### BEGIN TELEMETRY ##############################################################################
+##############################################################################################################
+#
+# Start sending telemetry, if enabled.  Call once the controller's state is set up.
+#
+def setup_telemetry():
+    global frame
+    global stream
+    global poll_stream
+    global last_telemetry_ms
+
+    if not TELEMETRY_ENABLED:
+        return
+    frame = bytearray(CRC_OFFSET + 1)
+    frame[0:len(TELEMETRY_SYNC)] = TELEMETRY_SYNC
+    frame[len(TELEMETRY_SYNC)] = CRC_OFFSET - HEADER_OFFSET
+    stream = sys.stdout.buffer
+    poller = select.poll()
+    poller.register(stream, select.POLLOUT)
+    # the host stand-ins run on CPython, which only has poll()
+    poll_stream = getattr(poller, "ipoll", poller.poll)
+    last_telemetry_ms = clock.ticks_ms()
+    record_reading()
+    log_message("Telemetry every %d s on USB serial" % TELEMETRY_SECS)
+
+#
+# Pack the current reading into the frame.  Call after each reading has updated the trend.
+#
+def record_reading():
+    if frame is None:
+        return
+    rate = round(policy.rh_rate * 100)
+    struct.pack_into(TELEMETRY_READING, frame, READING_OFFSET,
+                     min(max(round(policy.current_rh * 100), 0), 10000), round(policy.current_temperature * 100),
+                     policy.current_dew_point, policy.current_absolute_humidity,
+                     min(max(rate, -32768), 32767), policy.rh_trend)
+
+#
+# CRC-8 of the payload - the one calculated for the sensors, indexing the frame so it allocates no iterator
+#
+def payload_crc():
+    crc = 0xff
+    for i in range(HEADER_OFFSET, CRC_OFFSET):
+        crc ^= frame[i]
+        for bit in range(8):
+            if crc & 0x80:
+                crc = ((crc << 1) ^ 0x31) & 0xff
+            else:
+                crc = (crc << 1) & 0xff
+    return crc
+
+#
+# Whether the port can take a frame now, without waiting
+#
+def stream_writable():
+    for entry in poll_stream(0):
+        return entry[1] & select.POLLOUT
+    return False
+
+#
+# Send a frame if one is due.  Call from the main loop.
+#
+def send_telemetry():
+    global sequence
+    global last_telemetry_ms
+    global frames_dropped
+
+    if frame is None or clock.ticks_diff(clock.ticks_ms(), last_telemetry_ms) < TELEMETRY_SECS * 1000:
+        return
+    last_telemetry_ms = clock.ticks_ms()
+    sequence = (sequence + 1) & 0xffff
+
+    flags = 0
+    if policy.failsafe:
+        flags |= TELEMETRY_FLAG_FAILSAFE
+    if policy.rh_is_stale():
+        flags |= TELEMETRY_FLAG_STALE
+    if policy.failed_readings > 0:
+        flags |= TELEMETRY_FLAG_FAILING
+    struct.pack_into(TELEMETRY_HEADER, frame, HEADER_OFFSET, TELEMETRY_VERSION, sequence, clock.time())
+    struct.pack_into(TELEMETRY_STATE, frame, STATE_OFFSET, TELEMETRY_HUMIDIFYING.index(policy.humidifying), flags,
+                     len(policy.humidifiers))
+    for i in range(len(policy.humidifiers)):
+        humidifier = policy.humidifiers[i]
+        state = TELEMETRY_SETTINGS.index(humidifier.setting)
+        if humidifier.energized:
+            state |= TELEMETRY_ENERGIZED
+        used_pct = (policy.calculate_units_used(humidifier) * 100 + TANK_UNITS // 2) // TANK_UNITS
+        struct.pack_into(TELEMETRY_OUTLET, frame, OUTLET_OFFSET + i * OUTLET_SIZE, state,
+                         min(max(used_pct, 0), 100))
+    struct.pack_into(TELEMETRY_LOOP, frame, LOOP_OFFSET, stats.loop_count, stats.allocating_loop_count,
+                     stats.max_loop_alloc, stats.max_loop_us, stats.max_gc_pause_us, gc.mem_free())
+    frame[CRC_OFFSET] = payload_crc()
+
+    if stream_writable():
+        # not part way through a log message printed from core 1
+        with log_lock:
+            stream.write(frame)
+    else:
+        frames_dropped = frames_dropped + 1
+#
+##############################################################################################################
+################ END TELEMETRY ###############################################################################
+##############################################################################################################
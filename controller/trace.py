@@ -0,0 +1,158 @@
+# 3 humidifier controller - decision trace
+#
+# With TRACE_ENABLED, every input to the relay decisions is recorded to a compact binary trace file, so a host can
+# replay it through the same decision code and compare the relays (see host/replay.py):
+#   start       the state when the trace file was started - a warm snapshot (see snapshot.py), the exact RH and
+#               when it was read
+#   reading     an RH reading taken by update_rh(), with its temperature
+#   button      a button press accepted by a button handler
+#   menu        the main loop entering the menu - the presses that follow, until the next decision, are in the menu
+#   automate    a main loop pass that ran automate_energizing()
+#   capacity    a main loop pass that handled a capacity event
+#   command     a command from a host on USB serial that changed a setting (see commands.py)
+#   relay       a relay switching, for comparing with the replay
+#
+# There is one trace file per logfile, named after it: TRACE_BASENAME.<generation>.  It is started again each time
+# the logfile rotates, beginning with a fresh start record, and deleted along with its logfile - so each trace file
+# replays on its own.  Records are buffered in RAM and written TRACE_BUFFER_RECORDS at a time, from core 0.
+#
+# Layout (little endian), one record after another:
+#   header      TRACE_RECORD_HEADER - kind, ms since the trace file started, clock.time()
+#   payload     TRACE_PAYLOADS[kind], then for a start record that many bytes of snapshot
+
+import os
+import struct
+from controller.config import *
+from controller import clock
+from controller import logger
+
+
+TRACE_START    = 0x53           # "S"
+TRACE_READING  = 0x52           # "R"
+TRACE_BUTTON   = 0x42           # "B"
+TRACE_AUTOMATE = 0x41           # "A"
+TRACE_CAPACITY = 0x43           # "C"
+TRACE_MENU     = 0x4d           # "M"
+TRACE_RELAY    = 0x4f           # "O"
+TRACE_COMMAND  = 0x58           # "X"
+
+TRACE_RECORD_HEADER = "<BII"
+TRACE_PAYLOADS = { TRACE_START    : "<dIH",     # current RH, clock.time() it was read, snapshot length
+                   TRACE_READING  : "<dd",      # RH, temperature
+                   TRACE_BUTTON   : "<B",       # index in TRACE_BUTTONS
+                   TRACE_AUTOMATE : "<",
+                   TRACE_CAPACITY : "<",
+                   TRACE_MENU     : "<",
+                   TRACE_RELAY    : "<BB",      # outlet, value
+                   TRACE_COMMAND  : "<BBB" }    # action, outlet, value - see commands.apply_command()
+TRACE_BUTTONS = ( "a", "b", "x", "y" )
+
+trace_file = None           # the open trace file - None when not tracing
+trace_generation = 0        # logfile generation the trace file goes with
+trace_buffer = []           # records not yet written
+trace_ms = 0                # ms since the trace file started, as of trace_ticks_ms
+trace_ticks_ms = 0          # clock.ticks_ms() of the last record
+state_function = None       # returns the exact RH, its time and snapshot data for a start record - see start_trace()
+
+
+##############################################################################################################
+################# BEGIN TRACE ################################################################################
+##############################################################################################################
+#
+# Start tracing, if enabled.  Call once the controller's state is set up, before its first decision.
+#   state   function returning (current RH, clock.time() it was read, warm snapshot data) to start each trace file with
+#
+def start_trace(state):
+    global state_function
+    if not TRACE_ENABLED:
+        return
+    state_function = state
+    open_trace_file()
+    logger.log_message("Tracing to %s.%d" % (TRACE_BASENAME, trace_generation))
+
+#
+# Start the trace file for the current logfile generation, deleting the one that went with the oldest logfile
+#
+def open_trace_file():
+    global trace_file
+    global trace_generation
+    global trace_ms
+    global trace_ticks_ms
+
+    if trace_file:
+        trace_file.close()
+    trace_generation = logger.logfile_generation
+    if trace_generation >= LOGFILE_GENERATIONS:
+        try:
+            os.remove("%s.%d" % (TRACE_BASENAME, trace_generation - LOGFILE_GENERATIONS))
+        except OSError:
+            pass
+    trace_file = open("%s.%d" % (TRACE_BASENAME, trace_generation), "wb")
+    trace_ms = 0
+    trace_ticks_ms = clock.ticks_ms()
+
+    rh, rh_time, data = state_function()
+    record(TRACE_START, struct.pack(TRACE_PAYLOADS[TRACE_START], rh, rh_time, len(data)) + data)
+
+#
+# Buffer a record.  The ms are kept as a running total, so a trace file can be longer than ticks_ms() wraps.
+#
+def record(kind, payload=b""):
+    global trace_ms
+    global trace_ticks_ms
+
+    now = clock.ticks_ms()
+    trace_ms = trace_ms + clock.ticks_diff(now, trace_ticks_ms)
+    trace_ticks_ms = now
+    trace_buffer.append(struct.pack(TRACE_RECORD_HEADER, kind, trace_ms, clock.time()) + payload)
+
+def record_reading(rh, temperature):
+    if trace_file:
+        record(TRACE_READING, struct.pack(TRACE_PAYLOADS[TRACE_READING], rh, temperature))
+
+def record_button(button):
+    if trace_file:
+        record(TRACE_BUTTON, struct.pack(TRACE_PAYLOADS[TRACE_BUTTON], TRACE_BUTTONS.index(button)))
+
+def record_automate():
+    if trace_file:
+        record(TRACE_AUTOMATE)
+
+def record_capacity():
+    if trace_file:
+        record(TRACE_CAPACITY)
+
+def record_menu():
+    if trace_file:
+        record(TRACE_MENU)
+
+def record_command(action, outlet, value):
+    if trace_file:
+        record(TRACE_COMMAND, struct.pack(TRACE_PAYLOADS[TRACE_COMMAND], action, outlet, value))
+
+def record_relay(outlet, value):
+    if trace_file:
+        record(TRACE_RELAY, struct.pack(TRACE_PAYLOADS[TRACE_RELAY], outlet, value))
+
+#
+# Write the buffered records once there are TRACE_BUFFER_RECORDS of them, or now if force.  If the logfile has
+# rotated, finish this trace file and start the next.  Only call from core 0.
+#
+def flush_trace(force=False):
+    global trace_buffer
+
+    if not trace_file:
+        return
+    rotated = logger.logfile_generation != trace_generation
+    if force or rotated or len(trace_buffer) >= TRACE_BUFFER_RECORDS:
+        # a button handler may add a record while writing - it goes in the new buffer
+        records = trace_buffer
+        trace_buffer = []
+        for data in records:
+            trace_file.write(data)
+        trace_file.flush()
+    if rotated:
+        open_trace_file()
+##############################################################################################################
+################## END TRACE #################################################################################
+##############################################################################################################
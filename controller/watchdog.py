@@ -0,0 +1,32 @@
+# 3 humidifier controller - watchdog
+#
+# Resets the Pico if core 0 hangs.  The watchdog is fed by each main loop iteration and by each pass of a menu
+# screen, so a loop that never exits stops the feeding and resets the Pico.  Core 1 is not trusted to feed it -
+# core 0 watches the sensor acquisition task itself (see update_rh()).
+
+import machine
+from controller.config import *
+from controller.logger import log_message
+
+
+wdt = None                  # the machine.WDT once started - see start_watchdog()
+
+
+#
+# Start the watchdog, if enabled.  It cannot be stopped once started.
+#
+def start_watchdog():
+    global wdt
+    if not WATCHDOG_ENABLED:
+        log_message("Watchdog disabled")
+        return
+    wdt = machine.WDT(timeout=WDT_TIMEOUT_MS)
+    log_message("Watchdog started, timeout %d ms" % WDT_TIMEOUT_MS)
+
+
+#
+# Feed the watchdog.  Only call this from a point that shows the controller is making progress.
+#
+def feed_watchdog():
+    if wdt:
+        wdt.feed()
@@ -0,0 +1,56 @@
+# 3 humidifier controller - WiFi (Pico W)
+#
+# Joins WIFI_SSID for the network features - the MQTT publisher (mqtt.py) and the HTTP status server
+# (http_server.py).  Joining goes on in the background: nothing here waits for it, and the features check
+# wifi_connected() each time they want the network.  If the WLAN drops, or gives up joining, it is asked to join
+# again every WIFI_RETRY_SECS.
+
+from controller.config import *
+from controller import clock
+from controller.logger import log_message
+
+
+wlan = None                 # the WiFi interface - None until a network feature sets it up
+wifi_connecting = 0         # wlan.status() while it is joining
+rejoin_time = 0             # clock.time() to next ask a WLAN that is not joined to join
+
+
+##############################################################################################################
+################### BEGIN WIFI ###############################################################################
+##############################################################################################################
+#
+# Start joining WiFi, if nothing has yet.  Call from each network feature's setup.
+#
+def setup_wifi():
+    global wlan
+    global wifi_connecting
+    global rejoin_time
+
+    if wlan is not None:
+        return
+    # only a Pico W has the network module
+    import network
+    wifi_connecting = network.STAT_CONNECTING
+    wlan = network.WLAN(network.STA_IF)
+    wlan.active(True)
+    wlan.connect(WIFI_SSID, WIFI_PASSWORD)
+    rejoin_time = clock.time() + WIFI_RETRY_SECS
+    log_message("WiFi: joining %s" % WIFI_SSID)
+
+#
+# Whether WiFi is up.  If not, and the WLAN has stopped trying, it is asked to join again - at most every
+# WIFI_RETRY_SECS.
+#
+def wifi_connected():
+    global rejoin_time
+
+    if wlan.isconnected():
+        return True
+    if clock.time() >= rejoin_time and wlan.status() != wifi_connecting:
+        wlan.connect(WIFI_SSID, WIFI_PASSWORD)
+        rejoin_time = clock.time() + WIFI_RETRY_SECS
+    return False
+#
+##############################################################################################################
+#################### END WIFI ################################################################################
+##############################################################################################################
@@ -0,0 +1,374 @@
+# Fault injection - how quickly does the controller recover?
+#
+# Boots the controller on the host stand-ins (see hal.py), lets it settle with one humidifier running, injects a
+# fault and measures how long after the reset the relays are back as they were and the first frame is drawn.
+#   crash   an exception in the main loop - the crash handler saves a warm snapshot and resets
+#   hang    an I2C transaction never finishes during a reading - core 0 sees the acquisition task stall and resets warm
+#   freeze  the main loop stops - the watchdog resets
+#
+# A fault in a boot step must reset the controller too, and must not hold the relays on through a reset loop.
+#   bootcrash   a crash in the main loop, then BOOT_CRASHES boots that each crash as soon as they switch a relay or
+#               the sensor power on - the first of them restores the warm snapshot, the rest must come up with the
+#               relays off.  Then a boot without the fault must have as many relays back on as before.
+#
+# The sensor faults must not reset the controller at all.  They run on a virtual clock, with the fault lasting until
+# the RH is stale, and check that the relays go to the fail-safe, the screen keeps updating and says so, and all is
+# back to normal once the sensor is.
+#   unplug  the DHT20 stops answering
+#   busy    the DHT20's busy bit sticks, so every measurement misses its deadline
+#
+# Nor must a sensor fault that does reset it keep a stale RH in use.  On a virtual clock that starts again at each
+# reset, as the Pico's does:
+#   crashloop   the DHT20's driver raises at every reading, so the controller crashes and restarts warm over and over.
+#               The RH keeps its age across the resets, so once it has been stale for RH_STALE_SECS of running the
+#               relays must go off and stay off, and be back once the sensor is.
+#
+# Run from anywhere with host Python (hang and freeze take 10-20 seconds - they wait for the stall or watchdog):
+#   python host/fault_injection.py [crash|hang|freeze|bootcrash|unplug|busy|crashloop|all]
+
+import contextlib
+import os
+import sys
+import tempfile
+
+import hal
+
+RECOVERY_TARGET_MS = 1000       # the restart should have the relays back within this
+ROOM_RH = 53.0                  # between the default low and on thresholds - one humidifier running
+FAULT_AFTER_MS = 3000           # let the first boot settle before the fault
+SENSOR_FAULT_AFTER_SECS = 600   # let a sensor fault scenario settle for a few readings first
+CHECK_MARGIN_SECS = 60          # how long after a change is due to check for it
+BOOT_CRASHES = 3                # boots in a row that crash while booting
+CRASH_LOOP_MAX_BOOTS = 200      # give up on the crash loop reaching the fail-safe after this many boots
+CRASH_LOOP_OFF_BOOTS = 5        # boots the relays must stay off for once it has
+SCENARIOS = [ "crash", "hang", "freeze", "bootcrash", "unplug", "busy", "crashloop" ]
+SENSOR_FAULT_SCENARIOS = [ "unplug", "busy" ]
+
+# sensor fault scenarios run quietly without the watchdog, as simulate.py does
+SENSOR_FAULT_OVERRIDES = { "LOG_TO_CONSOLE" : False, "WATCHDOG_ENABLED" : False }
+# each crash restart is over in a second or so - the RH is stale sooner, to keep the loop to a few dozen restarts
+CRASH_LOOP_OVERRIDES = dict(SENSOR_FAULT_OVERRIDES, RH_STALE_SECS=360)
+
+
+class InjectedFault(Exception):
+    pass
+
+
+#
+# Run one scenario in its own flash directory and report on it.  Returns True if it recovered in time.
+#
+def run_scenario(name):
+    flash_dir = tempfile.mkdtemp(prefix="humidifier-%s-" % name)
+    hal.install(flash_dir)
+    from controller import config
+
+    dht20 = hal.DHT20Device(rh=ROOM_RH, power_pin=config.HMIDITY_SENSOR_POWER_PIN_NUMBER)
+    hal.i2c_devices = { hal.DHT20Device.ADDRESS : dht20 }
+    hal.timers = []
+    hal.reset_cause = hal.PWRON_RESET
+    fault = {}
+
+    def inject():
+        fault["ms"] = hal.ticks_ms()
+        if name == "crash":
+            raise InjectedFault("injected fault")
+        if name == "hang":
+            dht20.hang = True
+            return
+        while True:
+            hal.sleep_ms(10)
+
+    def stop():
+        raise hal.Stop()
+
+    def outlets():
+        return [ hal.pins[number].value() for number in config.OUTLET_PIN_NUMBERS ]
+
+    with open(os.path.join(flash_dir, "console.log"), "w") as console, contextlib.redirect_stdout(console):
+        # first boot, faulted once it has settled
+        hal.after(FAULT_AFTER_MS, inject)
+        reset = hal.boot()
+        reset_ms = hal.ticks_ms()
+        if reset is None:
+            print("%s: the controller did not reset" % name, file=sys.stderr)
+            return False
+        relays_before = outlets()
+
+        # the fault is gone after the reset - the sensor was power cycled with the Pico
+        dht20.hang = False
+        recovered = {}
+
+        def relays_changed(pin, value):
+            if "ms" not in recovered and pin.id in config.OUTLET_PIN_NUMBERS and outlets() == relays_before:
+                recovered["ms"] = hal.ticks_ms()
+
+        hal.on_pin_change = relays_changed
+        hal.after(3000, stop)
+        hal.boot()
+        hal.on_pin_change = None
+
+    print("%s: flash and console log in %s" % (name, flash_dir))
+    print("  fault at %d ms, reset %d ms later, reset cause %d" % (fault["ms"], reset_ms - fault["ms"], reset.cause))
+    print("  relays before the reset %s" % relays_before)
+    if hal.first_update_ms is not None:
+        print("  first frame %d ms after the reset" % (hal.first_update_ms - reset_ms))
+    if not 1 in relays_before:
+        print("  no relays to restore")
+        return True
+    if "ms" not in recovered:
+        print("  relays NOT restored")
+        return False
+    recovery_ms = recovered["ms"] - reset_ms
+    print("  relays restored %d ms after the reset (target %d ms)" % (recovery_ms, RECOVERY_TARGET_MS))
+    if os.path.exists(os.path.join(flash_dir, config.CRASH_LOG_FILENAME)):
+        print("  crash recorded in %s" % config.CRASH_LOG_FILENAME)
+    return recovery_ms <= RECOVERY_TARGET_MS
+
+
+#
+# Run the boot crash scenario in its own flash directory and report on it.  Returns True if it passed.
+#
+def run_boot_crash_scenario(name):
+    flash_dir = tempfile.mkdtemp(prefix="humidifier-%s-" % name)
+    hal.install(flash_dir)
+    from controller import config
+
+    dht20 = hal.DHT20Device(rh=ROOM_RH, power_pin=config.HMIDITY_SENSOR_POWER_PIN_NUMBER)
+    hal.i2c_devices = { hal.DHT20Device.ADDRESS : dht20 }
+    hal.timers = []
+    hal.reset_cause = hal.PWRON_RESET
+    problems = []
+
+    def inject():
+        raise InjectedFault("injected fault")
+
+    def boot_fault(pin, value):
+        if value == 1:
+            raise InjectedFault("injected boot fault")
+
+    def stop():
+        raise hal.Stop()
+
+    def outlets():
+        return [ hal.pins[number].value() if number in hal.pins else 0 for number in config.OUTLET_PIN_NUMBERS ]
+
+    boot_relays = []
+    with open(os.path.join(flash_dir, "console.log"), "w") as console, contextlib.redirect_stdout(console):
+        # first boot, crashed in the main loop once it has settled
+        hal.after(FAULT_AFTER_MS, inject)
+        if hal.boot() is None:
+            problems.append("the controller did not reset after the crash")
+        relays_before = outlets()
+
+        # boots that crash part way through
+        hal.on_pin_change = boot_fault
+        for i in range(BOOT_CRASHES):
+            if hal.boot() is None:
+                problems.append("boot %d did not reset after its crash" % (i + 2))
+            boot_relays.append(outlets())
+        hal.on_pin_change = None
+
+        # and one without the fault
+        hal.after(3000, stop)
+        if hal.boot() is not None:
+            problems.append("the last boot reset")
+        relays_after = outlets()
+
+    print("%s: flash and console log in %s" % (name, flash_dir))
+    print("  relays %s before the crash, %s at each boot crash, %s once booting works again"
+          % (relays_before, " ".join(str(relays) for relays in boot_relays), relays_after))
+    if not 1 in relays_before:
+        problems.append("no relays on before the crash to check")
+    for relays in boot_relays[1:]:
+        if 1 in relays:
+            problems.append("a relay was on after a crash while booting")
+    # a cold boot may choose another humidifier for light humidifying - as many are back on
+    if sum(relays_after) != sum(relays_before):
+        problems.append("the relays are not back as they were")
+    with open(os.path.join(flash_dir, "console.log")) as f:
+        boot_crashes = f.read().count("Crashed while booting")
+    if boot_crashes != BOOT_CRASHES:
+        problems.append("%d crashes while booting logged, not %d" % (boot_crashes, BOOT_CRASHES))
+    for problem in problems:
+        print("  FAILED - %s" % problem)
+    if not problems:
+        print("  each crash while booting reset the controller, with the relays off after the first")
+    return not problems
+
+
+#
+# Run one sensor fault scenario in its own flash directory and report on it.  Returns True if it passed.
+#
+def run_sensor_fault_scenario(name):
+    flash_dir = tempfile.mkdtemp(prefix="humidifier-%s-" % name)
+    hal.install(flash_dir)
+    from controller.clock import VirtualClock
+    from controller import config
+
+    clock = VirtualClock()
+    dht20 = hal.DHT20Device(rh=ROOM_RH, power_pin=config.HMIDITY_SENSOR_POWER_PIN_NUMBER)
+    hal.i2c_devices = { hal.DHT20Device.ADDRESS : dht20 }
+    hal.timers = []
+    hal.reset_cause = hal.PWRON_RESET
+    problems = []
+    seen = {}
+
+    def policy():
+        return sys.modules["controller.policy"]
+
+    def outlets():
+        return [ hal.pins[number].value() for number in config.OUTLET_PIN_NUMBERS ]
+
+    def inject():
+        seen["relays"] = outlets()
+        seen["humidifying"] = policy().humidifying
+        seen["updates"] = hal.display_updates
+        if name == "unplug":
+            del hal.i2c_devices[hal.DHT20Device.ADDRESS]
+        else:
+            dht20.stuck_busy = True
+
+    def check_failsafe():
+        seen["failsafe_relays"] = outlets()
+        if not policy().failsafe:
+            problems.append("not in fail-safe %d secs after the fault" % (config.RH_STALE_SECS + CHECK_MARGIN_SECS))
+        if (1 in outlets()) != (config.FAILSAFE_HUMIDIFYING != "off"):
+            problems.append("relays %s are not fail-safe humidifying %s" % (outlets(), config.FAILSAFE_HUMIDIFYING))
+        if hal.display_updates <= seen["updates"]:
+            problems.append("the screen stopped updating")
+        if not [ text for text in hal.screen_texts if text.startswith("SENSOR FAILED") ]:
+            problems.append("the screen does not show the sensor failed: %s" % hal.screen_texts)
+        # the sensor is back
+        hal.i2c_devices[hal.DHT20Device.ADDRESS] = dht20
+        dht20.stuck_busy = False
+
+    def check_recovered():
+        if policy().failsafe or policy().failed_readings:
+            problems.append("still failing after the sensor came back")
+        # the light humidifier may have rotated meanwhile - the same humidifying is back
+        if policy().humidifying != seen["humidifying"] or sum(outlets()) != sum(seen["relays"]):
+            problems.append("humidifying %s with relays %s, not back to %s with %s"
+                            % (policy().humidifying, outlets(), seen["humidifying"], seen["relays"]))
+        raise hal.Stop()
+
+    fault_secs = SENSOR_FAULT_AFTER_SECS
+    failsafe_secs = fault_secs + config.RH_STALE_SECS + CHECK_MARGIN_SECS
+    recovered_secs = failsafe_secs + config.SENSOR_FAILED_RETRY_SECS + CHECK_MARGIN_SECS
+    clock.call_at(fault_secs * 1000, inject)
+    clock.call_at(failsafe_secs * 1000, check_failsafe)
+    clock.call_at(recovered_secs * 1000, check_recovered)
+
+    with open(os.path.join(flash_dir, "console.log"), "w") as console, contextlib.redirect_stdout(console):
+        reset = hal.boot(clock=clock, overrides=SENSOR_FAULT_OVERRIDES)
+    if reset is not None:
+        problems.append("the controller reset, cause %d" % reset.cause)
+
+    print("%s: flash and console log in %s" % (name, flash_dir))
+    if "failsafe_relays" in seen:
+        print("  fault at %d s, relays %s -> %s when the RH was stale at %d s, sensor back until %d s"
+              % (fault_secs, seen["relays"], seen["failsafe_relays"], failsafe_secs, recovered_secs))
+    for problem in problems:
+        print("  FAILED - %s" % problem)
+    if not problems:
+        print("  fail-safe while the sensor was out, no reset, recovered once it was back")
+    return not problems
+
+
+#
+# Run the crash loop scenario in its own flash directory and report on it.  Returns True if it passed.
+#
+def run_crash_loop_scenario(name):
+    flash_dir = tempfile.mkdtemp(prefix="humidifier-%s-" % name)
+    hal.install(flash_dir)
+    from controller.clock import VirtualClock
+    from controller import config
+
+    dht20 = hal.DHT20Device(rh=ROOM_RH, power_pin=config.HMIDITY_SENSOR_POWER_PIN_NUMBER)
+    hal.i2c_devices = { hal.DHT20Device.ADDRESS : dht20 }
+    hal.timers = []
+    hal.reset_cause = hal.PWRON_RESET
+    problems = []
+
+    def outlets():
+        return [ hal.pins[number].value() if number in hal.pins else 0 for number in config.OUTLET_PIN_NUMBERS ]
+
+    def inject():
+        dht20.error = RuntimeError("injected sensor driver fault")
+
+    def stop():
+        raise hal.Stop()
+
+    with open(os.path.join(flash_dir, "console.log"), "w") as console, contextlib.redirect_stdout(console):
+        # first boot, with the driver faulted once it has settled - it crashes at the next reading
+        clock = VirtualClock()
+        clock.call_at(SENSOR_FAULT_AFTER_SECS * 1000, inject)
+        reset = hal.boot(clock=clock, overrides=CRASH_LOOP_OVERRIDES)
+        relays_before = outlets()
+        if reset is None:
+            problems.append("the driver fault did not reset the controller")
+
+        # restarts, each crashing at its first reading, until the relays go off
+        boots = 0
+        while reset is not None and 1 in outlets() and boots < CRASH_LOOP_MAX_BOOTS:
+            clock = VirtualClock()
+            reset = hal.boot(clock=clock, overrides=CRASH_LOOP_OVERRIDES)
+            boots = boots + 1
+        config = sys.modules["controller.config"]
+        policy = sys.modules["controller.policy"]
+        rh_age = clock.time() - policy.current_rh_time
+        failsafe = policy.failsafe
+
+        # and they stay off
+        for i in range(CRASH_LOOP_OFF_BOOTS):
+            clock = VirtualClock()
+            reset = hal.boot(clock=clock, overrides=CRASH_LOOP_OVERRIDES)
+            if 1 in outlets():
+                problems.append("a relay came back on %d boots after the fail-safe" % (i + 1))
+
+        # the sensor is back
+        dht20.error = None
+        clock = VirtualClock()
+        clock.call_at(CHECK_MARGIN_SECS * 1000, stop)
+        if hal.boot(clock=clock, overrides=CRASH_LOOP_OVERRIDES) is not None:
+            problems.append("the controller reset once the sensor was back")
+        relays_after = outlets()
+
+    print("%s: flash and console log in %s" % (name, flash_dir))
+    print("  relays %s before the fault, off after %d crash restarts with the RH %d s old (stale after %d s), %s once the sensor was back"
+          % (relays_before, boots, rh_age, config.RH_STALE_SECS, relays_after))
+    if not 1 in relays_before:
+        problems.append("no relays on before the fault to check")
+    if boots >= CRASH_LOOP_MAX_BOOTS:
+        problems.append("the relays were still on after %d crash restarts" % boots)
+    elif not failsafe or rh_age <= config.RH_STALE_SECS:
+        problems.append("the relays went off without the RH being stale")
+    if sum(relays_after) != sum(relays_before):
+        problems.append("the relays are not back as they were")
+    for problem in problems:
+        print("  FAILED - %s" % problem)
+    if not problems:
+        print("  the RH went stale through the crash restarts, fail-safe until the sensor was back")
+    return not problems
+
+
+def main():
+    scenarios = sys.argv[1:] or [ "all" ]
+    if scenarios == [ "all" ]:
+        scenarios = SCENARIOS
+    passed = True
+    for name in scenarios:
+        if name not in SCENARIOS:
+            sys.exit("unknown scenario %s - use %s or all" % (name, ", ".join(SCENARIOS)))
+        if name in SENSOR_FAULT_SCENARIOS:
+            passed = run_sensor_fault_scenario(name) and passed
+        elif name == "bootcrash":
+            passed = run_boot_crash_scenario(name) and passed
+        elif name == "crashloop":
+            passed = run_crash_loop_scenario(name) and passed
+        else:
+            passed = run_scenario(name) and passed
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
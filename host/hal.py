@@ -0,0 +1,545 @@
+# Host stand-in for the Pico hardware
+#
+# Runs the controller under CPython.  install() adds the MicroPython-only parts of time, gc and sys to CPython, and the
+# machine, picographics, pimoroni and network modules in this directory stand in for the Pico's.  The stand-ins keep
+# their state here, so a script can look at the relays and display, inject faults and boot the controller again after
+# a reset:
+#   pins            machine.Pin stand-ins by GPIO number (the outlets, the sensor power and the buttons)
+#   i2c_devices     I2C address -> device stand-in - DHT20Device, SHT3xDevice, BME280Device or TCA9548ADevice (and the
+#                   devices behind it)
+#   timers          (due ms, callback) pairs, run from sleeps - the controller only waits in sleeps.  They are the
+#                   outside world, so they carry on across boots.
+#   on_pin_change   called with (pin, value) whenever an output pin changes
+#   wifi_up         whether the Pico W's WLAN can join - see network.py
+#
+# The time spent in lightsleep and the backlight brightness are kept for energy_estimate().
+#
+# Faults and stops are raised from the callbacks.  Reset and Stop are BaseExceptions so the controller's own
+# "except Exception" handlers cannot swallow them.
+#
+# For a simulation, boot() can put the controller on a virtual clock (controller/clock.py) - the stand-ins then
+# follow virtual time too, and timers are the virtual clock's events rather than the ones here.  It can also
+# override configuration constants.
+#
+# _thread.start_new_thread() runs core 1's task as a thread.  Timers and the watchdog are only handled on the main
+# thread (core 0), and a reset ends the threads started by that boot at their next sleep or I2C transaction.
+
+import _thread
+import ast
+import gc
+import os
+import re
+import runpy
+import struct
+import sys
+import threading
+import time
+import types
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(HOST_DIR)
+ENTRY_POINT = os.path.join(REPO_DIR, "humidifiers.py")
+
+PWRON_RESET = 1
+WDT_RESET = 3
+
+# Rough power draw, for energy_estimate() - the Pico awake (125MHz, both cores) and in lightsleep, and the Display
+# Pack's backlight at full brightness.  The relays have their own supply and are not counted.
+AWAKE_MW = 95
+LIGHTSLEEP_MW = 7
+BACKLIGHT_MW = 65
+
+
+#
+# Raised by machine.reset() and by the watchdog - the controller has reset the Pico
+#
+class Reset(BaseException):
+    def __init__(self, cause):
+        BaseException.__init__(self, "reset")
+        self.cause = cause
+
+
+#
+# Raised from a timer callback to end a boot
+#
+class Stop(BaseException):
+    pass
+
+
+pins = {}
+i2c_devices = {}
+timers = []
+on_pin_change = None
+wifi_up = True
+reset_cause = PWRON_RESET
+wdt_timeout_ms = 0              # 0 until the controller starts the watchdog
+wdt_deadline_ms = 0
+display_updates = 0             # display.update() calls this boot
+first_update_ms = None          # ticks_ms() of the first display.update() this boot
+screen_texts = []               # texts on the screen as of the last display.update()
+boot_count = 0                  # boots so far - a thread started by an earlier boot must stop
+thread_boot = threading.local() # .boot is the boot_count when this thread was started
+virtual_clock = None            # the controller's VirtualClock, if it is running on one
+woken = False                   # set by an interrupt to end a real time lightsleep() early
+boot_ms = 0                     # ticks_ms() when this boot started
+lightsleep_ms = 0               # ms spent in real time lightsleep() this boot
+backlight = 1.0                 # the backlight's brightness
+backlight_ms = 0                # ticks_ms() the backlight brightness last changed
+backlight_level_ms = 0.0        # brightness times ms, summed this boot up to backlight_ms
+
+sleep = time.sleep
+start_new_thread = _thread.start_new_thread
+full_collect = gc.collect
+wall_time = time.time
+wall_localtime = time.localtime
+start_monotonic = time.monotonic()
+
+
+def ticks_ms():
+    if virtual_clock:
+        return virtual_clock.ticks_ms()
+    return int((time.monotonic() - start_monotonic) * 1000)
+
+def ticks_us():
+    return int((time.monotonic() - start_monotonic) * 1000000)
+
+def ticks_diff(end, start):
+    return end - start
+
+def ticks_add(ticks, delta):
+    return ticks + delta
+
+
+#
+# Run any timers that are due and check the watchdog.  Called from every sleep and I2C transaction.
+# On a core 1 thread, only check that the boot which started it is still running.
+#
+def poll():
+    global timers
+    if threading.current_thread() is not threading.main_thread():
+        if thread_boot.boot != boot_count:
+            raise SystemExit()
+        return
+    now = ticks_ms()
+    due = [ timer for timer in timers if timer[0] <= now ]
+    if due:
+        timers = [ timer for timer in timers if timer[0] > now ]
+        for timer in due:
+            timer[1]()
+    if wdt_timeout_ms and now >= wdt_deadline_ms:
+        raise Reset(WDT_RESET)
+
+def sleep_ms(ms):
+    poll()
+    sleep(ms / 1000)
+    poll()
+
+def sleep_secs(secs):
+    sleep_ms(secs * 1000)
+
+#
+# machine.lightsleep() in real time - sleeps in short steps so timers still run, until ms is up or an interrupt
+#
+def lightsleep(ms):
+    global woken
+    global lightsleep_ms
+    start_ms = ticks_ms()
+    woken = False
+    while not woken and ticks_ms() - start_ms < ms:
+        sleep_ms(min(10, ms - (ticks_ms() - start_ms)))
+    lightsleep_ms = lightsleep_ms + ticks_ms() - start_ms
+
+#
+# An interrupt - wakes a lightsleep
+#
+def wake():
+    global woken
+    if virtual_clock:
+        virtual_clock.wake()
+    woken = True
+
+def set_backlight(brightness):
+    global backlight
+    global backlight_ms
+    global backlight_level_ms
+    now = ticks_ms()
+    backlight_level_ms = backlight_level_ms + backlight * (now - backlight_ms)
+    backlight = brightness
+    backlight_ms = now
+
+#
+# Estimate the power used this boot so far.  Returns (% of the time awake, average backlight brightness, average mW).
+#
+def energy_estimate():
+    elapsed_ms = max(1, ticks_ms() - boot_ms)
+    asleep_ms = virtual_clock.lightsleep_ms if virtual_clock else lightsleep_ms
+    awake = 1.0 - asleep_ms / elapsed_ms
+    brightness = (backlight_level_ms + backlight * (ticks_ms() - backlight_ms)) / elapsed_ms
+    return 100.0 * awake, brightness, awake * AWAKE_MW + (1.0 - awake) * LIGHTSLEEP_MW + brightness * BACKLIGHT_MW
+
+def print_exception(exc, file=None):
+    import traceback
+    traceback.print_exception(type(exc), exc, exc.__traceback__, file=file or sys.stdout)
+
+
+#
+# Run callback after ms milliseconds (from now)
+#
+def after(ms, callback):
+    timers.append((ticks_ms() + ms, callback))
+
+
+#
+# Start a core 1 thread, noting the boot that started it
+#
+def start_thread(function, args):
+    boot = boot_count
+
+    def run():
+        thread_boot.boot = boot
+        function(*args)
+
+    return start_new_thread(run, ())
+
+
+#
+# Feed or start the watchdog - called by the machine.WDT stand-in
+#
+def feed_watchdog(timeout_ms=None):
+    global wdt_timeout_ms
+    global wdt_deadline_ms
+    if timeout_ms is not None:
+        wdt_timeout_ms = timeout_ms
+    wdt_deadline_ms = ticks_ms() + wdt_timeout_ms
+
+
+#
+# Patch CPython to look like MicroPython and put the stand-ins and the repo on sys.path
+#   flash_dir   directory used as the Pico's flash - the logfiles and snapshot are written there
+#
+def install(flash_dir):
+    global virtual_clock
+
+    time.ticks_ms = ticks_ms
+    time.ticks_us = ticks_us
+    time.ticks_diff = ticks_diff
+    time.ticks_add = ticks_add
+    time.sleep_ms = sleep_ms
+    time.sleep = sleep_secs
+    # MicroPython's time() is whole seconds and its localtime() has 8 fields
+    time.time = lambda: int(wall_time())
+    time.localtime = lambda *args: tuple(wall_localtime(*args))[:8]
+    # the controller collects at its idle points to keep MicroPython's heap tidy - CPython only needs a quick one
+    gc.collect = lambda: full_collect(0)
+    gc.mem_alloc = lambda: 0
+    gc.mem_free = lambda: 100000
+    sys.print_exception = print_exception
+    _thread.start_new_thread = start_thread
+
+    for path in (REPO_DIR, HOST_DIR):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    os.makedirs(flash_dir, exist_ok=True)
+    os.chdir(flash_dir)
+    # real time until boot() or load_controller() chooses a virtual clock
+    virtual_clock = None
+
+
+#
+# Load controller/config.py with some of its constants overridden.  Constants derived from an overridden one
+# follow it, as each override replaces the value in the constant's own assignment.
+#   overrides   constant name -> value
+#
+def load_config(overrides):
+    import controller
+    path = os.path.join(REPO_DIR, "controller", "config.py")
+    with open(path) as f:
+        source = f.read()
+    for name, value in overrides.items():
+        source, count = re.subn(r"^%s\s*=[^#\n]*" % name, "%s = %r " % (name, value), source, count=1, flags=re.MULTILINE)
+        if count == 0:
+            raise KeyError("no constant %s in config.py" % name)
+    config = types.ModuleType("controller.config")
+    config.__file__ = path
+    exec(compile(source, path, "exec"), config.__dict__)
+    sys.modules["controller.config"] = config
+    controller.config = config
+
+
+#
+# Parse --set NAME=VALUE command line settings into configuration overrides for load_config().  The value is a Python
+# literal, or a bare string (e.g. CONTROL_MODE=duty).
+#
+def parse_settings(settings):
+    overrides = {}
+    for setting in settings:
+        name, sep, value = setting.partition("=")
+        if not sep:
+            raise ValueError("--set %s is not NAME=VALUE" % setting)
+        try:
+            overrides[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            overrides[name] = value
+    return overrides
+
+
+#
+# Load the controller afresh: forget the controller modules from any previous boot, then override configuration
+# constants and choose the clock for the next import.
+#   clock       a controller.clock.VirtualClock to run the controller on, or None for real time
+#   overrides   configuration constants to override - see load_config()
+#
+def load_controller(clock=None, overrides=None):
+    global virtual_clock
+
+    for name in list(sys.modules):
+        if name == "controller" or name.startswith("controller."):
+            del sys.modules[name]
+    if overrides:
+        load_config(overrides)
+    virtual_clock = clock
+    if clock:
+        from controller import clock as controller_clock
+        controller_clock.use_clock(clock)
+
+
+#
+# Boot the controller: load it afresh (see load_controller()), forget the hardware state from any previous boot and
+# run the entry point.  Returns the Reset that ended the boot, or None if a Stop ended it.
+#
+def boot(clock=None, overrides=None):
+    global pins
+    global wdt_timeout_ms
+    global display_updates
+    global first_update_ms
+    global screen_texts
+    global reset_cause
+    global boot_count
+    global boot_ms
+    global lightsleep_ms
+    global backlight
+    global backlight_ms
+    global backlight_level_ms
+
+    boot_count = boot_count + 1
+    load_controller(clock, overrides)
+    boot_ms = ticks_ms()
+    lightsleep_ms = 0
+    backlight = 1.0
+    backlight_ms = boot_ms
+    backlight_level_ms = 0.0
+    pins = {}
+    wdt_timeout_ms = 0
+    display_updates = 0
+    first_update_ms = None
+    screen_texts = []
+
+    try:
+        runpy.run_path(ENTRY_POINT, run_name="__main__")
+    except Reset as reset:
+        reset_cause = reset.cause
+        return reset
+    except Stop:
+        pass
+    return None
+
+
+#
+# CRC-8 as the DHT20 and SHT3x send it
+#
+def crc8(data):
+    crc = 0xff
+    for byte in data:
+        crc ^= byte
+        for i in range(8):
+            crc = ((crc << 1) ^ 0x31) & 0xff if crc & 0x80 else (crc << 1) & 0xff
+    return crc
+
+
+#
+# DHT20 humidity and temperature sensor stand-in
+#   rh, temperature     what it reads
+#   power_pin           GPIO number powering it - it does not answer while the pin is low
+#   stuck_busy          fault - the busy bit never clears
+#   hang                fault - a transaction never finishes, as if the bus were stuck beyond the I2C timeout
+#   error               fault - an exception every transaction raises, as a bug in the driver would
+#
+class DHT20Device:
+    ADDRESS = 0x38
+
+    def __init__(self, rh=50.0, temperature=21.0, power_pin=None):
+        self.rh = rh
+        self.temperature = temperature
+        self.power_pin = power_pin
+        self.stuck_busy = False
+        self.hang = False
+        self.error = None
+        self.measure_done_ms = 0
+
+    def powered(self):
+        return self.power_pin is None or (self.power_pin in pins and pins[self.power_pin].value() == 1)
+
+    def hang_if_faulted(self):
+        if self.error:
+            raise self.error
+        while self.hang:
+            sleep_ms(10)
+
+    def writeto(self, data):
+        self.hang_if_faulted()
+        if data[0] == 0xac:
+            # trigger a measurement - it takes 80ms
+            self.measure_done_ms = ticks_ms() + 80
+
+    def readfrom(self, count):
+        self.hang_if_faulted()
+        status = 0x18
+        if self.stuck_busy or ticks_ms() < self.measure_done_ms:
+            status = status | 0x80
+        rh_raw = int(self.rh * 1048576 / 100) & 0xfffff
+        temperature_raw = int((self.temperature + 50) * 1048576 / 200) & 0xfffff
+        data = [ status, rh_raw >> 12, (rh_raw >> 4) & 0xff, ((rh_raw & 0x0f) << 4) | (temperature_raw >> 16),
+                 (temperature_raw >> 8) & 0xff, temperature_raw & 0xff ]
+        return bytes(data + [ crc8(data) ])[:count]
+
+
+#
+# SHT3x humidity and temperature sensor stand-in - single shot measurements without clock stretching
+#   rh, temperature     what it reads
+#   power_pin           GPIO number powering it - it does not answer while the pin is low
+#
+class SHT3xDevice:
+    ADDRESS = 0x44
+
+    def __init__(self, rh=50.0, temperature=21.0, power_pin=None):
+        self.rh = rh
+        self.temperature = temperature
+        self.power_pin = power_pin
+        self.measure_done_ms = 0
+        self.reply = b""
+
+    def powered(self):
+        return self.power_pin is None or (self.power_pin in pins and pins[self.power_pin].value() == 1)
+
+    def words(self, *words):
+        data = []
+        for word in words:
+            data = data + [ word >> 8, word & 0xff, crc8([ word >> 8, word & 0xff ]) ]
+        return bytes(data)
+
+    def writeto(self, data):
+        command = (data[0] << 8) | data[1]
+        if command == 0x2400:
+            # single shot at high repeatability - it takes 12.5ms
+            self.measure_done_ms = ticks_ms() + 13
+            self.reply = self.words(int((self.temperature + 45) * 65535 / 175), int(self.rh * 65535 / 100))
+        elif command == 0xf32d:
+            self.reply = self.words(0x8010)
+
+    def readfrom(self, count):
+        if ticks_ms() < self.measure_done_ms:
+            raise OSError(5)        # no ACK while measuring
+        return self.reply[:count]
+
+
+#
+# BME280 humidity, temperature and pressure sensor stand-in - forced mode only, and no pressure
+#   rh, temperature     what it reads
+#   power_pin           GPIO number powering it - it does not answer while the pin is low
+#
+class BME280Device:
+    ADDRESS = 0x76
+    CALIBRATION = (27504, 26435, -1000, 75, 362, 0, 313, 50, 30)   # t1-t3, h1-h6, as in a real sensor
+
+    def __init__(self, rh=50.0, temperature=21.0, power_pin=None):
+        self.rh = rh
+        self.temperature = temperature
+        self.power_pin = power_pin
+        self.measure_done_ms = 0
+        self.registers = bytearray(256)
+        self.pointer = 0
+        self.registers[0xd0] = 0x60
+        t1, t2, t3, h1, h2, h3, h4, h5, h6 = self.CALIBRATION
+        self.registers[0x88:0x8e] = struct.pack("<Hhh", t1, t2, t3)
+        self.registers[0xa1] = h1
+        self.registers[0xe1:0xe8] = struct.pack("<hBBBBb", h2, h3, (h4 >> 4) & 0xff, ((h5 & 0x0f) << 4) | (h4 & 0x0f),
+                                                (h5 >> 4) & 0xff, h6)
+
+    def powered(self):
+        return self.power_pin is None or (self.power_pin in pins and pins[self.power_pin].value() == 1)
+
+    # the raw readings for the temperature and RH - the driver's compensation, searched backwards
+    def raw_readings(self):
+        from controller.bme280 import compensate_humidity
+        t1, t2, t3 = self.CALIBRATION[:3]
+
+        def temperature(adc_t):
+            var1 = (((adc_t >> 3) - (t1 << 1)) * t2) >> 11
+            var2 = (((((adc_t >> 4) - t1) * ((adc_t >> 4) - t1)) >> 12) * t3) >> 14
+            return ((var1 + var2) * 5 + 128) / 25600
+
+        def search(value, function, top):
+            low, high = 0, top
+            while low < high:
+                middle = (low + high) // 2
+                if function(middle) < value:
+                    low = middle + 1
+                else:
+                    high = middle
+            return low
+
+        adc_t = search(self.temperature, temperature, 0xfffff)
+        adc_h = search(self.rh, lambda adc_h: compensate_humidity(self.CALIBRATION, adc_t, adc_h), 0xffff)
+        return adc_t, adc_h
+
+    def writeto(self, data):
+        self.pointer = data[0]
+        if len(data) > 1:
+            self.registers[data[0]] = data[1]
+            if data[0] == 0xf4 and data[1] & 0x03 == 0x01:
+                # forced mode - temperature and humidity oversampled once take 6.4ms at most
+                self.measure_done_ms = ticks_ms() + 7
+                adc_t, adc_h = self.raw_readings()
+                self.registers[0xfa:0xff] = bytes([ adc_t >> 12, (adc_t >> 4) & 0xff, (adc_t & 0x0f) << 4,
+                                                    adc_h >> 8, adc_h & 0xff ])
+
+    def readfrom(self, count):
+        self.registers[0xf3] = 0x08 if ticks_ms() < self.measure_done_ms else 0x00
+        return bytes(self.registers[self.pointer:self.pointer + count])
+
+
+#
+# TCA9548A I2C multiplexer stand-in - the devices on the selected channels answer as if they were on the bus
+#   channels    mux channel -> { I2C address -> device stand-in }
+#
+class TCA9548ADevice:
+    def __init__(self, channels):
+        self.channels = channels
+        self.selected = 0
+
+    def powered(self):
+        return True
+
+    def writeto(self, data):
+        self.selected = data[0]
+
+    def readfrom(self, count):
+        return bytes([ self.selected ])[:count]
+
+    def device(self, address):
+        for channel in sorted(self.channels):
+            if self.selected & (1 << channel) and address in self.channels[channel]:
+                return self.channels[channel][address]
+        return None
+
+
+#
+# The device stand-in answering at an I2C address - on the bus, or behind a multiplexer - or None
+#
+def find_i2c_device(address):
+    if address in i2c_devices:
+        return i2c_devices[address]
+    for device in i2c_devices.values():
+        if isinstance(device, TCA9548ADevice) and device.device(address):
+            return device.device(address)
+    return None
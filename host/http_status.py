@@ -0,0 +1,212 @@
+# HTTP status server - does it answer from its kept replies, without holding up the controller?
+#
+# Simulates the controller (see simulate.py) serving HTTP on a localhost port, and a client on the virtual clock that
+# asks for /status or /history every POLL_SECS - stepped once a virtual second on a non-blocking socket, as a browser
+# on a slow network would be.  Now and then it asks for a page that is not there, sends a request too long to take,
+# or sends half a request and stops.  It checks every reply is whole and up to date, the half request is dropped
+# after HTTP_CLIENT_SECS, the replies were made again far less often than they were asked for, and the relays
+# switched just as they do without the server.
+#
+# Or asks a Pico W for its status and history:
+#   python host/http_status.py --pico 192.168.1.50
+#
+# Run from anywhere with host Python:
+#   python host/http_status.py [--days 1]
+
+import argparse
+import json
+import select
+import socket
+import sys
+import urllib.request
+
+from simulate import simulate
+
+POLL_SECS = 10                  # ask for a page this often
+GIVE_UP_SECS = 30               # a reply not in by this long after asking is a failure
+
+# every this many requests, one that is not /status or /history: (request, status line wanted, or None for dropped)
+ODD_EVERY = 50
+ODD_REQUESTS = [ (b"GET /missing HTTP/1.1\r\nHost: pico\r\n\r\n", b"HTTP/1.0 404"),
+                 (b"GET /status HTTP/1.1\r\nX-Padding: " + b"x" * 1024 + b"\r\n\r\n", b"HTTP/1.0 400"),
+                 (b"POST /status HTTP/1.1\r\nHost: pico\r\n\r\n", b"HTTP/1.0 405"),
+                 (b"GET /status HTTP/1.1\r\nHost: pi", None) ]
+
+# the run without the server to compare the relays with is awake every loop pass, as the server keeps it
+BASE_OVERRIDES = { "LOW_POWER_ENABLED" : False }
+
+
+#
+# One request on a non-blocking socket, a step at a time
+#
+class Client:
+    def __init__(self, port, request, clock):
+        self.request = request
+        self.sent = 0
+        self.data = b""
+        self.closed = False
+        self.start_secs = clock.time()
+        self.sock = socket.socket()
+        self.sock.setblocking(False)
+        self.sock.connect_ex(("127.0.0.1", port))
+
+    #
+    # Send what the socket will take of the request, and read what has come back - the reply ends when the server
+    # closes the connection
+    #
+    def step(self):
+        readable, writable, failed = select.select([ self.sock ], [ self.sock ], [], 0)
+        try:
+            if writable and self.sent < len(self.request):
+                self.sent = self.sent + self.sock.send(self.request[self.sent:])
+            if readable:
+                data = self.sock.recv(65536)
+                self.data = self.data + data
+                if not data:
+                    self.close()
+        except ConnectionError:
+            self.close()
+
+    def close(self):
+        self.sock.close()
+        self.closed = True
+
+
+#
+# The status line and the body of a whole reply, or a failure
+#
+def parse_reply(data):
+    head, separator, body = data.partition(b"\r\n\r\n")
+    lines = head.split(b"\r\n")
+    length = [ int(line.split(b":")[1]) for line in lines if line.lower().startswith(b"content-length:") ]
+    if not separator or not length or length[0] != len(body):
+        raise ValueError("a reply that is not whole: %r" % data[:80])
+    return lines[0], body
+
+
+def check_pico(address, port):
+    for path in ("/status", "/history"):
+        with urllib.request.urlopen("http://%s:%d%s" % (address, port, path), timeout=10) as reply:
+            body = json.loads(reply.read())
+        if path == "/history":
+            body["rh"] = "%d readings, newest %s" % (len(body["rh"]), body["rh"][-1])
+        print("%s %s" % (path, json.dumps(body, indent=2)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate serving HTTP status requests, or ask a Pico W")
+    parser.add_argument("--days", type=float, default=1, help="how many days to simulate")
+    parser.add_argument("--pico", help="ask the Pico W at this address instead of simulating")
+    parser.add_argument("--port", type=int, default=80, help="the Pico W's HTTP_PORT")
+    args = parser.parse_args()
+
+    if args.pico:
+        check_pico(args.pico, args.port)
+        return
+
+    # a free port for the server
+    probe = socket.socket()
+    probe.bind(("127.0.0.1", 0))
+    port = probe.getsockname()[1]
+    probe.close()
+
+    counts = { "asked" : 0, "status" : 0, "history" : 0, "odd" : 0, "dropped" : 0 }
+    failures = []
+
+    def schedule(clock):
+        client = None
+
+        def modules():
+            return sys.modules["controller.config"], sys.modules["controller.policy"]
+
+        def check(done, client_secs):
+            config, policy = modules()
+            request = done.request
+            wanted = done.wanted
+            try:
+                if wanted is None:
+                    # the half request - dropped with no reply once it has had HTTP_CLIENT_SECS
+                    if done.data or not config.HTTP_CLIENT_SECS <= client_secs <= config.HTTP_CLIENT_SECS + 3:
+                        raise ValueError("a half request got %r after %d s" % (done.data[:40], client_secs))
+                    counts["dropped"] = counts["dropped"] + 1
+                    return
+                status_line, body = parse_reply(done.data)
+                if not status_line.startswith(wanted):
+                    raise ValueError("%r for %r" % (status_line, request[:40]))
+                if wanted != b"HTTP/1.0 200":
+                    counts["odd"] = counts["odd"] + 1
+                    return
+                reply = json.loads(body)
+                if request.startswith(b"GET /status"):
+                    counts["status"] = counts["status"] + 1
+                    reading_time = reply["time"]
+                    if (reply["on_rh"], reply["low_rh"]) != (policy.on_rh, policy.low_rh):
+                        raise ValueError("the status shows other thresholds")
+                    if [ outlet["setting"] for outlet in reply["outlets"] ] != [ h.setting for h in policy.humidifiers ]:
+                        raise ValueError("the status shows other settings")
+                else:
+                    counts["history"] = counts["history"] + 1
+                    reading_time = reply["newest_time"]
+                    if len(reply["rh"]) != config.MAX_PREV_RH_READINGS:
+                        raise ValueError("a history of %d readings" % len(reply["rh"]))
+                    if reading_time == policy.current_rh_time and reply["rh"][-1] != round(policy.prev_rh_readings[-1] / 100, 2):
+                        raise ValueError("the history's newest reading is not the current one")
+                # served from the reading before at worst - one may have come in while the reply was on its way
+                if not 0 <= policy.current_rh_time - reading_time <= config.RH_UPDATE_SECS:
+                    raise ValueError("a reply from %d s before the current reading" % (policy.current_rh_time - reading_time))
+            except ValueError as err:
+                failures.append("at %d s: %s" % (clock.time(), err))
+
+        def step():
+            nonlocal client
+            if client is None and clock.time() % POLL_SECS == 0:
+                counts["asked"] = counts["asked"] + 1
+                if counts["asked"] % ODD_EVERY == 0:
+                    request, wanted = ODD_REQUESTS[counts["asked"] // ODD_EVERY % len(ODD_REQUESTS)]
+                else:
+                    path = b"/status" if counts["asked"] % 2 else b"/history"
+                    request, wanted = b"GET " + path + b" HTTP/1.1\r\nHost: pico\r\n\r\n", b"HTTP/1.0 200"
+                client = Client(port, request, clock)
+                client.wanted = wanted
+            if client is not None:
+                client.step()
+                client_secs = clock.time() - client.start_secs
+                if client.closed:
+                    check(client, client_secs)
+                    client = None
+                elif client_secs > GIVE_UP_SECS:
+                    failures.append("at %d s: no reply to %r in %d s" % (clock.time(), client.request[:40], GIVE_UP_SECS))
+                    client.close()
+                    client = None
+            clock.call_after(1000, step)
+
+        clock.call_after(1000, step)
+
+    overrides = dict(BASE_OVERRIDES)
+    overrides.update({ "HTTP_ENABLED" : True, "HTTP_PORT" : port })
+    print("simulating %.1f days with a client asking the server on port %d every %d s" % (args.days, port, POLL_SECS))
+    result = simulate(args.days, 50.0, overrides, schedule=schedule)
+    http_server = sys.modules["controller.http_server"]
+    base = simulate(args.days, 50.0, BASE_OVERRIDES)
+
+    print("  %d requests: %d status, %d history, %d answered with an error, %d half requests dropped"
+          % (counts["asked"], counts["status"], counts["history"], counts["odd"], counts["dropped"]))
+    print("  %d replies sent whole, the status made %d times, the history %d times"
+          % (http_server.requests_served, http_server.status_rebuilds, http_server.history_rebuilds))
+    print("  relay sequence digest %s with the server, %s without" % (result["digest"], base["digest"]))
+
+    if http_server.status_rebuilds >= counts["status"] or http_server.history_rebuilds >= counts["history"]:
+        failures.append("the replies were made again for every request")
+    if result["digest"] != base["digest"]:
+        failures.append("the relays switched differently with the server")
+    if result["reset"] is not None:
+        failures.append("the controller reset")
+    if failures:
+        for failure in failures[:10]:
+            print("  " + failure)
+        sys.exit("FAILED - %d problems" % len(failures))
+    print("  passed")
+
+
+if __name__ == "__main__":
+    main()
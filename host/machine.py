@@ -0,0 +1,89 @@
+# Host stand-in for MicroPython's machine module - see hal.py
+
+import hal
+
+PWRON_RESET = hal.PWRON_RESET
+WDT_RESET = hal.WDT_RESET
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, id, mode=IN, pull=None, value=None):
+        self.id = id
+        self.mode = mode
+        self.pull = pull
+        self.handler = None
+        # a pulled up input (a button) reads 1 until pressed
+        self.current_value = 1 if pull == Pin.PULL_UP else 0
+        if value is not None:
+            self.current_value = 1 if value else 0
+        hal.pins[id] = self
+
+    def value(self, value=None):
+        if value is None:
+            return self.current_value
+        value = 1 if value else 0
+        if value != self.current_value:
+            self.current_value = value
+            if self.mode == Pin.OUT and hal.on_pin_change:
+                hal.on_pin_change(self, value)
+
+    def irq(self, trigger=IRQ_FALLING, handler=None):
+        self.handler = handler
+
+    # host only - press a button, calling its IRQ handler as the falling edge would
+    def press(self):
+        hal.wake()
+        if self.handler:
+            self.handler(self)
+
+
+class I2C:
+    def __init__(self, id, sda=None, scl=None, freq=400000, timeout=50000):
+        self.id = id
+
+    def device(self, address):
+        hal.poll()
+        device = hal.find_i2c_device(address)
+        if device is None or not device.powered():
+            raise OSError(5)        # EIO - no ACK, as the Pico reports it
+        return device
+
+    def scan(self):
+        return [ address for address in range(0x08, 0x78)
+                 if hal.find_i2c_device(address) and hal.find_i2c_device(address).powered() ]
+
+    def writeto(self, address, data, stop=True):
+        self.device(address).writeto(bytes(data))
+        return 1
+
+    def readfrom(self, address, count, stop=True):
+        return self.device(address).readfrom(count)
+
+
+class WDT:
+    def __init__(self, id=0, timeout=5000):
+        hal.feed_watchdog(timeout)
+
+    def feed(self):
+        hal.feed_watchdog()
+
+
+def lightsleep(ms=None):
+    hal.lightsleep(ms)
+
+
+def reset():
+    # the rp2 port resets through the watchdog, so the next boot reports WDT_RESET
+    raise hal.Reset(WDT_RESET)
+
+
+def reset_cause():
+    return hal.reset_cause
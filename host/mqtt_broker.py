@@ -0,0 +1,167 @@
+# Stand-in MQTT broker
+#
+# Just enough of an MQTT 3.1.1 broker to test the controller's publisher (controller/mqtt.py) against: it accepts
+# any CONNECT, answers PINGREQ and keeps every PUBLISH it is sent - nothing is forwarded to subscribers.  It runs on
+# asyncio in a thread of its own, so a simulation can take it down, bring it back, or stall it - accepted but no
+# longer reading, as a broker on a congested network looks.
+#
+# On its own it prints what it is sent, for trying a Pico W against:
+#   python host/mqtt_broker.py [--address 0.0.0.0] [--port 1883]
+
+import argparse
+import asyncio
+import socket
+import threading
+
+MQTT_CONNECT    = 1             # MQTT packet types, as in the fixed header's top four bits
+MQTT_PUBLISH    = 3
+MQTT_PINGREQ    = 12
+MQTT_DISCONNECT = 14
+CONNACK = b"\x20\x02\x00\x00"
+PINGRESP = b"\xd0\x00"
+RECEIVE_BUFFER = 4096           # a small socket receive buffer, so a stall pushes back on the client soon
+
+
+#
+# One client's connection
+#
+class Connection(asyncio.Protocol):
+    def __init__(self, broker):
+        self.broker = broker
+        self.buffer = bytearray()
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.broker.connections.add(self)
+        if self.broker.stalled:
+            transport.pause_reading()
+
+    def connection_lost(self, exc):
+        self.broker.connections.discard(self)
+
+    def data_received(self, data):
+        self.buffer.extend(data)
+        while True:
+            # the fixed header - type and flags, then the remaining length, 7 bits a byte
+            length = 0
+            shift = 0
+            i = 1
+            while True:
+                if i >= len(self.buffer):
+                    return
+                length = length | (self.buffer[i] & 0x7f) << shift
+                shift = shift + 7
+                i = i + 1
+                if not self.buffer[i - 1] & 0x80:
+                    break
+            if len(self.buffer) < i + length:
+                return
+            kind = self.buffer[0] >> 4
+            flags = self.buffer[0] & 0x0f
+            body = bytes(self.buffer[i:i + length])
+            del self.buffer[:i + length]
+            self.packet(kind, flags, body)
+
+    def packet(self, kind, flags, body):
+        if kind == MQTT_CONNECT:
+            self.broker.connects = self.broker.connects + 1
+            self.transport.write(CONNACK)
+        elif kind == MQTT_PUBLISH:
+            topic_length = int.from_bytes(body[0:2], "big")
+            topic = body[2:2 + topic_length].decode()
+            # QoS 1 and 2 publishes have a packet identifier before the payload - the controller only sends QoS 0
+            payload = body[2 + topic_length + (2 if flags & 0x06 else 0):]
+            self.broker.publishes.append((topic, payload))
+            if self.broker.on_publish:
+                self.broker.on_publish(topic, payload)
+        elif kind == MQTT_PINGREQ:
+            self.transport.write(PINGRESP)
+        elif kind == MQTT_DISCONNECT:
+            self.transport.close()
+
+
+#
+# The broker, on its own thread's event loop
+#
+class StandInBroker:
+    def __init__(self, address="127.0.0.1", on_publish=None):
+        self.address = address          # address to listen on
+        self.on_publish = on_publish    # called with (topic, payload) for each PUBLISH, on the broker's thread
+        self.publishes = []             # (topic, payload) of every PUBLISH
+        self.connects = 0               # CONNECTs accepted
+        self.connections = set()
+        self.stalled = False
+        self.server = None
+        self.port = None
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+
+    def call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    #
+    # Start listening - on port, or the same port as before, or any free port the first time
+    #
+    def up(self, port=None):
+        async def listen():
+            sock = socket.socket()
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+            sock.bind((self.address, port or self.port or 0))
+            self.server = await self.loop.create_server(lambda: Connection(self), sock=sock)
+        self.call(listen())
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    #
+    # Stop listening and drop every connection - the broker is gone
+    #
+    def down(self):
+        async def close():
+            self.server.close()
+            for connection in list(self.connections):
+                connection.transport.abort()
+            await self.server.wait_closed()
+        self.call(close())
+
+    #
+    # Wait for the broker to take in what has been sent to it so far, and answer it - a turn of its event loop, which
+    # picks up the sockets that are ready along with this call
+    #
+    def sync(self):
+        async def turn():
+            pass
+        self.call(turn())
+
+    #
+    # Stop reading from the clients, new ones too, or start again
+    #
+    def stall(self, stalled):
+        async def set_stalled():
+            self.stalled = stalled
+            for connection in self.connections:
+                if stalled:
+                    connection.transport.pause_reading()
+                else:
+                    connection.transport.resume_reading()
+        self.call(set_stalled())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in MQTT broker that prints what it is sent")
+    parser.add_argument("--address", default="0.0.0.0", help="address to listen on - all of them by default")
+    parser.add_argument("--port", type=int, default=1883, help="port to listen on")
+    args = parser.parse_args()
+
+    broker = StandInBroker(args.address, lambda topic, payload: print("%s %s" % (topic, payload.decode(errors="replace")),
+                                                                      flush=True))
+    broker.up(args.port)
+    print("listening on %s:%d" % (args.address, broker.port))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# MQTT outages - does the publisher keep every reading it can, without holding up the controller?
+#
+# Simulates the controller (see simulate.py) publishing to the stand-in broker (mqtt_broker.py) while the network
+# misbehaves, on the virtual clock:
+#   broker down     the broker goes away for a while, then comes back - the readings wait in the queue
+#   WiFi down       the WLAN drops, then joins again
+#   stall           the broker stops reading, as on a congested network - the socket pushes back
+#   long outage     the broker is away for longer than the queue holds - the oldest readings are dropped
+# and then checks what the broker got: every reading, oldest first, except those the controller says it dropped.
+# The relays must switch just as they do without MQTT - the network never gets a say in the decisions.
+#
+# Run from anywhere with host Python:
+#   python host/mqtt_outage.py [--days 4]
+
+import argparse
+import json
+import sys
+import time
+
+import hal
+from mqtt_broker import StandInBroker
+from simulate import simulate
+
+PACE_MS = 1000                  # let the broker's thread catch up every this many virtual ms, so a round trip
+                                #   takes a virtual second or so, as on a real network
+
+# virtual hour -> what happens
+EVENTS = [ ( 6, "broker down" ), ( 10, "broker up" ),
+           ( 16, "WiFi down" ), ( 19, "WiFi up" ),
+           ( 26, "stall" ), ( 30, "unstall" ),
+           ( 40, "broker down" ), ( 70, "broker up" ) ]
+
+# the run without MQTT to compare the relays with is awake every loop pass, as MQTT keeps it
+BASE_OVERRIDES = { "LOW_POWER_ENABLED" : False }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate MQTT publishing through broker and WiFi outages")
+    parser.add_argument("--days", type=float, default=4, help="how many days to simulate")
+    args = parser.parse_args()
+
+    broker = StandInBroker()
+    broker.up()
+
+    def schedule(clock):
+        def pace():
+            broker.sync()
+            clock.call_after(PACE_MS, pace)
+
+        def event(what):
+            print("  %5.1f h  %s" % (clock.ticks_ms() / 3600000, what))
+            if what == "broker down":
+                broker.down()
+            elif what == "broker up":
+                broker.up()
+            elif what == "WiFi down":
+                hal.wifi_up = False
+            elif what == "WiFi up":
+                hal.wifi_up = True
+            elif what == "stall":
+                broker.stall(True)
+            elif what == "unstall":
+                broker.stall(False)
+
+        clock.call_after(PACE_MS, pace)
+        for hours, what in EVENTS:
+            if hours < args.days * 24:
+                clock.call_at(hours * 3600 * 1000, lambda what=what: event(what))
+
+    overrides = dict(BASE_OVERRIDES)
+    overrides.update({ "MQTT_ENABLED" : True, "MQTT_BROKER" : "127.0.0.1", "MQTT_PORT" : broker.port })
+    print("simulating %.1f days publishing to the stand-in broker on port %d" % (args.days, broker.port))
+    result = simulate(args.days, 50.0, overrides, schedule=schedule)
+    mqtt = sys.modules["controller.mqtt"]
+    base = simulate(args.days, 50.0, BASE_OVERRIDES)
+    # let the broker read what is on its way
+    time.sleep(0.2)
+
+    times = []
+    for topic, payload in broker.publishes:
+        times.extend(reading["time"] for reading in json.loads(payload)["readings"])
+    published = sorted(set(times))
+    duplicates = len(times) - len(published)
+    in_order = all(times[i] < times[i + 1] or times[i + 1] in times[:i + 1] for i in range(len(times) - 1))
+    # readings are every RH_UPDATE_SECS, so a longer gap is readings that never arrived
+    update_secs = sys.modules["controller.config"].RH_UPDATE_SECS
+    missing = sum(round((published[i + 1] - published[i]) / update_secs) - 1 for i in range(len(published) - 1))
+
+    print("  %d publishes (%d connections) of %d readings, %d of them a second time after a dropped connection"
+          % (len(broker.publishes), broker.connects, len(published), duplicates))
+    print("  %d readings dropped by the controller's full queue, %d missing at the broker, %d still queued at the end"
+          % (mqtt.readings_dropped, missing, mqtt.queue_count))
+    print("  %d times the socket could not take a whole packet" % mqtt.send_waits)
+    print("  relay sequence digest %s with MQTT, %s without" % (result["digest"], base["digest"]))
+
+    failed = []
+    if not in_order:
+        failed.append("readings arrived out of order")
+    if missing != mqtt.readings_dropped:
+        failed.append("%d readings missing but %d dropped" % (missing, mqtt.readings_dropped))
+    if result["digest"] != base["digest"]:
+        failed.append("the relays switched differently with MQTT")
+    if result["reset"] is not None:
+        failed.append("the controller reset")
+    if failed:
+        sys.exit("FAILED - " + ", ".join(failed))
+    print("  passed")
+
+
+if __name__ == "__main__":
+    main()
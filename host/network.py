@@ -0,0 +1,34 @@
+# Host stand-in for the Pico W's network module - see hal.py
+#
+# The WLAN joins straight away unless hal.wifi_up is False, which also drops a joined one.  The sockets are the
+# host's own.
+
+import hal
+
+STA_IF = 0
+STAT_IDLE = 0
+STAT_CONNECTING = 1
+STAT_GOT_IP = 3
+
+
+class WLAN:
+    def __init__(self, interface):
+        self.interface = interface
+        self.joined = False
+
+    def active(self, active=None):
+        return True
+
+    def connect(self, ssid, password):
+        self.joined = hal.wifi_up
+
+    def disconnect(self):
+        self.joined = False
+
+    def isconnected(self):
+        if not hal.wifi_up:
+            self.joined = False
+        return self.joined
+
+    def status(self):
+        return STAT_GOT_IP if self.isconnected() else STAT_IDLE
@@ -0,0 +1,68 @@
+# Host stand-in for Pimoroni's picographics module - see hal.py
+# Drawing does nothing; display.update() is counted, and the texts drawn since the last clear() are kept in
+# hal.screen_texts.  The backlight brightness is passed on to hal for its energy estimate.
+
+import hal
+
+DISPLAY_PICO_DISPLAY = 0
+PEN_P4 = 2
+PEN_P8 = 3
+PEN_RGB565 = 4
+
+
+class PicoGraphics:
+    def __init__(self, display=DISPLAY_PICO_DISPLAY, pen_type=PEN_RGB565, rotate=0):
+        self.pens = 0
+        self.texts = []
+
+    def get_bounds(self):
+        return (240, 135)
+
+    def create_pen(self, r, g, b):
+        self.pens = self.pens + 1
+        return self.pens - 1
+
+    def measure_text(self, text, scale=1, spacing=1):
+        return len(text) * 6 * scale
+
+    def update(self):
+        hal.display_updates = hal.display_updates + 1
+        hal.screen_texts = list(self.texts)
+        if hal.first_update_ms is None:
+            hal.first_update_ms = hal.ticks_ms()
+
+    def set_backlight(self, brightness):
+        hal.set_backlight(brightness)
+
+    def set_pen(self, pen):
+        pass
+
+    def set_font(self, font):
+        pass
+
+    def set_clip(self, x, y, w, h):
+        pass
+
+    def remove_clip(self):
+        pass
+
+    def clear(self):
+        self.texts = []
+
+    def pixel(self, x, y):
+        pass
+
+    def line(self, x1, y1, x2, y2, thickness=1):
+        pass
+
+    def rectangle(self, x, y, w, h):
+        pass
+
+    def circle(self, x, y, r):
+        pass
+
+    def polygon(self, points):
+        pass
+
+    def text(self, text, x, y, wordwrap=-1, scale=1, angle=0, spacing=1):
+        self.texts.append(text)
@@ -0,0 +1,9 @@
+# Host stand-in for Pimoroni's pimoroni module - see hal.py
+
+
+class RGBLED:
+    def __init__(self, r, g, b):
+        self.rgb = (0, 0, 0)
+
+    def set_rgb(self, r, g, b):
+        self.rgb = (r, g, b)
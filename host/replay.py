@@ -0,0 +1,206 @@
+# Replay a decision trace
+#
+# Feeds a trace recorded by the controller (TRACE_ENABLED - see controller/trace.py) back through the same code at
+# full speed, on a virtual clock: the RH readings through update_rh(), the button presses through the button handlers
+# and the menu (entered when the main loop entered it), the serial commands through apply_command(), and the main loop's
+# automation and capacity event passes.  The relays it switches are compared with
+# the ones recorded, and the first difference is reported.  The time taken makes it a benchmark of the decision path.
+#
+# Copy the trace.bin.<n> files off the Pico (or make some with simulate.py --trace), then run with host Python:
+#   python host/replay.py trace.bin.1 [trace.bin.2 ...] [--repeat 5] [--set NAME=VALUE ...]
+#
+# The replay uses controller/config.py as it is - give the same --set overrides as a simulate.py run that made the
+# traces, or set any constants changed on the Pico.
+
+import argparse
+import struct
+import sys
+import tempfile
+import time
+
+import hal
+
+# configuration for the replay - quiet, no watchdog and not tracing the replay itself
+OVERRIDES = { "LOG_TO_CONSOLE" : False, "WATCHDOG_ENABLED" : False, "TRACE_ENABLED" : False }
+
+
+#
+# Read a trace file into a list of (kind, ms, secs, payload values, snapshot data)
+#
+def read_trace(path, trace):
+    with open(path, "rb") as f:
+        data = f.read()
+    records = []
+    offset = 0
+    header_size = struct.calcsize(trace.TRACE_RECORD_HEADER)
+    while offset + header_size <= len(data):
+        kind, ms, secs = struct.unpack_from(trace.TRACE_RECORD_HEADER, data, offset)
+        offset = offset + header_size
+        if kind not in trace.TRACE_PAYLOADS:
+            raise ValueError("%s: unknown record kind 0x%02x at byte %d" % (path, kind, offset - header_size))
+        payload_format = trace.TRACE_PAYLOADS[kind]
+        values = struct.unpack_from(payload_format, data, offset)
+        offset = offset + struct.calcsize(payload_format)
+        snapshot_data = b""
+        if kind == trace.TRACE_START:
+            snapshot_data = data[offset:offset + values[2]]
+            offset = offset + values[2]
+        records.append((kind, ms, secs, values, snapshot_data))
+    if not records or records[0][0] != trace.TRACE_START:
+        raise ValueError("%s does not begin with a start record" % path)
+    return records
+
+
+#
+# Replay one trace file.  Returns (recorded relays, replayed relays, record counts by kind, seconds taken), the relays
+# as lists of (ms, outlet, value).
+#   settings    configuration constants to override, on top of OVERRIDES
+#
+def replay(path, settings):
+    from controller.clock import VirtualClock
+    clock = VirtualClock()
+    overrides = dict(settings)
+    overrides.update(OVERRIDES)
+    hal.load_controller(clock, overrides)
+    from controller import commands
+    from controller import config
+    from controller import main
+    from controller import menu
+    from controller import policy
+    from controller import render
+    from controller import sensor
+    from controller import snapshot
+    from controller import trace
+
+    records = read_trace(path, trace)
+    handlers = { "a" : menu.button_a_handler, "b" : menu.button_b_handler,
+                 "x" : menu.button_x_handler, "y" : menu.button_y_handler }
+
+    # move virtual time on to a record, lining clock.time() up with the time recorded
+    def move_to(ms, secs):
+        if ms > clock.ticks_ms():
+            clock.advance(ms - clock.ticks_ms())
+        clock.start_secs = secs - clock.ticks_ms() // 1000
+
+    recorded = []
+    replayed = []
+    counts = {}
+    fired = set()
+
+    def relay_changed(pin, value):
+        if pin.id in config.OUTLET_PIN_NUMBERS:
+            replayed.append((clock.ticks_ms(), config.OUTLET_PIN_NUMBERS.index(pin.id), value))
+
+    def press(i):
+        fired.add(i)
+        handlers[trace.TRACE_BUTTONS[records[i][3][0]]](None)
+
+    start = time.monotonic()
+
+    # the starting state, with the relays as they were
+    kind, ms, secs, values, snapshot_data = records[0]
+    move_to(ms, secs)
+    render.setup_display()
+    main.setup_outlets()
+    if not snapshot.restore_snapshot_data(snapshot_data):
+        raise ValueError("%s: the start record's snapshot does not fit this controller" % path)
+    policy.current_rh = values[0]
+    policy.current_rh_time = values[1]
+    policy.update_rh_projection()
+    policy.update_relays()
+    menu.last_button_ms = clock.ticks_ms() - config.DEBOUNCE_MS
+    hal.on_pin_change = relay_changed
+
+    for i in range(1, len(records)):
+        kind, ms, secs, values, snapshot_data = records[i]
+        counts[kind] = counts.get(kind, 0) + 1
+        if kind == trace.TRACE_RELAY:
+            recorded.append((ms, values[0], values[1]))
+            continue
+        if i in fired:
+            continue
+        move_to(ms, secs)
+
+        if kind == trace.TRACE_BUTTON:
+            press(i)
+        elif kind == trace.TRACE_MENU:
+            # the menu waits for the presses that follow, up to the next decision - deliver them on time
+            j = i + 1
+            while j < len(records) and records[j][0] in (trace.TRACE_BUTTON, trace.TRACE_RELAY):
+                if records[j][0] == trace.TRACE_BUTTON:
+                    clock.call_at(records[j][1], lambda j=j: press(j))
+                j = j + 1
+            menu.enter_menu(config.TOP_MENU, None)
+            clock.events = []
+        elif kind == trace.TRACE_READING:
+            sensor.acquisition_heartbeat()
+            with sensor.mailbox_lock:
+                sensor.mailbox_rh = values[0]
+                sensor.mailbox_temperature = values[1]
+                sensor.mailbox_sequence = sensor.mailbox_sequence + 1
+            sensor.update_rh()
+        elif kind == trace.TRACE_AUTOMATE:
+            policy.automate_energizing()
+        elif kind == trace.TRACE_CAPACITY:
+            policy.handle_capacity_event()
+        elif kind == trace.TRACE_COMMAND:
+            commands.apply_command(*values)
+
+    hal.on_pin_change = None
+    return recorded, replayed, counts, time.monotonic() - start
+
+
+#
+# Compare the recorded and replayed relays.  Returns a description of the first difference, or None if they match.
+#
+def compare_relays(recorded, replayed):
+    for i in range(min(len(recorded), len(replayed))):
+        if recorded[i][1:] != replayed[i][1:]:
+            return ("relay change %d differs: recorded outlet %d -> %d at %.1f s, replayed outlet %d -> %d at %.1f s"
+                    % (i, recorded[i][1], recorded[i][2], recorded[i][0] / 1000,
+                       replayed[i][1], replayed[i][2], replayed[i][0] / 1000))
+    if len(recorded) != len(replayed):
+        return "recorded %d relay changes, replayed %d" % (len(recorded), len(replayed))
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay controller decision traces and compare the relays")
+    parser.add_argument("traces", nargs="+", help="trace files (trace.bin.<n>)")
+    parser.add_argument("--repeat", type=int, default=1, help="replay each trace this many times, for benchmarking")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help="override a constant in controller/config.py, as it was when the traces were recorded")
+    args = parser.parse_args()
+    try:
+        settings = hal.parse_settings(args.set)
+    except ValueError as err:
+        sys.exit(str(err))
+
+    hal.install(tempfile.mkdtemp(prefix="humidifier-replay-"))
+    from controller import trace
+
+    different = False
+    for path in args.traces:
+        best = None
+        for i in range(args.repeat):
+            recorded, replayed, counts, elapsed = replay(path, settings)
+            best = elapsed if best is None else min(best, elapsed)
+        inputs = sum(counts.get(kind, 0) for kind in (trace.TRACE_READING, trace.TRACE_BUTTON, trace.TRACE_COMMAND,
+                                                      trace.TRACE_AUTOMATE, trace.TRACE_CAPACITY))
+        print("%s: %d readings, %d button presses, %d commands, %d automation and %d capacity passes in %.3f s - %.0f inputs per second"
+              % (path, counts.get(trace.TRACE_READING, 0), counts.get(trace.TRACE_BUTTON, 0), counts.get(trace.TRACE_COMMAND, 0),
+                 counts.get(trace.TRACE_AUTOMATE, 0), counts.get(trace.TRACE_CAPACITY, 0), best,
+                 inputs / best if best else 0))
+        difference = compare_relays(recorded, replayed)
+        if difference:
+            different = True
+            print("  DIFFERENT - %s" % difference)
+        else:
+            print("  same %d relay changes as recorded" % len(recorded))
+
+    if different:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
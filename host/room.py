@@ -0,0 +1,153 @@
+# Room humidity model
+#
+# A moisture mass balance for one or many rooms at once, vectorised with NumPy.  Each room holds water vapour in its
+# air (and, through buffer_factor, in its furnishings), gains it from the humidifiers and loses it to air exchange
+# with the outdoors:
+#
+#   buffer_factor * volume * dW/dt = output - air_changes_per_hour / 3600 * volume * (W - W_outdoor)
+#
+# where W is the absolute humidity (g/m3).  Over a step the humidifier output is constant, so step() uses the exact
+# exponential solution - any step size is stable.  RH comes from W and the room temperature.  The sensor sees the
+# room's RH through a first order lag and adds noise.
+#
+# Every parameter is a scalar or an array with one value per room.  Use it as the controller's reading source
+# (sensor.reading_source, see simulate.py), or run this file to benchmark many rooms under the RH band decision of
+# determine_needed_humidifying():
+#   python host/room.py [--rooms 10000] [--days 7]
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WATER_VAPOUR_GAS_CONSTANT = 461.5   # J/(kg K)
+
+HUMIDIFYING_OFF = 0                 # humidifying codes used by band_decision()
+HUMIDIFYING_LIGHT = 1
+HUMIDIFYING_HEAVY = 2
+
+
+#
+# Saturation absolute humidity in g/m3 at temperature_c (Magnus formula over water)
+#
+def saturation_absolute_humidity(temperature_c):
+    vapour_pressure_pa = 611.2 * np.exp(17.62 * temperature_c / (243.12 + temperature_c))
+    return vapour_pressure_pa / (WATER_VAPOUR_GAS_CONSTANT * (temperature_c + 273.15)) * 1000.0
+
+
+class RoomModel:
+    def __init__(self, rooms=1, volume_m3=60.0, air_changes_per_hour=0.7, temperature_c=20.0,
+                 outdoor_rh=80.0, outdoor_temperature_c=5.0, buffer_factor=3.0,
+                 lo_g_per_hour=250.0, hi_g_per_hour=500.0, start_rh=45.0,
+                 sensor_lag_secs=60.0, sensor_noise_rh=0.2, seed=0):
+        shape = (rooms,)
+        self.rooms = rooms
+        self.volume_m3 = np.broadcast_to(np.asarray(volume_m3, dtype=float), shape)
+        self.air_changes_per_hour = np.broadcast_to(np.asarray(air_changes_per_hour, dtype=float), shape)
+        self.temperature_c = np.broadcast_to(np.asarray(temperature_c, dtype=float), shape)
+        self.buffer_factor = np.broadcast_to(np.asarray(buffer_factor, dtype=float), shape)
+        self.lo_g_per_hour = np.broadcast_to(np.asarray(lo_g_per_hour, dtype=float), shape)
+        self.hi_g_per_hour = np.broadcast_to(np.asarray(hi_g_per_hour, dtype=float), shape)
+        self.sensor_lag_secs = np.broadcast_to(np.asarray(sensor_lag_secs, dtype=float), shape)
+        self.sensor_noise_rh = np.broadcast_to(np.asarray(sensor_noise_rh, dtype=float), shape)
+        self.random = np.random.default_rng(seed)
+
+        self.saturation = saturation_absolute_humidity(self.temperature_c)
+        self.outdoor_absolute = np.asarray(outdoor_rh, dtype=float) / 100.0 * saturation_absolute_humidity(
+            np.asarray(outdoor_temperature_c, dtype=float)) * np.ones(shape)
+        self.absolute = np.asarray(start_rh, dtype=float) / 100.0 * self.saturation * np.ones(shape)
+        self.sensor_rh = self.rh.copy()
+
+    #
+    # The rooms' true RH
+    #
+    @property
+    def rh(self):
+        return self.absolute / self.saturation * 100.0
+
+    #
+    # Total humidifier output in g/h for each room
+    #   energized   (rooms, outlets) - whether each outlet is energized
+    #   hi          (rooms, outlets) - whether each outlet's humidifier is set to hi (otherwise lo)
+    #
+    def output(self, energized, hi):
+        per_outlet = np.where(hi, self.hi_g_per_hour[:, None], self.lo_g_per_hour[:, None])
+        return (per_outlet * energized).sum(axis=1)
+
+    #
+    # Advance the rooms by dt_secs with the humidifiers giving output_g_per_hour (per room) throughout
+    #
+    def step(self, dt_secs, output_g_per_hour):
+        exchange_per_sec = self.air_changes_per_hour / 3600.0
+        equilibrium = self.outdoor_absolute + output_g_per_hour / 3600.0 / (exchange_per_sec * self.volume_m3)
+        decay = np.exp(-exchange_per_sec / self.buffer_factor * dt_secs)
+        self.absolute = equilibrium + (self.absolute - equilibrium) * decay
+        self.sensor_rh = self.rh + (self.sensor_rh - self.rh) * np.exp(-dt_secs / self.sensor_lag_secs)
+
+    #
+    # What the rooms' sensors read now
+    #
+    def read(self):
+        return self.sensor_rh + self.random.normal(0.0, 1.0, self.rooms) * self.sensor_noise_rh
+
+
+#
+# determine_needed_humidifying() for arrays of rooms: the new humidifying code for each room
+#
+def band_decision(humidifying, rh, on_rh, low_rh, debounce):
+    from_off = np.where(rh > on_rh - debounce, HUMIDIFYING_OFF,
+                        np.where(rh > low_rh - debounce, HUMIDIFYING_LIGHT, HUMIDIFYING_HEAVY))
+    from_light = np.where(rh > on_rh + debounce, HUMIDIFYING_OFF,
+                          np.where(rh < low_rh - debounce, HUMIDIFYING_HEAVY, HUMIDIFYING_LIGHT))
+    from_heavy = np.where(rh > on_rh + debounce, HUMIDIFYING_OFF,
+                          np.where(rh > low_rh + debounce, HUMIDIFYING_LIGHT, HUMIDIFYING_HEAVY))
+    return np.choose(humidifying, [ from_off, from_light, from_heavy ])
+
+
+#
+# Benchmark: many rooms with two lo humidifiers each, one running when light and both when heavy, the decision
+# made every step from the sensor reading
+#
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the room model over many rooms")
+    parser.add_argument("--rooms", type=int, default=10000, help="how many rooms to simulate at once")
+    parser.add_argument("--days", type=float, default=7, help="how many days to simulate")
+    parser.add_argument("--step-secs", type=float, default=60, help="simulation step")
+    args = parser.parse_args()
+
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    from controller import config
+
+    random = np.random.default_rng(1)
+    rooms = RoomModel(rooms=args.rooms, volume_m3=random.uniform(30, 90, args.rooms),
+                      air_changes_per_hour=random.uniform(0.3, 1.2, args.rooms), seed=2)
+    steps = int(args.days * 86400 / args.step_secs)
+    humidifying = np.zeros(args.rooms, dtype=int)
+    hi = np.zeros((args.rooms, 2), dtype=bool)
+    in_band_steps = np.zeros(args.rooms)
+
+    start = time.monotonic()
+    for i in range(steps):
+        humidifying = band_decision(humidifying, rooms.read(), config.DEFAULT_ON_RH, config.DEFAULT_LOW_RH,
+                                    config.DEBOUNCE_RH_AMOUNT)
+        energized = np.stack([ humidifying >= HUMIDIFYING_LIGHT, humidifying == HUMIDIFYING_HEAVY ], axis=1)
+        rooms.step(args.step_secs, rooms.output(energized, hi))
+        rh = rooms.rh
+        in_band_steps = in_band_steps + ((rh >= config.DEFAULT_LOW_RH) & (rh <= config.DEFAULT_ON_RH + config.DEBOUNCE_RH_AMOUNT))
+    elapsed = time.monotonic() - start
+
+    room_minutes = args.rooms * steps * args.step_secs / 60
+    in_band_pct = in_band_steps / steps * 100.0
+    print("%d rooms x %.1f days in %.2f s: %.1f million simulated room-minutes per second"
+          % (args.rooms, args.days, elapsed, room_minutes / elapsed / 1e6))
+    print("  time in band: median %.1f%%, worst 5%% of rooms below %.1f%%"
+          % (np.median(in_band_pct), np.percentile(in_band_pct, 5)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# Send a command to the controller on USB serial
+#
+# Sends one command (set COMMANDS_ENABLED on the Pico - see controller/commands.py) and prints the reply, skipping the log messages
+# and telemetry frames around it.  The history command's binary frame is checked and written to a CSV file, one row
+# per reading, oldest first.
+#
+# Run with host Python:
+#   python host/serial_command.py /dev/ttyACM0 get
+#   python host/serial_command.py /dev/ttyACM0 set on_rh 50
+#   python host/serial_command.py /dev/ttyACM0 history [--out history.csv]
+
+import argparse
+import csv
+import os
+import select
+import struct
+import sys
+import tempfile
+import time
+import tty
+
+import hal
+
+REPLY_TIMEOUT_SECS = 5
+
+
+#
+# Read from the port until a reply line arrives, and for history its frame.  Returns (reply line, history payload).
+#
+def read_reply(fd, commands, want_history):
+    data = b""
+    reply = None
+    deadline = time.monotonic() + REPLY_TIMEOUT_SECS
+    while time.monotonic() < deadline:
+        if select.select([ fd ], [], [], 0.1)[0]:
+            data = data + os.read(fd, 4096)
+        if reply is None:
+            for line in data.split(b"\n")[:-1]:
+                line = line.strip(b"\r")
+                if line.startswith(b"ok") or line.startswith(b"error"):
+                    reply = line.decode()
+                    break
+        if reply is not None and (not want_history or reply.startswith("error")):
+            return reply, None
+        start = data.find(commands.COMMAND_HISTORY_SYNC)
+        if reply is not None and start >= 0:
+            offset = start + len(commands.COMMAND_HISTORY_SYNC)
+            if len(data) >= offset + 2:
+                length, = struct.unpack_from(commands.COMMAND_HISTORY_LENGTH, data, offset)
+                offset = offset + 2
+                if len(data) > offset + length:
+                    payload = data[offset:offset + length]
+                    if hal.crc8(payload) != data[offset + length]:
+                        sys.exit("the history frame has a bad CRC")
+                    return reply, payload
+    sys.exit("no reply in %d s" % REPLY_TIMEOUT_SECS)
+
+
+#
+# Write a history payload to a CSV file
+#
+def write_history(payload, out_path, commands, snapshot):
+    count, newest_time, secs = struct.unpack_from(commands.COMMAND_HISTORY_HEADER, payload, 0)
+    offset = struct.calcsize(commands.COMMAND_HISTORY_HEADER)
+    readings = struct.unpack_from("<%dH" % count, payload, offset)
+    codes = payload[offset + 2 * count:offset + 3 * count]
+    dew_points = struct.unpack_from("<%dh" % count, payload, offset + 3 * count)
+    absolute_humidities = struct.unpack_from("<%dH" % count, payload, offset + 5 * count)
+    with open(out_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow([ "time", "rh", "humidifying", "dew_point", "absolute_humidity" ])
+        for i in range(count):
+            # placeholders before the first reading are 0
+            if readings[i]:
+                writer.writerow([ newest_time - (count - 1 - i) * secs, readings[i] / 100,
+                                  snapshot.HUMIDIFYING_CODES[codes[i]], dew_points[i] / 100,
+                                  absolute_humidities[i] / 100 ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send a command to the controller on USB serial")
+    parser.add_argument("port", help="the Pico's USB serial port, e.g. /dev/ttyACM0")
+    parser.add_argument("command", nargs="+", help="the command and its arguments, e.g. set on_rh 50")
+    parser.add_argument("--out", default="history.csv", help="CSV file to write a history to")
+    args = parser.parse_args()
+
+    out_path = os.path.abspath(args.out)
+    fd = os.open(args.port, os.O_RDWR | os.O_NOCTTY)
+    tty.setraw(fd)
+    # the frame layout comes from the controller itself
+    hal.install(tempfile.mkdtemp(prefix="humidifier-command-"))
+    from controller import commands
+    from controller import snapshot
+
+    os.write(fd, (" ".join(args.command) + "\n").encode())
+    reply, payload = read_reply(fd, commands, args.command == [ "history" ])
+    print(reply)
+    if payload is not None:
+        write_history(payload, out_path, commands, snapshot)
+        print("history written to %s" % out_path)
+    if reply.startswith("error"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
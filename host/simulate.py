@@ -0,0 +1,199 @@
+# Simulate days of controller operation in seconds
+#
+# Boots the real controller on the host stand-ins (see hal.py) with a virtual clock (controller/clock.py), so usage
+# accounting, lo humidifier rotation, the RH trend and the relay decisions all run as they would on the Pico - just
+# without waiting.  The room is room.py's moisture balance: each energized humidifier adds water vapour at its
+# setting's rate, air exchange with the outdoors takes it away, and the DHT20 stand-in reads the room's sensor RH.
+# Twice a day someone refills the tanks that are low - straight into the policy rather than through the menu, so a
+# --trace file that spans a refill does not replay the same from there on.
+#
+# The run is deterministic - the same arguments give the same relay sequence, shown by the digest at the end.
+# It also estimates the Pico and display's power use from the time spent in lightsleep and the backlight brightness.
+#
+# Run from anywhere with host Python:
+#   python host/simulate.py [--days 7] [--start-rh 50] [--volume-m3 60] [--trace] [--set NAME=VALUE ...]
+#
+# --set overrides a constant in controller/config.py for the run, e.g. --set MIN_ON_SECS=0 --set MIN_OFF_SECS=0 to
+# see the relays without the relay scheduler's limits, or --set CONTROL_MODE=duty for duty cycle light humidifying.
+#
+# simulate() runs one simulation and returns its results - sweep.py runs many.
+
+import argparse
+import hashlib
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import hal
+from room import RoomModel
+
+ROOM_STEP_MS = 60 * 1000            # how often the room is updated
+REFILL_EVERY_HOURS = 12             # how often someone checks the tanks
+REFILL_BELOW_PCT = 30.0             # they refill the tanks with this much or less left
+
+# keep a long run quiet, let it run without the watchdog, pass through the main loop once a virtual second rather
+# than ten times (the decisions are made every AUTOMATE_SECS either way) and only redraw the screen when something
+# changes - nobody is watching it
+OVERRIDES = { "LOG_TO_CONSOLE" : False, "WATCHDOG_ENABLED" : False, "LOOP_SLEEP_MS" : 1000, "BAR_DISPLAY_SECS" : 3600 }
+
+
+#
+# Simulate the controller in the room and return the results as a dict
+#   days            how many days to simulate
+#   start_rh        the room's RH at the start
+#   overrides       configuration constants to override, on top of OVERRIDES
+#   room_options    RoomModel() arguments
+#   schedule        called with the VirtualClock before the boot, to add events of its own
+#
+def simulate(days, start_rh, overrides=None, room_options=None, schedule=None):
+    flash_dir = tempfile.mkdtemp(prefix="humidifier-simulate-")
+    hal.install(flash_dir)
+    from controller.clock import VirtualClock
+    from controller import config
+
+    clock = VirtualClock()
+    room = RoomModel(start_rh=start_rh, **(room_options or {}))
+    dht20 = hal.DHT20Device(rh=start_rh, temperature=float(room.temperature_c[0]),
+                            power_pin=config.HMIDITY_SENSOR_POWER_PIN_NUMBER)
+    hal.i2c_devices = { hal.DHT20Device.ADDRESS : dht20 }
+    end_ms = int(days * 24 * 3600 * 1000)
+
+    relay_events = []                                   # (ms, outlet, value)
+    switch_counts = [ 0 ] * len(config.OUTLET_PIN_NUMBERS)
+    last_switch_ms = [ None ] * len(config.OUTLET_PIN_NUMBERS)
+    shortest_ms = [ [ None, None ] for number in config.OUTLET_PIN_NUMBERS ]   # shortest time off, on per outlet
+    energized_ms = [ 0 ] * len(config.OUTLET_PIN_NUMBERS)
+    stats = { "refills" : 0, "min_rh" : start_rh, "max_rh" : start_rh, "overshoot_rh" : 0.0, "in_band_mins" : 0,
+              "room_mins" : 0, "rh_sum" : 0.0, "rh_squares" : 0.0 }
+
+    def policy():
+        return sys.modules["controller.policy"]
+
+    def relay_changed(pin, value):
+        if pin.id in config.OUTLET_PIN_NUMBERS:
+            outlet = config.OUTLET_PIN_NUMBERS.index(pin.id)
+            relay_events.append((clock.ticks_ms(), outlet, value))
+            switch_counts[outlet] = switch_counts[outlet] + 1
+            # the time it spent in the state it is leaving
+            if last_switch_ms[outlet] is not None:
+                ms = clock.ticks_ms() - last_switch_ms[outlet]
+                if shortest_ms[outlet][1 - value] is None or ms < shortest_ms[outlet][1 - value]:
+                    shortest_ms[outlet][1 - value] = ms
+            last_switch_ms[outlet] = clock.ticks_ms()
+
+    def room_step():
+        energized = np.zeros((1, len(config.OUTLET_PIN_NUMBERS)), dtype=bool)
+        hi = np.zeros(energized.shape, dtype=bool)
+        for i, number in enumerate(config.OUTLET_PIN_NUMBERS):
+            if hal.pins[number].value() == 1:
+                energized_ms[i] = energized_ms[i] + ROOM_STEP_MS
+                energized[0, i] = policy().humidifiers[i].setting != "off"
+                hi[0, i] = policy().humidifiers[i].setting == "hi"
+        room.step(ROOM_STEP_MS / 1000, room.output(energized, hi))
+        dht20.rh = float(room.read()[0])
+        rh = float(room.rh[0])
+        stats["min_rh"] = min(stats["min_rh"], rh)
+        stats["max_rh"] = max(stats["max_rh"], rh)
+        # overshoot is how far RH goes past where humidifying turns off
+        stats["overshoot_rh"] = max(stats["overshoot_rh"], rh - policy().on_rh_on_debounced)
+        stats["room_mins"] = stats["room_mins"] + 1
+        stats["rh_sum"] = stats["rh_sum"] + rh
+        stats["rh_squares"] = stats["rh_squares"] + rh * rh
+        if policy().low_rh <= rh <= policy().on_rh_on_debounced:
+            stats["in_band_mins"] = stats["in_band_mins"] + 1
+        clock.call_after(ROOM_STEP_MS, room_step)
+
+    def refill():
+        for humidifier in policy().humidifiers:
+            if humidifier.setting != "off":
+                left_pct = 100.0 - policy().units_to_pct(policy().calculate_units_used(humidifier))
+                if left_pct <= REFILL_BELOW_PCT:
+                    policy().humidifier_refilled(humidifier)
+                    stats["refills"] = stats["refills"] + 1
+        clock.call_after(REFILL_EVERY_HOURS * 3600 * 1000, refill)
+
+    def stop():
+        raise hal.Stop()
+
+    clock.call_after(ROOM_STEP_MS, room_step)
+    clock.call_after(REFILL_EVERY_HOURS * 3600 * 1000, refill)
+    clock.call_at(end_ms, stop)
+    if schedule:
+        schedule(clock)
+    hal.on_pin_change = relay_changed
+
+    all_overrides = dict(OVERRIDES)
+    all_overrides.update(overrides or {})
+    start = time.monotonic()
+    reset = hal.boot(clock=clock, overrides=all_overrides)
+    elapsed = time.monotonic() - start
+    awake_pct, backlight, average_mw = hal.energy_estimate()
+    if "controller.trace" in sys.modules:
+        # write what the stop left buffered
+        sys.modules["controller.trace"].flush_trace(force=True)
+
+    hours = end_ms / 3600000
+    rh_mean = stats["rh_sum"] / max(1, stats["room_mins"])
+    rh_sd = max(0.0, stats["rh_squares"] / max(1, stats["room_mins"]) - rh_mean * rh_mean) ** 0.5
+    return { "days" : days, "elapsed" : elapsed, "flash_dir" : flash_dir, "reset" : reset,
+             "reset_hours" : clock.ticks_ms() / 3600000 if reset is not None else None,
+             "min_rh" : stats["min_rh"], "max_rh" : stats["max_rh"], "overshoot_rh" : stats["overshoot_rh"],
+             "in_band_pct" : 100.0 * stats["in_band_mins"] / max(1, stats["room_mins"]), "rh_mean" : rh_mean, "rh_sd" : rh_sd,
+             "switch_counts" : switch_counts, "energized_hours" : [ ms / 3600000 for ms in energized_ms ],
+             "shortest_off_mins" : [ off_ms / 60000 if off_ms is not None else None for off_ms, on_ms in shortest_ms ],
+             "shortest_on_mins" : [ on_ms / 60000 if on_ms is not None else None for off_ms, on_ms in shortest_ms ],
+             "switches_deferred" : policy().relay_switches_deferred, "switches_suppressed" : policy().relay_switches_suppressed,
+             "refills" : stats["refills"], "hours_per_refill" : hours / stats["refills"] if stats["refills"] else None,
+             "awake_pct" : awake_pct, "backlight" : backlight, "average_mw" : average_mw,
+             "digest" : hashlib.sha1(repr(relay_events).encode()).hexdigest()[:12] }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate the humidifier controller on a virtual clock")
+    parser.add_argument("--days", type=float, default=7, help="how many days to simulate")
+    parser.add_argument("--start-rh", type=float, default=50.0, help="the room's RH at the start")
+    parser.add_argument("--volume-m3", type=float, default=60.0, help="the room's volume - small rooms overshoot more")
+    parser.add_argument("--trace", action="store_true", help="record decision traces for replay.py")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help="override a constant in controller/config.py, e.g. MIN_ON_SECS=0")
+    args = parser.parse_args()
+
+    try:
+        overrides = hal.parse_settings(args.set)
+    except ValueError as err:
+        sys.exit(str(err))
+    if args.trace:
+        overrides["TRACE_ENABLED"] = True
+
+    result = simulate(args.days, args.start_rh, overrides, { "volume_m3" : args.volume_m3 })
+    if result["reset"] is not None:
+        sys.exit("the controller reset after %.1f simulated hours - see %s" % (result["reset_hours"], result["flash_dir"]))
+
+    hours = args.days * 24
+    print("simulated %.1f days in %.1f s (%.0fx real time), flash and logs in %s"
+          % (args.days, result["elapsed"], hours * 3600 / result["elapsed"], result["flash_dir"]))
+    print("  RH %.1f - %.1f, mean %.1f%% (standard deviation %.2f), in band (low RH to on RH) %.1f%% of the time, overshoot %.1f%%"
+          % (result["min_rh"], result["max_rh"], result["rh_mean"], result["rh_sd"], result["in_band_pct"], result["overshoot_rh"]))
+    for i, switches in enumerate(result["switch_counts"]):
+        energized_hours = result["energized_hours"][i]
+        shortest = ""
+        if result["shortest_on_mins"][i] is not None and result["shortest_off_mins"][i] is not None:
+            shortest = ", shortest on %.0f min, off %.0f min" % (result["shortest_on_mins"][i], result["shortest_off_mins"][i])
+        print("  outlet %d: %4d relay switches, energized %5.1f hours (%4.1f%%)%s"
+              % (i, switches, energized_hours, 100.0 * energized_hours / hours, shortest))
+    print("  %d relay switches deferred by the relay scheduler, %d of them suppressed"
+          % (result["switches_deferred"], result["switches_suppressed"]))
+    if result["refills"]:
+        print("  %d refills, one every %.1f hours" % (result["refills"], result["hours_per_refill"]))
+    else:
+        print("  no refills in %.1f hours" % hours)
+    print("  Pico awake %.1f%% of the time, backlight at %.0f%% on average - about %.0f mW, %.1f Wh a day (%s)"
+          % (result["awake_pct"], 100.0 * result["backlight"], result["average_mw"], result["average_mw"] * 24 / 1000,
+             "low power" if result["awake_pct"] < 100.0 else "LOW_POWER_ENABLED off"))
+    print("  relay sequence digest %s" % result["digest"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# Sweep the controller's tuning constants over a grid
+#
+# Runs simulate.py's simulation - the real controller, decisions and all, in room.py's room - for every combination
+# of the constants below, spread over a pool of processes (one per core by default).  Each combination reports:
+#   in_band_pct         % of the time RH was between the LOW threshold and the ON threshold plus the debounce
+#   rh_sd               standard deviation of the RH - how tightly it was held
+#   switches            relay switches, all outlets
+#   hours_per_refill    hours between tank refills - NaN if the tanks were not refilled
+#   energized_hours     hours the outlets were energized, all outlets - how fast the tanks drained
+#   overshoot_rh        how far RH went above the ON threshold plus the debounce
+#
+# The results are written as columns (one array per parameter and result) to a NumPy .npz file, and the best
+# combinations are printed.  Load them with numpy.load().
+#
+#   python host/sweep.py [--days 3] [--on-rh 54,56,58] [--debounce 0.25,0.5,1] ... [--volume-m3 60] [--out sweep.npz]
+
+import argparse
+import itertools
+import multiprocessing
+import os
+import shutil
+import time
+
+import numpy as np
+
+import simulate
+
+# parameter -> (config constant, default values swept).  WARN_PCT and ERROR_PCT are swept together as warn/error.
+PARAMETERS = [
+    ("on_rh",           "DEFAULT_ON_RH",        "54,56,58"),
+    ("low_rh",          "DEFAULT_LOW_RH",       "48,50"),
+    ("debounce",        "DEBOUNCE_RH_AMOUNT",   "0.25,0.5,1"),
+    ("switch_pct",      "SWITCH_PCT",           "10"),
+    ("warn_error_pct",  None,                   "30/10"),
+    ("rh_update_secs",  "RH_UPDATE_SECS",       "60,300"),
+    ("control_mode",    "CONTROL_MODE",         "bang,duty"),
+]
+
+RESULTS = [ "in_band_pct", "rh_sd", "switches", "hours_per_refill", "energized_hours", "overshoot_rh", "min_rh",
+            "max_rh", "reset", "elapsed" ]
+
+
+#
+# Run one combination in a pool process
+#   job     (days, start_rh, room volume, parameter values in PARAMETERS order)
+#
+def run_combination(job):
+    days, start_rh, volume_m3, values = job
+    overrides = {}
+    for (name, constant, default), value in zip(PARAMETERS, values):
+        if name == "warn_error_pct":
+            overrides["WARN_PCT"], overrides["ERROR_PCT"] = value
+        else:
+            overrides[constant] = value
+    result = simulate.simulate(days, start_rh, overrides, { "volume_m3" : volume_m3 })
+    shutil.rmtree(result["flash_dir"], ignore_errors=True)
+    # no refills is not a refill interval - NaN keeps it a float column without ranking as one
+    hours_per_refill = result["hours_per_refill"] if result["hours_per_refill"] is not None else np.nan
+    return values, [ result["in_band_pct"], result["rh_sd"], sum(result["switch_counts"]), hours_per_refill,
+                     sum(result["energized_hours"]), result["overshoot_rh"], result["min_rh"], result["max_rh"],
+                     result["reset"] is not None, result["elapsed"] ]
+
+
+def parse_values(name, text):
+    if name == "warn_error_pct":
+        return [ tuple(float(pct) for pct in pair.split("/")) for pair in text.split(",") ]
+    if name == "rh_update_secs":
+        return [ int(value) for value in text.split(",") ]
+    if name == "control_mode":
+        return text.split(",")
+    return [ float(value) for value in text.split(",") ]
+
+
+#
+# Whether a combination makes sense - the LOW threshold must be below ON, and ERROR below WARN
+#
+def valid_combination(values):
+    named = dict(zip([ parameter[0] for parameter in PARAMETERS ], values))
+    return named["low_rh"] < named["on_rh"] and named["warn_error_pct"][1] < named["warn_error_pct"][0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep the controller's tuning constants in simulated rooms")
+    parser.add_argument("--days", type=float, default=3, help="how many days to simulate each combination")
+    parser.add_argument("--start-rh", type=float, default=45.0, help="the room's RH at the start")
+    parser.add_argument("--volume-m3", type=float, default=60.0, help="the room's volume - small rooms overshoot more")
+    for name, constant, default in PARAMETERS:
+        parser.add_argument("--" + name.replace("_", "-"), default=default,
+                            help="comma separated values to sweep (default %s)" % default)
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="processes to run (default: one per core)")
+    parser.add_argument("--out", default="sweep.npz", help="results file")
+    parser.add_argument("--top", type=int, default=10, help="how many of the best combinations to print")
+    args = parser.parse_args()
+
+    grid = [ parse_values(name, getattr(args, name)) for name, constant, default in PARAMETERS ]
+    combinations = [ values for values in itertools.product(*grid) if valid_combination(values) ]
+    jobs = [ (args.days, args.start_rh, args.volume_m3, values) for values in combinations ]
+    print("%d combinations of %.1f days on %d processes" % (len(jobs), args.days, args.jobs))
+
+    start = time.monotonic()
+    rows = []
+    with multiprocessing.Pool(args.jobs) as pool:
+        for i, row in enumerate(pool.imap_unordered(run_combination, jobs)):
+            rows.append(row)
+            print("\r  %d/%d" % (i + 1, len(jobs)), end="", flush=True)
+    elapsed = time.monotonic() - start
+    print("\n%d combinations in %.1f s, %.1f simulated days per second" % (len(rows), elapsed,
+                                                                          len(rows) * args.days / elapsed))
+
+    # keep the grid's order whatever order the pool finished in
+    rows.sort(key=lambda row: combinations.index(row[0]))
+    columns = {}
+    for i, (name, constant, default) in enumerate(PARAMETERS):
+        if name == "warn_error_pct":
+            columns["warn_pct"] = np.array([ values[i][0] for values, results in rows ])
+            columns["error_pct"] = np.array([ values[i][1] for values, results in rows ])
+        else:
+            columns[name] = np.array([ values[i] for values, results in rows ])
+    for i, name in enumerate(RESULTS):
+        columns[name] = np.array([ results[i] for values, results in rows ])
+    np.savez_compressed(args.out, **columns)
+    print("results in %s" % args.out)
+
+    # best: most time in band, then fewest relay switches
+    order = np.lexsort((columns["switches"], -columns["in_band_pct"]))
+    print("  on_rh low_rh debounce switch warn/error rh_secs mode | in_band rh_sd switches refill_h energized overshoot")
+    for row in order[:args.top]:
+        refill = columns["hours_per_refill"][row]
+        print("  %5.1f %6.1f %8.2f %6.0f %5.0f/%-4.0f %7d %4s | %6.1f%% %5.2f %8d %8s %9.1f %9.2f%s"
+              % (columns["on_rh"][row], columns["low_rh"][row], columns["debounce"][row], columns["switch_pct"][row],
+                 columns["warn_pct"][row], columns["error_pct"][row], columns["rh_update_secs"][row],
+                 columns["control_mode"][row], columns["in_band_pct"][row], columns["rh_sd"][row],
+                 columns["switches"][row], "-" if np.isnan(refill) else "%.1f" % refill, columns["energized_hours"][row],
+                 columns["overshoot_rh"][row], "  RESET" if columns["reset"][row] else ""))
+
+
+if __name__ == "__main__":
+    main()
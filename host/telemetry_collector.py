@@ -0,0 +1,210 @@
+# Collect the controller's telemetry
+#
+# Reads the binary telemetry frames the controller sends on USB serial (TELEMETRY_ENABLED - see
+# controller/telemetry.py) and appends each one to a CSV time series, one row per frame.  The console text around the
+# frames - log messages, the REPL - is passed through to stdout.  Frames with a bad CRC are skipped, and gaps in the
+# sequence numbers are counted as frames the controller dropped.
+#
+# Run with host Python:
+#   python host/telemetry_collector.py /dev/ttyACM0 [--out telemetry.csv]
+# or, with no Pico, against a pseudo-terminal stand-in - simulate.py runs the controller on a virtual clock with its
+# console on the pty, sending a frame every virtual TELEMETRY_SECS, and the collector reads the other end:
+#   python host/telemetry_collector.py --stand-in [--days 0.5] [--out telemetry.csv] [--set NAME=VALUE ...]
+# The simulation runs far faster than real time, so the stand-in also shows the controller dropping the frames the pty
+# has no room for rather than waiting.
+
+import argparse
+import asyncio
+import csv
+import errno
+import os
+import struct
+import sys
+import tempfile
+import time
+import tty
+
+import hal
+
+READ_BYTES = 4096
+
+
+#
+# Splits the bytes read from the port into telemetry frames and console text
+#
+class TelemetryParser:
+    def __init__(self, telemetry):
+        self.telemetry = telemetry
+        self.buffer = bytearray()
+        self.frames = 0
+        self.bad_frames = 0
+        self.dropped = 0
+        self.last_sequence = None
+
+    #
+    # Add bytes read from the port.  Returns (frames, text) - the frames as dicts, in order, and the text between them.
+    # The end of the bytes may be the start of a frame - it is kept for the next call.
+    #
+    def feed(self, data):
+        t = self.telemetry
+        self.buffer.extend(data)
+        frames = []
+        text = bytearray()
+        while True:
+            start = self.buffer.find(t.TELEMETRY_SYNC)
+            if start < 0:
+                # keep a last byte that may be the start of the sync
+                keep = 1 if self.buffer[-1:] == t.TELEMETRY_SYNC[:1] else 0
+                text.extend(self.buffer[:len(self.buffer) - keep])
+                del self.buffer[:len(self.buffer) - keep]
+                break
+            text.extend(self.buffer[:start])
+            del self.buffer[:start]
+            if len(self.buffer) < t.HEADER_OFFSET:
+                break
+            length = self.buffer[len(t.TELEMETRY_SYNC)]
+            if length != t.CRC_OFFSET - t.HEADER_OFFSET:
+                # not a frame this collector knows - pass the sync byte on as text and look again
+                text.extend(self.buffer[:1])
+                del self.buffer[:1]
+                continue
+            if len(self.buffer) <= t.CRC_OFFSET:
+                break
+            payload = bytes(self.buffer[t.HEADER_OFFSET:t.CRC_OFFSET])
+            if hal.crc8(payload) != self.buffer[t.CRC_OFFSET]:
+                self.bad_frames = self.bad_frames + 1
+                text.extend(self.buffer[:1])
+                del self.buffer[:1]
+                continue
+            frames.append(self.unpack(bytes(self.buffer[:t.CRC_OFFSET + 1])))
+            del self.buffer[:t.CRC_OFFSET + 1]
+        return frames, bytes(text)
+
+    #
+    # Unpack a whole frame into a dict of its values, in their units
+    #
+    def unpack(self, data):
+        t = self.telemetry
+        version, sequence, secs = struct.unpack_from(t.TELEMETRY_HEADER, data, t.HEADER_OFFSET)
+        rh, temperature, dew_point, absolute, rate, trend = struct.unpack_from(t.TELEMETRY_READING, data, t.READING_OFFSET)
+        humidifying, flags, outlets = struct.unpack_from(t.TELEMETRY_STATE, data, t.STATE_OFFSET)
+        values = { "version" : version, "sequence" : sequence, "time" : secs, "rh" : rh / 100,
+                   "temperature" : temperature / 100, "dew_point" : dew_point / 100, "absolute_humidity" : absolute / 100,
+                   "rate" : rate / 100, "trend" : trend, "humidifying" : t.TELEMETRY_HUMIDIFYING[humidifying],
+                   "failsafe" : int(bool(flags & t.TELEMETRY_FLAG_FAILSAFE)),
+                   "stale" : int(bool(flags & t.TELEMETRY_FLAG_STALE)),
+                   "failing" : int(bool(flags & t.TELEMETRY_FLAG_FAILING)) }
+        for i in range(outlets):
+            state, used_pct = struct.unpack_from(t.TELEMETRY_OUTLET, data, t.OUTLET_OFFSET + i * t.OUTLET_SIZE)
+            values["outlet%d_setting" % i] = t.TELEMETRY_SETTINGS[state & ~t.TELEMETRY_ENERGIZED]
+            values["outlet%d_energized" % i] = int(bool(state & t.TELEMETRY_ENERGIZED))
+            values["outlet%d_used_pct" % i] = used_pct
+        (values["loops"], values["allocating_loops"], values["max_loop_alloc"], values["max_loop_us"],
+         values["max_gc_pause_us"], values["mem_free"]) = struct.unpack_from(t.TELEMETRY_LOOP, data, t.LOOP_OFFSET)
+
+        self.frames = self.frames + 1
+        if self.last_sequence is not None:
+            self.dropped = self.dropped + ((sequence - self.last_sequence - 1) & 0xffff)
+        self.last_sequence = sequence
+        return values
+
+
+#
+# Read the port until it closes, appending the frames to a CSV file
+#   fd          the port, open for reading
+#   out_path    CSV file - the header is written when it is new
+#   parser      a TelemetryParser, which counts the frames
+#   echo        pass the console text through to stdout
+#
+async def collect(fd, out_path, parser, echo=True):
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(fd, "rb", buffering=0))
+    new = not os.path.exists(out_path) or os.path.getsize(out_path) == 0
+    with open(out_path, "a", newline="") as f:
+        writer = None
+        while True:
+            try:
+                data = await reader.read(READ_BYTES)
+            except OSError as err:
+                # a pty reads EIO once the other end has closed
+                if err.errno != errno.EIO:
+                    raise
+                data = b""
+            if not data:
+                break
+            frames, text = parser.feed(data)
+            if echo and text:
+                sys.stdout.write(text.decode("utf-8", "replace"))
+                sys.stdout.flush()
+            for values in frames:
+                if writer is None:
+                    writer = csv.DictWriter(f, [ "host_time" ] + list(values))
+                    if new:
+                        writer.writeheader()
+                writer.writerow(dict(host_time="%.3f" % time.time(), **values))
+            f.flush()
+
+
+#
+# Open a serial port for collecting - raw, so no byte of a frame is translated
+#
+def open_port(path):
+    fd = os.open(path, os.O_RDONLY | os.O_NOCTTY | os.O_NONBLOCK)
+    tty.setraw(fd)
+    return fd
+
+
+#
+# Collect from simulate.py's controller with its console on a pty.  Returns simulate.py's exit status.
+#
+async def collect_stand_in(days, settings, out_path, parser, echo=True):
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    command = [ sys.executable, "-u", os.path.join(hal.HOST_DIR, "simulate.py"), "--days", str(days),
+                "--set", "TELEMETRY_ENABLED=True" ]
+    for setting in settings:
+        command.extend([ "--set", setting ])
+    process = await asyncio.create_subprocess_exec(*command, stdin=asyncio.subprocess.DEVNULL, stdout=slave)
+    # only the simulation holds the pty's other end now, so it closes when the simulation ends
+    os.close(slave)
+    await collect(master, out_path, parser, echo)
+    return await process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collect the controller's telemetry from USB serial into a CSV file")
+    parser.add_argument("port", nargs="?", help="the Pico's USB serial port, e.g. /dev/ttyACM0")
+    parser.add_argument("--out", default="telemetry.csv", help="CSV file to append the frames to")
+    parser.add_argument("--quiet", action="store_true", help="do not pass the console text through")
+    parser.add_argument("--stand-in", action="store_true", help="collect from a simulated controller on a pty")
+    parser.add_argument("--days", type=float, default=0.5, help="with --stand-in, how many days to simulate")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help="with --stand-in, override a constant in controller/config.py for the simulation")
+    args = parser.parse_args()
+    if args.stand_in == (args.port is not None):
+        parser.error("give a port or --stand-in")
+
+    out_path = os.path.abspath(args.out)
+    port = os.path.abspath(args.port) if args.port else None
+    # the frame layout comes from the controller itself
+    hal.install(tempfile.mkdtemp(prefix="humidifier-telemetry-"))
+    from controller import telemetry
+
+    result = TelemetryParser(telemetry)
+    status = 0
+    try:
+        if args.stand_in:
+            status = asyncio.run(collect_stand_in(args.days, args.set, out_path, result, not args.quiet))
+        else:
+            asyncio.run(collect(open_port(port), out_path, result, not args.quiet))
+    except KeyboardInterrupt:
+        pass
+    print("%d frames to %s, %d dropped by the controller, %d with a bad CRC"
+          % (result.frames, out_path, result.dropped, result.bad_frames))
+    if status:
+        sys.exit("simulate.py exited with status %d" % status)
+
+
+if __name__ == "__main__":
+    main()
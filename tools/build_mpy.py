@@ -0,0 +1,93 @@
+# Build the controller for the Pico
+#
+# Precompiles the controller package to .mpy files with mpy-cross, so the Pico does not compile ~2000 lines of
+# source at every power-up.  The output in build/ is copied to the Pico as is:
+#   build/main.py               the entry point (humidifiers.py)
+#   build/controller/*.mpy      the precompiled controller package
+#
+# With --frozen it also writes build/manifest.py, for freezing the controller into a firmware build.  The display
+# needs Pimoroni's MicroPython build, so include() the manifest from that build's board manifest (or pass it as
+# FROZEN_MANIFEST).  A firmware with the controller frozen in only needs build/main.py copied to the Pico.
+#
+# Run from anywhere with host Python:
+#   python tools/build_mpy.py [--frozen] [--mpy-cross PATH]
+#
+# mpy-cross must match the MicroPython version on the Pico - "pip install mpy-cross==<version>" or build it
+# from the MicroPython source tree.
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = "controller"
+ENTRY_POINT = "humidifiers.py"
+BUILD_DIR = os.path.join(REPO_DIR, "build")
+MPY_CROSS_ARCH = "armv6m"           # RP2040 Cortex-M0+
+
+
+#
+# Find the mpy-cross command - an explicit path, the mpy-cross executable or the mpy_cross python package
+#
+def find_mpy_cross(path):
+    if path:
+        return [ path ]
+    if shutil.which("mpy-cross"):
+        return [ "mpy-cross" ]
+    try:
+        import mpy_cross
+        return [ sys.executable, "-m", "mpy_cross" ]
+    except ImportError:
+        sys.exit("mpy-cross not found.  Install it with \"pip install mpy-cross\" or pass --mpy-cross PATH")
+
+
+#
+# Precompile every module in the controller package into build/controller
+#
+def build_package(mpy_cross):
+    package_dir = os.path.join(REPO_DIR, PACKAGE)
+    out_dir = os.path.join(BUILD_DIR, PACKAGE)
+    os.makedirs(out_dir, exist_ok=True)
+    for name in sorted(os.listdir(package_dir)):
+        if not name.endswith(".py"):
+            continue
+        source = os.path.join(package_dir, name)
+        output = os.path.join(out_dir, name[:-3] + ".mpy")
+        # -s sets the source name shown in tracebacks to the module path on the Pico
+        subprocess.run(mpy_cross + [ "-march=" + MPY_CROSS_ARCH, "-s", PACKAGE + "/" + name, "-o", output, source ], check=True)
+        print("%-28s %6d bytes -> %6d bytes" % (PACKAGE + "/" + name, os.path.getsize(source), os.path.getsize(output)))
+
+
+#
+# Write a manifest for freezing the controller package into firmware
+#
+def write_manifest():
+    manifest = os.path.join(BUILD_DIR, "manifest.py")
+    with open(manifest, "w") as f:
+        f.write("# Generated by tools/build_mpy.py - freezes the humidifier controller into the firmware\n")
+        f.write("include(\"$(PORT_DIR)/boards/manifest.py\")\n")
+        f.write("package(\"%s\", base_path=\"%s\")\n" % (PACKAGE, REPO_DIR))
+    print("wrote %s" % manifest)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompile the humidifier controller for the Pico")
+    parser.add_argument("--frozen", action="store_true", help="also write build/manifest.py for a frozen firmware build")
+    parser.add_argument("--mpy-cross", help="path to the mpy-cross executable")
+    args = parser.parse_args()
+
+    if os.path.isdir(BUILD_DIR):
+        shutil.rmtree(BUILD_DIR)
+    os.makedirs(BUILD_DIR)
+
+    build_package(find_mpy_cross(args.mpy_cross))
+    shutil.copy(os.path.join(REPO_DIR, ENTRY_POINT), os.path.join(BUILD_DIR, "main.py"))
+    print("%-28s copied to main.py" % ENTRY_POINT)
+    if args.frozen:
+        write_manifest()
+
+
+if __name__ == "__main__":
+    main()